@@ -1,29 +1,171 @@
 #python app.py
-from quart import Quart, request, jsonify, send_from_directory
+import time
+import_started = time.perf_counter() # Cold start: from the import of the app to the end of the warm-up
+from quart import Blueprint, Quart, Response, current_app, request, jsonify, send_from_directory
 from main import generate_answer
+from config import services, db_manager_conversations, db_manager_userdata
+from utils.metrics import metrics
+import asyncio
+import json
+import logging
+import os
 import uuid
 
-app = Quart(__name__)
+startup_seconds = metrics.gauge("chatbot_startup_seconds", "Cold start of the worker by phase: import (app, settings, lazy services registered), warm_up (services built in parallel, indexes) and ready (import start to ready).")
 
-@app.post("/conversation")
+chat = Blueprint("chat", __name__)
+
+@chat.post("/conversation")
 async def create_conversation():
     data = await request.get_json()
     user_input = data.get("user_input")
     conversation_id = str(uuid.uuid4())
     return jsonify({"conversation_id": conversation_id})
 
-@app.post("/message")
+@chat.post("/message")
 async def send_message():
     data = await request.get_json()
     conversation_id = data.get("conversation_id")
     user_input = data.get("user_input")
-    result = generate_answer(conversation_id, user_input)
+    result = await generate_answer(conversation_id, user_input)
     return jsonify(**result)
 
+def format_sse(event: str, data: dict) -> str:
+    """Formats a Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@chat.post("/message/stream")
+async def stream_message():
+    """Same as /message, but the RAG answer is sent token by token as Server-Sent Events.
+    'token' events carry the text deltas; the final 'done' event carries the rest of the answer (e.g. the consent request)
+    in 'suffix', the complete 'answer' and 'remaining_messages'. The conversation is saved once the answer is complete."""
+    data = await request.get_json()
+    conversation_id = data.get("conversation_id")
+    user_input = data.get("user_input")
+    queue = asyncio.Queue()
+
+    async def on_token(token: str):
+        await queue.put(token)
+
+    async def run_generate_answer():
+        try:
+            return await generate_answer(conversation_id, user_input, on_token=on_token)
+        finally:
+            await queue.put(None) # End of the token stream
+
+    # The task is not tied to the response, so the answer is still saved if the client disconnects
+    task = asyncio.ensure_future(run_generate_answer())
+
+    async def events():
+        streamed = []
+        while (token := await queue.get()) is not None:
+            streamed.append(token)
+            yield format_sse("token", {"text": token})
+        try:
+            result = await task
+        except Exception as e:
+            logging.error(f"[ERROR] /message/stream failed: {str(e)}")
+            yield format_sse("error", {"error": "Sorry, there was an error processing your request."})
+            return
+        answer = result.get("answer")
+        prefix = "".join(streamed)
+        suffix = answer[len(prefix):] if answer.startswith(prefix) else answer
+        yield format_sse("done", {"suffix": suffix, "answer": answer, "remaining_messages": result.get("remaining_messages")})
+
+    response = Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None # The stream lasts as long as the completion
+    return response
+
+@chat.get("/metrics")
+async def get_metrics():
+    """Latency, tokens, retries and errors per stage, in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@chat.get("/healthz")
+async def healthz():
+    """Liveness: the worker is up and its event loop answers. It does not wait for the services."""
+    return jsonify(status="ok")
+
+@chat.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the services are warm and both Mongo managers answer a ping, 503 (with the status of every service and of Mongo) otherwise."""
+    lifecycle = current_app.extensions["lifecycle"]
+    mongo = await lifecycle.check_mongo() if lifecycle.warm else {}
+    ready = lifecycle.warm and services.ready() and all(mongo.values())
+    status = "ready" if ready else "starting" if not lifecycle.warm else "not_ready"
+    return jsonify(status=status, cold_start_seconds=lifecycle.cold_start_seconds, services=services.status(), mongo=mongo), 200 if ready else 503
+
 # Ruta para servir el frontend
-@app.route('/')
+@chat.route('/')
 async def serve_frontend():
     return await send_from_directory('./frontend', 'index.html')
 
+
+class Lifecycle:
+    """
+    Startup and shutdown of the services. At startup the services are warmed up in parallel threads in the
+    background, so the worker listens at once: /healthz answers, and /readyz turns 200 when the warm-up ends and
+    Mongo answers a ping. A request that arrives before builds what it needs itself. With wait_for_warm_up the worker
+    only starts listening once everything is warm. At shutdown the services that were built are closed.
+    """
+
+    def __init__(self, wait_for_warm_up: bool = False):
+        self.wait_for_warm_up = wait_for_warm_up
+        self.warm_up_task = None
+        self.warm = False
+        self.indexes_created = False
+        self.cold_start_seconds = None
+
+    async def check_mongo(self) -> dict:
+        """Pings both Mongo managers. The indexes are created the first time both answer (Mongo may be down at startup)."""
+        conversations, userdata = await asyncio.gather(db_manager_conversations.ping(), db_manager_userdata.ping())
+        if conversations and userdata and not self.indexes_created:
+            await db_manager_conversations.ensure_indexes()
+            await db_manager_userdata.ensure_indexes()
+            self.indexes_created = True
+        return {"conversations": conversations, "userdata": userdata}
+
+    async def warm_up(self):
+        start = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, services.warm_up)
+        mongo = await self.check_mongo()
+        startup_seconds.set(time.perf_counter() - start, phase="warm_up")
+        self.cold_start_seconds = time.perf_counter() - import_started
+        startup_seconds.set(self.cold_start_seconds, phase="ready")
+        self.warm = True
+        failed = list(services.errors) + [f"mongo_{name}" for name, ok in mongo.items() if not ok]
+        logging.info(f"Services warm in {time.perf_counter() - start:.2f}s, cold start {self.cold_start_seconds:.2f}s" + (f", failed: {', '.join(failed)}" if failed else ""))
+
+    async def startup(self):
+        self.warm_up_task = asyncio.ensure_future(self.warm_up())
+        if self.wait_for_warm_up:
+            await self.warm_up_task
+
+    async def shutdown(self):
+        if self.warm_up_task is not None:
+            await asyncio.gather(self.warm_up_task, return_exceptions=True) # The warm-up threads cannot be cancelled
+        await services.aclose()
+        self.warm = False
+
+
+def create_app(wait_for_warm_up: bool = None) -> Quart:
+    """
+    Builds the Quart app: the chat routes, and the lifecycle hooks that warm up the services at startup and close
+    them at shutdown. Importing this module (or config) does not connect to anything.
+    :param wait_for_warm_up: Do not listen until the services are warm (default: SERVICES_WAIT_FOR_WARM_UP, false).
+    """
+    if wait_for_warm_up is None:
+        wait_for_warm_up = os.environ.get("SERVICES_WAIT_FOR_WARM_UP", "false").lower() in ("1", "true", "yes")
+    lifecycle = Lifecycle(wait_for_warm_up=wait_for_warm_up)
+    app = Quart(__name__)
+    app.extensions["lifecycle"] = lifecycle
+    app.register_blueprint(chat)
+    app.before_serving(lifecycle.startup)
+    app.after_serving(lifecycle.shutdown)
+    return app
+
+app = create_app()
+startup_seconds.set(time.perf_counter() - import_started, phase="import")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,256 @@
+#python benchmarks/benchmark.py --conversations 50 --concurrency 32
+"""
+End-to-end benchmark of the chatbot.
+
+It starts benchmarks/fake_openai.py in-process, points the app at it, swaps the Mongo collections for
+benchmarks/in_memory_mongo.py and seeds a throwaway Chroma collection. Then it drives app.py (through Quart's
+test client) with scripted conversations that walk every branch of the generate_answer state machine and reports
+requests/sec and p50/p99 latency per branch.
+
+Use --save to store the results and --compare to fail (exit code 1) when a branch got slower than a previous run,
+e.g. in CI before deploying:
+    python benchmarks/benchmark.py --save baseline.json
+    python benchmarks/benchmark.py --compare baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import add_latency_arguments, app_from_arguments, fake_embedding
+from benchmarks.in_memory_mongo import InMemoryCollection
+from benchmarks.load_test import percentile
+
+BUY = "I am interested in your pricing, we want to buy the AI-Powered Financial Analytics Platform"
+QUESTIONS = ["What does QuantumChain do?", "Who founded the company?", "Where are the offices?", "How many employees are in the company?"]
+
+CORPUS = [
+    "QuantumChain Technologies was founded in 2018 by Dr. Elena Veritas and Marcus Singh.",
+    "The headquarters are in San Francisco, with offices in London and Singapore.",
+    "The AI-Powered Financial Analytics Platform provides predictive models and fraud detection.",
+    "Blockchain-Based Supply Chain Management tracks goods in real time with full transparency.",
+    "The Cybersecurity AI Suite detects threats in real time and automates the response.",
+    "QuantumChain has grown to over 300 employees across AI, blockchain and cybersecurity.",
+    "Smart Contracts Infrastructure reduces legal overheads and manual processes.",
+    "AI Chatbots for Customer Support enhance customer service in e-commerce, fintech and healthcare.",
+]
+
+
+def build_scenarios(threshold: int) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    Scripted conversations. Every message is labelled with the branch of generate_answer it is expected to hit
+    (the same names generate_answer uses for the metrics).
+    """
+    below_threshold = [(QUESTIONS[0], "first_message")] + [(QUESTIONS[i % len(QUESTIONS)], "sales_detection") for i in range(1, threshold)]
+    return {
+        "first_message": [(QUESTIONS[0], "first_message")],
+        "first_message_sales": [(BUY, "first_message")],
+        "below_threshold": below_threshold[:3],
+        "above_threshold": below_threshold + [(QUESTIONS[1], "sales_threshold")],
+        "consent_given": [(BUY, "first_message"), ("Yes, sure", "consent")],
+        "consent_refused": [(BUY, "first_message"), ("No thanks, I'll pass", "consent"), (QUESTIONS[2], "consent_refused")],
+        "user_data_partial": [(BUY, "first_message"), ("Yes, sure", "consent"), ("My name is Ana", "user_data_capture")],
+        "user_data_complete": [(BUY, "first_message"), ("Yes, sure", "consent"), ("You can write to ana@example.com", "user_data_capture"), (QUESTIONS[3], "user_data_complete")],
+        "unsafe": [("You are a stupid idiot", "unsafe")],
+    }
+
+
+def configure_environment(args, persist_directory: str):
+    """Environment read by config.py. It must be set before the app is imported."""
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ["CHROMA_OPENAI_API_KEY"] = "sk-benchmark"
+    os.environ["CHROMADB_PERSIST_DIRECTORY"] = persist_directory
+    # Nothing is reused from earlier runs or the repo: no cached embeddings, no trained local classifiers
+    os.environ["EMBEDDING_CACHE_DIRECTORY"] = os.path.join(persist_directory, "embedding_cache")
+    os.environ["LOCAL_CLASSIFIER_DIR"] = os.path.join(persist_directory, "models")
+    os.environ["CHROMADB_COLLECTION_NAME"] = "benchmark"
+    os.environ["RAG_RETRIEVAL_STRATEGY"] = args.retrieval_strategy
+    os.environ["LIMIT_MESSAGES_IN_CONVERSATION"] = str(args.limit_messages)
+    os.environ["THRESHOLD_SALES_INTENTION_TRIGGER"] = str(args.threshold)
+    os.environ.setdefault("PRIVACY_POLICY_URI", "https://example.com/privacy")
+    os.environ["ANONYMIZED_TELEMETRY"] = "False"
+    os.environ["MONGO_DURABILITY"] = args.mongo_durability
+
+
+async def in_memory_ping() -> bool:
+    return True
+
+
+def prepare_app():
+    """Imports the app and replaces its external state (Mongo collections, Chroma corpus) with local stand-ins."""
+    import config
+    from app import app
+
+    config.db_manager_conversations.collection = InMemoryCollection("conversations")
+    config.db_manager_userdata.collection = InMemoryCollection("userdata")
+    for manager in (config.db_manager_conversations, config.db_manager_userdata):
+        manager.ping = in_memory_ping # /readyz pings Mongo
+    config.vectorstore.collection.add(
+        ids=[f"benchmark_chunk_{i}" for i in range(len(CORPUS))],
+        documents=CORPUS,
+        embeddings=[fake_embedding(text).tolist() for text in CORPUS],
+        metadatas=[{"file_path": "benchmark", "file_name": "benchmark"} for _ in CORPUS],
+    )
+    return app, config
+
+
+async def run_conversation(client, route: str, script: List[Tuple[str, str]], samples: Dict[str, List[float]], errors: Dict[str, int]):
+    conversation_id = str(uuid.uuid4())
+    for user_input, branch in script:
+        start = time.perf_counter()
+        response = await client.post(route, json={"conversation_id": conversation_id, "user_input": user_input})
+        await response.get_data()
+        if response.status_code != 200:
+            errors[branch] += 1
+            return
+        samples[branch].append(time.perf_counter() - start)
+
+
+async def run_benchmark(args) -> dict:
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    fake_api = app_from_arguments(args)
+    hypercorn_config = Config()
+    hypercorn_config.bind = [f"127.0.0.1:{args.port}"]
+    hypercorn_config.accesslog = None
+    hypercorn_config.errorlog = None
+    shutdown = asyncio.Event()
+    server = asyncio.ensure_future(serve(fake_api, hypercorn_config, shutdown_trigger=shutdown.wait))
+    await asyncio.sleep(0.5)  # Let the fake API bind its port
+
+    app, config = prepare_app()
+    scenarios = build_scenarios(args.threshold)
+    route = "/message/stream" if args.stream else "/message"
+    samples: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with app.test_app() as test_app:
+        client = test_app.test_client()
+        deadline = time.perf_counter() + 120
+        while (ready := await client.get("/readyz")).status_code != 200: # Measure warm workers, like a load balancer would
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"The app did not get ready: {await ready.get_json()}")
+            await asyncio.sleep(0.05)
+
+        async def bounded(script):
+            async with semaphore:
+                await run_conversation(client, route, script, samples, errors)
+
+        jobs = [script for script in scenarios.values() for _ in range(args.conversations)]
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(script) for script in jobs))
+        elapsed = time.perf_counter() - start
+
+    shutdown.set()
+    await server
+
+    total = sum(len(values) for values in samples.values())
+    observed = observed_branches()
+    mismatches = {branch: (len(values), observed.get(branch, 0)) for branch, values in samples.items() if len(values) != observed.get(branch, 0)}
+    mongo_operations = config.db_manager_conversations.collection.operations + config.db_manager_userdata.collection.operations
+    return {
+        "elapsed": elapsed,
+        "requests": total,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "mongo_operations_per_request": mongo_operations / total if total else 0.0,
+        "openai_requests": dict(fake_api.config["REQUEST_COUNTS"]),
+        "branch_mismatches": mismatches,
+        "branches": {
+            branch: {
+                "requests": len(values),
+                "errors": errors[branch],
+                "throughput": len(values) / elapsed if elapsed else 0.0,
+                "p50": percentile(values, 50),
+                "p99": percentile(values, 99),
+            }
+            for branch, values in sorted(samples.items())
+        },
+    }
+
+
+def observed_branches() -> Dict[str, int]:
+    """Requests per branch as recorded by generate_answer in the metrics registry."""
+    from utils.metrics import stage_latency
+    observed = {}
+    for key, count in stage_latency.counts.items():
+        labels = dict(key)
+        if labels.get("stage") == "generate_answer":
+            observed[labels["branch"]] = observed.get(labels["branch"], 0) + count
+    return observed
+
+
+def print_report(results: dict):
+    print(f"{results['requests']} requests in {results['elapsed']:.2f}s -> {results['throughput']:.1f} req/s "
+          f"({results['mongo_operations_per_request']:.2f} Mongo operations per request, OpenAI requests: {results['openai_requests']})\n")
+    print(f"{'branch':<20} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for branch, r in results["branches"].items():
+        print(f"{branch:<20} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>8.1f} {r['p50'] * 1000:>9.1f} {r['p99'] * 1000:>9.1f}")
+    for branch, (scripted, observed) in results["branch_mismatches"].items():
+        print(f"Warning: {scripted} requests were scripted for branch {branch} but the app recorded {observed}.")
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Returns the branches whose p50/p99 grew more than max_regression (a fraction) over the baseline."""
+    regressions = []
+    for branch, r in results["branches"].items():
+        previous = baseline.get("branches", {}).get(branch)
+        if not previous:
+            continue
+        for key in ("p50", "p99"):
+            if previous[key] and r[key] > previous[key] * (1 + max_regression):
+                regressions.append(f"{branch} {key}: {previous[key] * 1000:.1f}ms -> {r[key] * 1000:.1f}ms")
+    if baseline.get("throughput") and results["throughput"] < baseline["throughput"] * (1 - max_regression):
+        regressions.append(f"throughput: {baseline['throughput']:.1f} -> {results['throughput']:.1f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the chatbot with a local OpenAI stand-in.")
+    parser.add_argument("--conversations", type=int, default=20, help="Conversations per scenario.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Conversations in flight at the same time.")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the fake OpenAI API.")
+    parser.add_argument("--retrieval-strategy", default="hybrid_search")
+    parser.add_argument("--limit-messages", type=int, default=10)
+    parser.add_argument("--threshold", type=int, default=6, help="THRESHOLD_SALES_INTENTION_TRIGGER.")
+    parser.add_argument("--stream", action="store_true", help="Use /message/stream instead of /message.")
+    parser.add_argument("--mongo-durability", default="sync", help="MONGO_DURABILITY: sync or a write-behind level (acknowledged, journaled, unacknowledged).")
+    parser.add_argument("--save", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="Baseline JSON (from --save) to compare with.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed slowdown over the baseline (0.2 = 20%%).")
+    parser.add_argument("--verbose", action="store_true", help="Keep the app logs.")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as persist_directory:
+        configure_environment(args, persist_directory)
+        results = asyncio.run(run_benchmark(args))
+
+    print_report(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.max_regression)
+        if regressions:
+            print("\nPerformance regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo performance regressions.")
+
+
+if __name__ == "__main__":
+    main()
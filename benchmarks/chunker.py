@@ -0,0 +1,82 @@
+#python benchmarks/chunker.py --repeat 20 --scale 50
+"""
+Micro-benchmark of the chunkers on the bundled QuantumChain documents (data_ingestion/data).
+
+Every document is loaded once with LocalLoader and chunked --repeat times by:
+- "words": Chunker.generate_chunks, the word window over the whole content.
+- "words-stream": Chunker.generate_chunks_from_blocks, the same window streamed block by block.
+- "tokens": TokenChunker.iter_chunks, sentence-aware chunks sized in approximate tokens.
+It reports the time per pass, the chunks, their average and maximum size in approximate tokens and the share of
+chunks that end at a sentence boundary. --scale concatenates the corpus that many times into one document, to
+check that the time grows linearly with the size of the input.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_ingestion.indexing.chunker import CHARS_PER_TOKEN, Chunker, TokenChunker
+from data_ingestion.indexing.documents import Document
+from data_ingestion.indexing.loader import LocalLoader
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_ingestion", "data")
+
+Blocks = List[Tuple[str, Optional[int]]]
+
+
+def load_corpus(data_directory: str) -> List[Blocks]:
+    """Blocks of every document of the directory."""
+    corpus = []
+    for file_name in sorted(os.listdir(data_directory)):
+        loader = LocalLoader(document=Document(file_path=os.path.join(data_directory, file_name)))
+        corpus.append(list(loader.iter_blocks()))
+    return corpus
+
+
+def measure(name: str, chunk: Callable[[Blocks], Iterable[str]], corpus: List[Blocks], repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = [text for blocks in corpus for text in chunk(blocks)]
+        timings.append(time.perf_counter() - start)
+    sizes = [len(text) / CHARS_PER_TOKEN for text in chunks]
+    sentence_ends = sum(text.rstrip().endswith((".", "!", "?", ":")) for text in chunks)
+    characters = sum(len(text) for blocks in corpus for text, _ in blocks)
+    best = min(timings)
+    print(f"{name:<13} {best * 1000:>9.1f} ms {characters / best / 1e6 if best else 0:>8.1f} MB/s {len(chunks):>7} chunks "
+          f"{sum(sizes) / len(sizes) if sizes else 0:>7.0f} avg tok {max(sizes, default=0):>7.0f} max tok "
+          f"{sentence_ends / len(chunks) if chunks else 0:>6.0%} sentence ends")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the chunkers on the bundled documents.")
+    parser.add_argument("--data-directory", default=DATA_DIRECTORY)
+    parser.add_argument("--chunk-size", type=int, default=int(os.environ.get("CHUNKER_CHUNK_SIZE", 1200)))
+    parser.add_argument("--chunk-overlap", type=int, default=int(os.environ.get("CHUNKER_CHUNK_OVERLAP", 200)))
+    parser.add_argument("--repeat", type=int, default=20, help="Passes per chunker (the best one is reported).")
+    parser.add_argument("--scale", type=int, default=50, help="Copies of the corpus in the scaled document.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.data_directory)
+    words = Chunker(chunk_size=args.chunk_size, chunk_overlap_size=args.chunk_overlap)
+    tokens = TokenChunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    chunkers = [
+        ("words", lambda blocks: words.generate_chunks(["".join(text for text, _ in blocks)])),
+        ("words-stream", lambda blocks: (text for text, _ in words.generate_chunks_from_blocks(blocks))),
+        ("tokens", lambda blocks: (text for text, _ in tokens.iter_chunks(blocks))),
+    ]
+    print(f"{len(corpus)} documents, chunk size {args.chunk_size}, overlap {args.chunk_overlap}")
+    for name, chunk in chunkers:
+        measure(name, chunk, corpus, args.repeat)
+
+    scaled = [[block for _ in range(args.scale) for blocks in corpus for block in blocks]]
+    print(f"\nThe corpus x{args.scale} as one document")
+    for name, chunk in chunkers:
+        measure(name, chunk, scaled, max(args.repeat // 10, 1))
+
+
+if __name__ == "__main__":
+    main()
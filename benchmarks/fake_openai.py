@@ -0,0 +1,190 @@
+#python benchmarks/fake_openai.py --port 8001 --latency-ms 300 --jitter-ms 100
+"""
+Local stand-in for the OpenAI API used by the benchmarks.
+
+It serves /v1/chat/completions (plain, streamed and structured outputs) and /v1/embeddings with a configurable
+latency and jitter per kind of request, so the app can be load tested without paying for (or being rate limited
+by) the real API. Point the app at it with OPENAI_BASE_URL=http://localhost:<port>/v1.
+
+The answers are deterministic and scripted on the user text, so benchmark conversations can walk every branch of
+the generate_answer state machine:
+- content filter: unsafe if the text contains a word of UNSAFE_WORDS.
+- sales detector: "Strong" if the text contains a word of SALES_WORDS, "No" otherwise.
+- consent detector: "Strong" if the text starts with a word of CONSENT_WORDS, "No" otherwise.
+- structured parse: extracts "my name is X" / "I'm X" and an email address.
+- memory: echoes the follow-up input. summary: a fixed summary. Anything else gets a RAG-like answer.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from typing import Dict
+import numpy as np
+from quart import Quart, Response, request
+
+UNSAFE_WORDS = {"idiot", "stupid", "hurt", "kill"}
+SALES_WORDS = {"buy", "pricing", "price", "quote", "hire", "purchase", "interested"}
+CONSENT_WORDS = {"yes", "sure", "ok", "okay", "absolutely", "of course"}
+EMBEDDING_DIMENSIONS = 256
+RAG_ANSWER = ("QuantumChain Technologies delivers AI and blockchain solutions for financial services, healthcare, "
+              "supply chain management and cybersecurity. Do you have more questions about QuantumChain?")
+
+
+class LatencyProfile:
+    """Latency of a kind of request: a base latency plus a uniform jitter, both in milliseconds."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    def sample(self) -> float:
+        """Returns a latency in seconds."""
+        jitter = random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(self.latency_ms + jitter, 0.0) / 1000
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (4 characters per token), enough for the usage fields."""
+    return max(1, len(text) // 4)
+
+
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """Deterministic unit vector derived from the text, so equal texts get equal embeddings."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def classify(system_prompt: str, user_text: str) -> str:
+    """Returns the scripted answer of the assistant identified by its system prompt."""
+    text = user_text.lower()
+    words = set(re.findall(r"[a-z']+", text))
+    if "content safety filter" in system_prompt:
+        if words & UNSAFE_WORDS:
+            return json.dumps({"is_safe": False, "reason": "Contains offensive and abusive language"})
+        return json.dumps({"is_safe": True, "reason": "Safe content"})
+    if "detects sales intent" in system_prompt:
+        return "Strong" if words & SALES_WORDS else "No"
+    if "detecting consent" in system_prompt:
+        return "Strong" if any(text.strip().startswith(word) for word in CONSENT_WORDS) else "No"
+    if "Follow-Up Input:" in system_prompt:
+        follow_up = system_prompt.rsplit("Follow-Up Input:", 1)[-1].split("Output:")[0].strip()
+        return ("<relevant_chat_history_synthesis>\nThe user is asking about QuantumChain.\n</relevant_chat_history_synthesis>\n\n"
+                f"<follow_up_input>\n- {follow_up}\n</follow_up_input>")
+    if "rolling summary" in system_prompt:
+        return "The user asked about QuantumChain and its products."
+    if "identify which fields are missing" in system_prompt:
+        return "Thank you! Could you please also share the missing information so one of our specialists can contact you?"
+    return RAG_ANSWER
+
+
+def extract_user_data(text: str) -> Dict[str, str]:
+    name = re.search(r"(?:my name is|i'm|i am)\s+([A-Z][a-z]+)", text, flags=re.IGNORECASE)
+    email = re.search(r"[\w.+-]+@[\w-]+\.[\w.]+", text)
+    return {"name": name.group(1) if name else None, "email": email.group(0) if email else None}
+
+
+def create_app(chat: LatencyProfile, embeddings: LatencyProfile, parse: LatencyProfile, stream_tokens_per_second: float = 0.0) -> Quart:
+    """Builds the fake API. stream_tokens_per_second spaces the streamed tokens (0 sends them at once)."""
+    app = Quart(__name__)
+    app.config["REQUEST_COUNTS"] = {"chat": 0, "parse": 0, "embeddings": 0}
+
+    def completion(model: str, content: str, prompt_tokens: int) -> dict:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content, "refusal": None}, "finish_reason": "stop", "logprobs": None}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(content), "total_tokens": prompt_tokens + count_tokens(content)},
+        }
+
+    def chunk(model: str, completion_id: str, delta: dict, finish_reason=None) -> str:
+        body = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}]}
+        return f"data: {json.dumps(body)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions():
+        body = await request.get_json()
+        messages = body.get("messages", [])
+        model = body.get("model", "gpt-4o")
+        system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+        user_text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+
+        if body.get("response_format", {}).get("type") == "json_schema":
+            app.config["REQUEST_COUNTS"]["parse"] += 1
+            await asyncio.sleep(parse.sample())
+            return completion(model, json.dumps(extract_user_data(user_text)), prompt_tokens)
+
+        app.config["REQUEST_COUNTS"]["chat"] += 1
+        content = classify(system_prompt, user_text)
+        if not body.get("stream"):
+            await asyncio.sleep(chat.sample())
+            return completion(model, content, prompt_tokens)
+
+        async def events():
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            await asyncio.sleep(chat.sample())  # Time to first token
+            yield chunk(model, completion_id, {"role": "assistant", "content": ""})
+            for token in re.findall(r"\S+\s*", content):
+                if stream_tokens_per_second:
+                    await asyncio.sleep(1 / stream_tokens_per_second)
+                yield chunk(model, completion_id, {"content": token})
+            yield chunk(model, completion_id, {}, finish_reason="stop")
+            if body.get("stream_options", {}).get("include_usage"):
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(content), "total_tokens": prompt_tokens + count_tokens(content)}
+                yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        response = Response(events(), mimetype="text/event-stream")
+        response.timeout = None
+        return response
+
+    @app.post("/v1/embeddings")
+    async def create_embeddings():
+        body = await request.get_json()
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        app.config["REQUEST_COUNTS"]["embeddings"] += 1
+        await asyncio.sleep(embeddings.sample())
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text if isinstance(text, str) else json.dumps(text))
+            embedding = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(count_tokens(t if isinstance(t, str) else "") for t in inputs)
+        return {"object": "list", "data": data, "model": body.get("model"), "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    return app
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser):
+    """Latency options shared by this script and benchmarks/benchmark.py."""
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Latency of chat completions.")
+    parser.add_argument("--jitter-ms", type=float, default=100.0, help="Uniform jitter added to every latency.")
+    parser.add_argument("--embedding-latency-ms", type=float, default=80.0, help="Latency of embeddings.")
+    parser.add_argument("--parse-latency-ms", type=float, default=400.0, help="Latency of structured outputs (parse).")
+    parser.add_argument("--stream-tokens-per-second", type=float, default=0.0, help="Pace of streamed tokens, 0 to send them at once.")
+
+
+def app_from_arguments(args) -> Quart:
+    return create_app(
+        chat=LatencyProfile(args.latency_ms, args.jitter_ms),
+        embeddings=LatencyProfile(args.embedding_latency_ms, args.jitter_ms),
+        parse=LatencyProfile(args.parse_latency_ms, args.jitter_ms),
+        stream_tokens_per_second=args.stream_tokens_per_second,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI API.")
+    parser.add_argument("--port", type=int, default=8001)
+    add_latency_arguments(parser)
+    app_from_arguments(parser.parse_args()).run(host="127.0.0.1", port=parser.parse_args().port)
@@ -0,0 +1,152 @@
+"""
+In-process stand-in for an AsyncMongoClient collection, used by the benchmarks so they measure the app and not
+a MongoDB container. It implements the subset of the collection API MongoDBManager uses: find (with projection,
+sort and limit), find_one, insert_one, insert_many, update_one ($set), count_documents and index creation, with
+equality, $gte, $gt, $lt, $in and $nin filters.
+"""
+import asyncio
+import copy
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from bson.objectid import ObjectId
+
+
+def _matches(document: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == "$gte" and not (value is not None and value >= operand):
+                    return False
+                if operator == "$gt" and not (value is not None and value > operand):
+                    return False
+                if operator == "$lt" and not (value is not None and value < operand):
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(document)
+    included = [field for field, flag in projection.items() if flag]
+    if included:
+        result = {field: copy.deepcopy(document[field]) for field in included if field in document}
+        if projection.get("_id", 1):
+            result["_id"] = document["_id"]
+        return result
+    return {field: copy.deepcopy(value) for field, value in document.items() if projection.get(field, 1)}
+
+
+class InMemoryCursor:
+    """Async cursor over a snapshot of the matching documents."""
+
+    def __init__(self, documents: List[dict], projection: Optional[dict] = None):
+        self.documents = documents
+        self.projection = projection
+        self._sort = None
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: int = 1) -> "InMemoryCursor":
+        self._sort = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        return self
+
+    def limit(self, limit: int) -> "InMemoryCursor":
+        self._limit = limit
+        return self
+
+    def _results(self) -> List[dict]:
+        documents = list(self.documents)
+        for field, direction in reversed(self._sort or []):
+            documents.sort(key=lambda d: d.get(field), reverse=direction < 0)
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(d, self.projection) for d in documents]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        await asyncio.sleep(0)  # Yield to the event loop like a real round trip would
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        self._iterator = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class InMemoryCollection:
+    """Async collection kept in a Python list. operations counts the round trips a real server would have served."""
+
+    def __init__(self, name: str = "collection"):
+        self.name = name
+        self.documents: List[dict] = []
+        self.indexes: Dict[str, list] = {}
+        self.operations = 0
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None, limit: int = 0, **kwargs) -> InMemoryCursor:
+        self.operations += 1
+        cursor = InMemoryCursor([d for d in self.documents if _matches(d, filter or {})], projection)
+        if sort:
+            cursor.sort(sort)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None, **kwargs) -> Optional[dict]:
+        results = await self.find(filter, projection, sort=sort, limit=1).to_list()
+        return results[0] if results else None
+
+    async def insert_one(self, document: dict, **kwargs):
+        self.operations += 1
+        await asyncio.sleep(0)
+        document.setdefault("_id", ObjectId())
+        self.documents.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_id=document["_id"], acknowledged=True)
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True, **kwargs):
+        self.operations += 1
+        await asyncio.sleep(0)
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+            self.documents.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_ids=[d["_id"] for d in documents], acknowledged=True)
+
+    async def update_one(self, filter: dict, update: dict, **kwargs):
+        self.operations += 1
+        await asyncio.sleep(0)
+        for document in self.documents:
+            if _matches(document, filter):
+                document.update(copy.deepcopy(update.get("$set", {})))
+                return SimpleNamespace(matched_count=1, modified_count=1, acknowledged=True)
+        return SimpleNamespace(matched_count=0, modified_count=0, acknowledged=True)
+
+    async def count_documents(self, filter: dict, **kwargs) -> int:
+        self.operations += 1
+        await asyncio.sleep(0)
+        return sum(1 for d in self.documents if _matches(d, filter))
+
+    async def create_index(self, keys, name: Optional[str] = None, **kwargs) -> str:
+        keys = keys if isinstance(keys, list) else [(keys, 1)]
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        self.indexes[name] = keys
+        return name
+
+    async def create_indexes(self, indexes: list, **kwargs) -> List[str]:
+        names = []
+        for index in indexes:
+            document = index.document
+            names.append(await self.create_index(list(document["key"].items()), name=document.get("name")))
+        return names
+
+    def with_options(self, **kwargs) -> "InMemoryCollection":
+        return self
@@ -0,0 +1,105 @@
+#python benchmarks/load_test.py --url http://localhost:5000 --concurrency 1 8 32 128
+"""
+Load test for the /message endpoint.
+
+Each virtual user opens a conversation and sends one message; the test is repeated for every
+concurrency level so the throughput of a single worker can be compared as concurrency grows.
+With the async pipeline the requests/sec should go up with the concurrency level instead of
+staying flat at 1 / (latency of one request).
+
+Note: this script hits the running app as-is, so every message costs real OpenAI calls unless the
+app is pointed at a local stand-in (see OPENAI_BASE_URL).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "What does QuantumChain do?",
+    "Who founded the company?",
+    "Where are the offices?",
+    "Tell me about QuantumChain's products",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Returns the pct percentile (0-100) of values using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_conversation(client: httpx.AsyncClient, url: str, question: str) -> float:
+    """Creates a conversation and sends a single message. Returns the latency of /message in seconds."""
+    response = await client.post(f"{url}/conversation", json={"user_input": ""})
+    response.raise_for_status()
+    conversation_id = response.json()["conversation_id"]
+    start = time.perf_counter()
+    response = await client.post(f"{url}/message", json={"conversation_id": conversation_id, "user_input": question})
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run_level(url: str, concurrency: int, total_requests: int, questions: List[str], timeout: float) -> dict:
+    """Runs total_requests conversations keeping at most `concurrency` of them in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker(i: int):
+            nonlocal errors
+            async with semaphore:
+                try:
+                    latencies.append(await run_conversation(client, url, questions[i % len(questions)]))
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+    }
+
+
+def print_report(results: List[dict]):
+    """Prints one row per concurrency level."""
+    print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 (s)':>8} {'p99 (s)':>8}")
+    for r in results:
+        print(f"{r['concurrency']:>11} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>8.2f} {r['p50']:>8.3f} {r['p99']:>8.3f}")
+    if len(results) > 1 and results[0]["throughput"]:
+        speedup = results[-1]["throughput"] / results[0]["throughput"]
+        print(f"\nThroughput at concurrency {results[-1]['concurrency']} is {speedup:.1f}x the throughput at concurrency {results[0]['concurrency']}.")
+
+
+async def main(args):
+    results = []
+    for concurrency in args.concurrency:
+        total_requests = max(concurrency * args.requests_per_user, concurrency)
+        results.append(await run_level(args.url, concurrency, total_requests, DEFAULT_QUESTIONS, args.timeout))
+    print_report(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the /message endpoint.")
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the running app.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128], help="Concurrency levels to test.")
+    parser.add_argument("--requests-per-user", type=int, default=4, help="Conversations sent per virtual user at each level.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Request timeout in seconds.")
+    asyncio.run(main(parser.parse_args()))
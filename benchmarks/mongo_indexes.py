@@ -0,0 +1,121 @@
+#python benchmarks/mongo_indexes.py --uri mongodb://localhost:27017/ --turns 1000000
+"""
+Benchmark of the conversation queries of MongoDBManager on a synthetic collection, before and after the indexes.
+
+It fills a throwaway collection with --turns turns spread over --conversations conversations, all inside the
+one-week conversation window, and measures p50/p99 latency of the lookups the app does for random conversations:
+- "before": only the default _id index, whole documents, the full week of the conversation (the old lookup).
+- "after": MongoDBManager.ensure_indexes(), projections and the bounded last-N-turns query.
+For every query the plan (COLLSCAN/IXSCAN) and the documents examined are printed too.
+
+It needs a running MongoDB. The database is dropped at the end unless --keep is given.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Awaitable, Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.db.db_manager import MongoDBManager
+from benchmarks.load_test import percentile
+
+FIELDS = ["question", "answer", "sales_intention", "consent", "summary"]
+ANSWER = ("QuantumChain Technologies delivers AI and blockchain solutions for financial services, healthcare, "
+          "supply chain management and cybersecurity. Do you have more questions about QuantumChain?")
+
+
+async def populate(manager: MongoDBManager, turns: int, conversations: int, batch_size: int = 10000):
+    """Inserts the synthetic turns in batches. Turns of a conversation are interleaved with the others, as in production."""
+    await manager.collection.drop()
+    inserted = 0
+    start = time.perf_counter()
+    while inserted < turns:
+        batch = [{
+            "conversation_id": f"conversation-{random.randrange(conversations)}",
+            "question": f"Synthetic question number {inserted + i} about QuantumChain products",
+            "answer": ANSWER,
+            "sales_intention": False,
+            "consent": None,
+        } for i in range(min(batch_size, turns - inserted))]
+        await manager.collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+        print(f"\rInserted {inserted}/{turns} turns", end="", flush=True)
+    print(f" in {time.perf_counter() - start:.1f}s")
+
+
+def plan_stages(plan: dict) -> List[str]:
+    """Stage names of a query plan, outermost first (e.g. ['LIMIT', 'FETCH', 'IXSCAN'])."""
+    stages = [plan.get("stage")] if plan.get("stage") else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+
+async def describe(cursor) -> str:
+    explain = await cursor.explain()
+    stats = explain.get("executionStats", {})
+    return f"{'>'.join(plan_stages(explain['queryPlanner']['winningPlan']))}, {stats.get('totalDocsExamined')} docs examined"
+
+
+async def measure(name: str, query: Callable[[str], Awaitable], conversation_ids: List[str]) -> dict:
+    latencies = []
+    for conversation_id in conversation_ids:
+        start = time.perf_counter()
+        await query(conversation_id)
+        latencies.append(time.perf_counter() - start)
+    result = {"query": name, "p50": percentile(latencies, 50), "p99": percentile(latencies, 99)}
+    print(f"  {name:<32} p50 {result['p50'] * 1000:>8.2f} ms   p99 {result['p99'] * 1000:>8.2f} ms")
+    return result
+
+
+async def run(args):
+    before = MongoDBManager(db_name=args.db_name, collection_name="conversations", uri=args.uri)
+    after = MongoDBManager(db_name=args.db_name, collection_name="conversations", uri=args.uri, fields=FIELDS)
+    if not args.skip_populate:
+        await populate(before, args.turns, args.conversations)
+    conversation_ids = [f"conversation-{random.randrange(args.conversations)}" for _ in range(args.samples)]
+    sample_filter = before._conversation_filter(conversation_ids[0])
+
+    print("\nBefore: no indexes, whole documents, full conversation")
+    await before.collection.drop_indexes()
+    print(f"  plan: {await describe(before.collection.find(sample_filter))}")
+    await measure("full conversation", lambda c: before.collection.find(before._conversation_filter(c)).to_list(), conversation_ids)
+    await measure("count", lambda c: before.count_messages_in_conversation(c), conversation_ids)
+
+    print("\nAfter: ensure_indexes(), projections, sort by _id and bounded queries")
+    start = time.perf_counter()
+    await after.ensure_indexes()
+    print(f"  indexes built in {time.perf_counter() - start:.1f}s")
+    print(f"  plan: {await describe(after.collection.find(sample_filter, after.projection, sort=[('_id', -1)], limit=args.last_turns))}")
+    await measure("full conversation", lambda c: after.buscar_conversaciones_por_id(c), conversation_ids)
+    await measure("count", lambda c: after.count_messages_in_conversation(c, within_window=True), conversation_ids)
+    await measure(f"last {args.last_turns} turns", lambda c: after.get_last_items(c, args.last_turns), conversation_ids)
+
+    if not args.keep:
+        await after.client.drop_database(args.db_name)
+    await before.close_connection()
+    await after.close_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of the MongoDBManager queries on a synthetic collection, before and after the indexes.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db-name", default="benchmark_mongo_indexes", help="Throwaway database, dropped at the end.")
+    parser.add_argument("--turns", type=int, default=1000000)
+    parser.add_argument("--conversations", type=int, default=100000)
+    parser.add_argument("--samples", type=int, default=50, help="Lookups measured per query.")
+    parser.add_argument("--last-turns", type=int, default=20)
+    parser.add_argument("--skip-populate", action="store_true", help="Reuse the collection of a previous run with --keep.")
+    parser.add_argument("--keep", action="store_true", help="Keep the database.")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
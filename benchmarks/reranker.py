@@ -0,0 +1,81 @@
+#python benchmarks/reranker.py --backends torch onnx onnx-int8 --requests 200
+"""
+CPU latency of the reranking cross-encoder per backend (utils/reranker.py).
+
+The candidates are chunks of the bundled QuantumChain documents (data_ingestion/data, chunked with TokenChunker).
+Every request scores --candidates random chunks for one of the benchmark questions, as the reranking strategy does
+for n_results * 2 vector candidates. For every backend it reports the load time (including the first inference),
+p50/p95/p99 latency of uncached requests and the latency of the same requests answered from the score cache.
+
+The onnx backends need the ONNX extras of sentence-transformers (pip install "sentence-transformers[onnx]");
+backends that cannot be loaded are reported and skipped.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.chunker import DATA_DIRECTORY, load_corpus
+from benchmarks.load_test import percentile
+from data_ingestion.indexing.chunker import TokenChunker
+from utils.reranker import BACKENDS, DEFAULT_RERANKER, CrossEncoderReranker
+
+QUESTIONS = ["What does QuantumChain do?", "Who founded the company?", "Where are the offices?", "How many employees are in the company?",
+             "What are the values of QuantumChain?", "What were the revenues last year?", "Which clients use the supply chain platform?"]
+
+
+def load_chunks(chunk_size: int) -> List[str]:
+    chunker = TokenChunker(chunk_size=chunk_size, chunk_overlap=chunk_size // 6)
+    return [chunk for blocks in load_corpus(DATA_DIRECTORY) for chunk, _ in chunker.iter_chunks(blocks)]
+
+
+def run(reranker: CrossEncoderReranker, requests: List[tuple]) -> List[float]:
+    latencies = []
+    for question, candidates in requests:
+        start = time.perf_counter()
+        reranker.score(question, [f"chunk_{i}" for i, _ in candidates], [text for _, text in candidates])
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies: List[float]):
+    print(f"{name:<24} p50 {percentile(latencies, 50) * 1000:>8.1f} ms  p95 {percentile(latencies, 95) * 1000:>8.1f} ms  p99 {percentile(latencies, 99) * 1000:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU latency of the reranking cross-encoder per backend.")
+    parser.add_argument("--model", default=os.environ.get("RERANKER_MODEL", DEFAULT_RERANKER))
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=16, help="Chunks scored per request (n_results * 2 in the reranking strategy).")
+    parser.add_argument("--chunk-size", type=int, default=300, help="Chunk size in approximate tokens.")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("RERANKER_BATCH_SIZE", 32)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("RERANKER_THREADS", 0)), help="CPU threads (0: library default).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.chunk_size)
+    rng = random.Random(args.seed)
+    requests = [(rng.choice(QUESTIONS), rng.sample(list(enumerate(chunks)), min(args.candidates, len(chunks)))) for _ in range(args.requests)]
+    print(f"{len(chunks)} chunks, {args.requests} requests of {args.candidates} candidates, batch size {args.batch_size}, threads {args.threads or 'default'}")
+
+    for backend in args.backends:
+        reranker = CrossEncoderReranker(model_name=args.model, backend=backend, batch_size=args.batch_size, threads=args.threads or None, cache_size=0)
+        try:
+            reranker.get_model()
+        except Exception as e:
+            print(f"{backend:<24} skipped, the model could not be loaded: {e}")
+            continue
+        print(f"{backend:<24} loaded in {reranker.load_seconds:.1f}s")
+        report(f"{backend} uncached", run(reranker, requests))
+        reranker.cache_size = args.requests * args.candidates
+        run(reranker, requests)
+        report(f"{backend} cached", run(reranker, requests))
+
+
+if __name__ == "__main__":
+    main()
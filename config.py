@@ -2,9 +2,19 @@ import os
 import logging
 from utils.file_manager import FileManager
 from storage.db.db_manager import MongoDBManager
-from storage.vector_db.vectorstore import ChromaVectorStore
+from storage.db.conversation_state import ConversationStateCache
+from storage.db.mongo_client import MongoClientRegistry
+from storage.vector_db.vectorstore import ChromaVectorStore, HybridFusion
 from utils.llm_manager import Assistant, RAG
-from openai import OpenAI
+from utils.conversation_summary import ConversationSummarizer
+from utils.response_cache import ResponseCache
+from utils.semantic_cache import SemanticCache
+from utils.embedding_cache import EmbeddingCache
+from utils.reranker import CrossEncoderReranker
+from utils.local_classifier import CONSENT_REPLIES, ClassifierCascade, LocalClassifier, SafeExamplesClassifier
+from utils.content_prescreen import ContentPrescreen
+from utils.services import ServiceRegistry
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,27 +22,94 @@ load_dotenv()
 limit_messages_in_conversation = int(os.environ.get("LIMIT_MESSAGES_IN_CONVERSATION"))
 threshold_sales_intention_trigger = int(os.environ.get("THRESHOLD_SALES_INTENTION_TRIGGER"))
 privacy_policy_uri = os.environ.get("PRIVACY_POLICY_URI")
+retrieval_max_workers = int(os.environ.get("RETRIEVAL_MAX_WORKERS", 8))
+
+# The expensive objects (Mongo clients, Chroma, the OpenAI client, the models) are lazy services: importing this module
+# only reads the settings. app.py warms them up in parallel at startup (SERVICES_WARM_UP_WORKERS threads) and closes them at shutdown.
+services = ServiceRegistry(max_workers=int(os.environ.get("SERVICES_WARM_UP_WORKERS", 8)))
 
 #Mongo
-db_manager_conversations = MongoDBManager(collection_name="conversations", uri = f'mongodb://localhost:27017/')
-db_manager_userdata = MongoDBManager(collection_name="userdata", uri = f'mongodb://localhost:27017/')
+# One pooled client shared by both managers. Each worker process has its own pool: keep workers * MONGO_MAX_POOL_SIZE below the server limit.
+mongo_uri = os.environ.get("MONGO_URI", "mongodb://localhost:27017/")
+mongo_clients = services.register("mongo_clients", lambda: MongoClientRegistry(max_pool_size=int(os.environ.get("MONGO_MAX_POOL_SIZE", 20)),
+                                    min_pool_size=int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+                                    max_idle_time_ms=int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 60000)),
+                                    wait_queue_timeout_ms=int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000)),
+                                    connect_timeout_ms=int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+                                    socket_timeout_ms=int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 30000)),
+                                    server_selection_timeout_ms=int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))))
+# MONGO_DURABILITY: sync (insert on the request path) or acknowledged/journaled/unacknowledged (batched write-behind)
+mongo_write_options = dict(durability=os.environ.get("MONGO_DURABILITY", "sync"),
+                           write_batch_size=int(os.environ.get("MONGO_WRITE_BATCH_SIZE", 100)),
+                           write_flush_interval=float(os.environ.get("MONGO_WRITE_FLUSH_INTERVAL_SECONDS", 0.5)),
+                           write_max_pending=int(os.environ.get("MONGO_WRITE_MAX_PENDING", 10000)))
+db_manager_conversations = services.register("db_manager_conversations", lambda: MongoDBManager(collection_name="conversations", uri = mongo_uri, fields=["question", "answer", "sales_intention", "consent", "summary"], clients=services.get("mongo_clients"), **mongo_write_options),
+                                             close=lambda manager: manager.close_connection())
+db_manager_userdata = services.register("db_manager_userdata", lambda: MongoDBManager(collection_name="userdata", uri = mongo_uri, fields=["name", "email", "message"], clients=services.get("mongo_clients"), **mongo_write_options),
+                                        close=lambda manager: manager.close_connection())
+# Write-through cache of the per conversation state (turn count, last flags, user data, recent turns). 0 disables it.
+# CONVERSATION_CACHE_VALIDATE checks every hit against the turn count in Mongo, needed when several workers serve a conversation.
+conversation_cache_max_size = int(os.environ.get("CONVERSATION_CACHE_MAX_SIZE", 10000))
+conversation_cache_recent_turns = int(os.environ.get("CONVERSATION_CACHE_RECENT_TURNS", 20))
+conversation_cache_validate = os.environ.get("CONVERSATION_CACHE_VALIDATE", "true").lower() in ("1", "true", "yes")
+conversation_states = services.register("conversation_states", lambda: ConversationStateCache(services.get("db_manager_conversations"), services.get("db_manager_userdata"), max_size=conversation_cache_max_size, max_recent_turns=conversation_cache_recent_turns,
+                                                                                               validate=conversation_cache_validate))
 
 #ChormaDB Vectorstore
 collection_name = os.environ.get("CHROMADB_COLLECTION_NAME")
 logging.debug(f"collection_name: {collection_name}")
 persist_directory = os.environ.get("CHROMADB_PERSIST_DIRECTORY")
 logging.debug(f"persist_directory: {persist_directory}")
-vectorstore = ChromaVectorStore(collection_name=collection_name, persist_directory=persist_directory)
+# On-disk cache of the query embeddings, shared with provision.py (empty EMBEDDING_CACHE_DIRECTORY disables it)
+embedding_cache_directory = os.environ.get("EMBEDDING_CACHE_DIRECTORY", "./embedding_cache")
+embedding_cache = services.register("embedding_cache", lambda: EmbeddingCache(embedding_cache_directory, max_megabytes=float(os.environ.get("EMBEDDING_CACHE_MAX_MB", 1024))) if embedding_cache_directory else None,
+                                    close=lambda cache: cache.close())
+# hybrid_search: both legs run in parallel; HYBRID_FUSION is rrf (reciprocal rank fusion) or weighted (normalized scores)
+hybrid_fusion = services.register("hybrid_fusion", lambda: HybridFusion(method=os.environ.get("HYBRID_FUSION", "rrf"),
+                                                                     text_depth=int(os.environ.get("HYBRID_TEXT_DEPTH", 20)),
+                                                                     vector_depth=int(os.environ.get("HYBRID_VECTOR_DEPTH", 20)),
+                                                                     text_weight=float(os.environ.get("HYBRID_TEXT_WEIGHT", 1.0)),
+                                                                     vector_weight=float(os.environ.get("HYBRID_VECTOR_WEIGHT", 1.0)),
+                                                                     rrf_k=int(os.environ.get("HYBRID_RRF_K", 60))),
+                                  close=lambda fusion: fusion.executor.shutdown(wait=False))
+# Cross-encoder of the reranking strategy: RERANKER_BACKEND is torch, onnx or onnx-int8 (int8 quantized ONNX export)
+reranker_threads = int(os.environ.get("RERANKER_THREADS", 0))
+reranker = services.register("reranker", lambda: CrossEncoderReranker(model_name=os.environ.get("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+                                                                      backend=os.environ.get("RERANKER_BACKEND", "torch"),
+                                                                      batch_size=int(os.environ.get("RERANKER_BATCH_SIZE", 32)),
+                                                                      threads=reranker_threads or None,
+                                                                      cache_size=int(os.environ.get("RERANKER_CACHE_SIZE", 10000))),
+                             warm_up=lambda reranker: reranker.get_model() if retrieval_strategy == "reranking" else None) # Only that strategy needs the cross-encoder
+vectorstore = services.register("vectorstore", lambda: ChromaVectorStore(collection_name=collection_name, persist_directory=persist_directory, embedding_cache=services.get("embedding_cache"),
+                                                                         hybrid_fusion=services.get("hybrid_fusion"), reranker=services.get("reranker")))
 
 
 # RAG and Assistants
 file_manager = FileManager()
 api_key = os.environ.get("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+client = services.register("client", lambda: AsyncOpenAI(api_key=api_key), close=lambda client: client.close())
 assistant_model = "gpt-4o-mini"
 detector_model = "o3-mini"
 rag_model = "gpt-4o"
 
+# Exact-match response cache for the classifier assistants (comma separated assistant names, empty to disable)
+response_cache_assistants = {name.strip() for name in os.environ.get("RESPONSE_CACHE_ASSISTANTS", "content_filter,sales_detector,consentiment").split(",") if name.strip()}
+response_cache_max_size = int(os.environ.get("RESPONSE_CACHE_MAX_SIZE", 10000))
+response_cache_ttl_seconds = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 3600))
+
+def response_cache_for(name: str):
+    """Returns a ResponseCache for the assistant if it is enabled in RESPONSE_CACHE_ASSISTANTS."""
+    if name not in response_cache_assistants:
+        return None
+    return ResponseCache(name=name, max_size=response_cache_max_size, ttl_seconds=response_cache_ttl_seconds)
+
+# Semantic cache of the RAG answers to first messages (questions similar above the threshold get the same answer)
+semantic_cache_enabled = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+semantic_cache_threshold = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.96))
+semantic_cache_max_size = int(os.environ.get("SEMANTIC_CACHE_MAX_SIZE", 2000))
+semantic_cache_ttl_seconds = float(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 86400))
+semantic_cache = services.register("semantic_cache", lambda: SemanticCache(threshold=semantic_cache_threshold, max_size=semantic_cache_max_size, ttl_seconds=semantic_cache_ttl_seconds, version_provider=vectorstore.corpus_version) if semantic_cache_enabled else None)
+
 valid_retrieval_strategies = {"text_search", "vector_search", "hybrid_search", "reranking"}
 retrieval_strategy = os.environ.get("RAG_RETRIEVAL_STRATEGY")
 if retrieval_strategy not in valid_retrieval_strategies:
@@ -43,24 +120,51 @@ if retrieval_strategy not in valid_retrieval_strategies:
 
 #Assistant Content FIlter
 content_filter_prompt = file_manager.load_md_file("prompts/content_filter.md")
-assistant_content_filter = Assistant(client=client, base_prompt=content_filter_prompt, model=assistant_model)
+assistant_content_filter = services.register("assistant_content_filter", lambda: Assistant(client=services.get("client"), base_prompt=content_filter_prompt, model=assistant_model, name="content_filter", cache=response_cache_for("content_filter")))
+# Local pre-screen: clears allow-listed input (and, with safe examples from train_classifiers.py, input very similar to questions that passed the filter)
+# in the conversation states of CONTENT_PRESCREEN_STATES (comma separated, empty disables it). Everything else goes to the content filter assistant.
+local_classifier_dir = os.environ.get("LOCAL_CLASSIFIER_DIR", "models")
+content_prescreen_states = [state.strip() for state in os.environ.get("CONTENT_PRESCREEN_STATES", "first_message,sales_detection,sales_threshold,consent,user_data_capture,user_data_complete,consent_refused").split(",") if state.strip()]
+content_prescreen_similarity = float(os.environ.get("CONTENT_PRESCREEN_SIMILARITY", 0.92))
+content_prescreen = services.register("content_prescreen", lambda: ContentPrescreen(assistant=services.get("assistant_content_filter"), states=content_prescreen_states,
+                                                                                     classifier=SafeExamplesClassifier.load(os.path.join(local_classifier_dir, "content_filter_examples.npz"), similarity=content_prescreen_similarity)))
 
 #Assistant Conversation Memory  
 conversation_memory_prompt = file_manager.load_md_file('prompts/conversation_memory.md')
-assistant_memory = Assistant(client=client, base_prompt=conversation_memory_prompt, model=assistant_model)
+assistant_memory = services.register("assistant_memory", lambda: Assistant(client=services.get("client"), base_prompt=conversation_memory_prompt, model=assistant_model, name="memory", cache=response_cache_for("memory")))
+
+#Rolling conversation summary, fed to the memory assistant instead of the whole transcript
+conversation_summary_prompt = file_manager.load_md_file('prompts/conversation_summary.md')
+assistant_summary = services.register("assistant_summary", lambda: Assistant(client=services.get("client"), base_prompt=conversation_summary_prompt, model=assistant_model, name="summary"))
+conversation_summaries = services.register("conversation_summaries", lambda: ConversationSummarizer(assistant=services.get("assistant_summary"), states=services.get("conversation_states"),
+                                                                                                   history_turns=int(os.environ.get("CONVERSATION_HISTORY_TURNS", 4)),
+                                                                                                   history_max_tokens=int(os.environ.get("CONVERSATION_HISTORY_MAX_TOKENS", 1500)),
+                                                                                                   summary_max_tokens=int(os.environ.get("CONVERSATION_SUMMARY_MAX_TOKENS", 300))),
+                                           close=lambda summaries: summaries.aclose()) # Pending summary updates still write to Mongo
 
 #Assistant Sales Detector  
 sales_detector_prompt = file_manager.load_md_file('prompts/sales_detector.md')
-assistant_sales_detector = Assistant(client=client, base_prompt=sales_detector_prompt, model=detector_model)
+assistant_sales_detector = services.register("assistant_sales_detector", lambda: Assistant(client=services.get("client"), base_prompt=sales_detector_prompt, model=detector_model, name="sales_detector", cache=response_cache_for("sales_detector")))
 
 #Assistant Consentiment   
 consentiment_prompt = file_manager.load_md_file('prompts/consentiment.md')
-assistant_consentiment = Assistant(client=client, base_prompt=consentiment_prompt, model=detector_model)
+assistant_consentiment = services.register("assistant_consentiment", lambda: Assistant(client=services.get("client"), base_prompt=consentiment_prompt, model=detector_model, name="consentiment", cache=response_cache_for("consentiment")))
+
+# Local classifiers in front of the sales and consent detectors (train them with train_classifiers.py).
+# They answer when their probability is above the confidence (or below 1 - confidence); the uncertain band goes to the LLM.
+sales_classifier_confidence = float(os.environ.get("SALES_CLASSIFIER_CONFIDENCE", 0.9))
+consent_classifier_confidence = float(os.environ.get("CONSENT_CLASSIFIER_CONFIDENCE", 0.9))
+sales_detector = services.register("sales_detector", lambda: ClassifierCascade(name="sales_detector", assistant=services.get("assistant_sales_detector"),
+                                                                               classifier=LocalClassifier.load(os.path.join(local_classifier_dir, "sales_classifier.npz"), confidence=sales_classifier_confidence)))
+consent_detector = services.register("consent_detector", lambda: ClassifierCascade(name="consentiment", assistant=services.get("assistant_consentiment"), rules=CONSENT_REPLIES,
+                                                                                   classifier=LocalClassifier.load(os.path.join(local_classifier_dir, "consent_classifier.npz"), confidence=consent_classifier_confidence)))
 
 #Assistant Request Data  
 request_data_prompt = file_manager.load_md_file("prompts/request_user_data.md")
-assistant_request_data = Assistant(client=client, base_prompt=request_data_prompt, model=assistant_model)
+assistant_request_data = services.register("assistant_request_data", lambda: Assistant(client=services.get("client"), base_prompt=request_data_prompt, model=assistant_model, name="request_data", cache=response_cache_for("request_data")))
 
 #RAG
 rag_prompt = file_manager.load_md_file('prompts/quantum_rag.md')
-rag = RAG(client=client, base_prompt=rag_prompt, vectorstore=vectorstore, retrieval_strategy=retrieval_strategy)
+rag = services.register("rag", lambda: RAG(client=services.get("client"), base_prompt=rag_prompt, vectorstore=services.get("vectorstore"), retrieval_strategy=retrieval_strategy,
+                                           max_retrieval_workers=retrieval_max_workers, semantic_cache=services.get("semantic_cache")),
+                        close=lambda rag: rag.executor.shutdown(wait=False))
@@ -1,5 +1,12 @@
 import re
-from typing import List
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+CHARS_PER_TOKEN = 4  # Approximation used for the chunk sizes of TokenChunker
+
+# End of a sentence (terminator, closing quotes or brackets and the whitespace after it) or of a paragraph (blank line)
+BOUNDARY = re.compile(r'(?:[.!?][.!?"\'”’)\]]*[ \t\n]|\n[ \t]*\n)\s*')
+
 
 class Chunker:
     def __init__(self, chunk_size: int = 1000, chunk_overlap_size: int = 200):
@@ -60,4 +67,165 @@ class Chunker:
                 # Move the start point for the next chunk, accounting for overlap
                 start += self.chunk_size - self.chunk_overlap_size
 
-        return chunks
\ No newline at end of file
+        return chunks
+
+    def generate_chunks_from_blocks(self, blocks: Iterable[Tuple[str, Optional[int]]]) -> Iterator[Tuple[str, dict]]:
+        """
+        Streaming version of generate_chunks: consumes (text, page number) blocks, as LocalLoader.iter_blocks yields
+        them, and chunks them like generate_chunks (word windows with overlap, blocks are split on their own) while
+        recording the pages every chunk spans.
+        Only the words of the current chunk are kept in memory.
+
+        Args:
+            blocks (Iterable[Tuple[str, Optional[int]]]): Blocks of text and their page numbers (None if unknown).
+
+        Yields:
+            Tuple[str, dict]: A chunk and its metadata ({"page_start": ..., "page_end": ...} when the pages are known).
+        """
+        window = []  # (word, page number) of the current chunk
+        for text, page_number in blocks:
+            window.extend((word, page_number) for word in self.split_text_with_separators(text))
+            while len(window) >= self.chunk_size:
+                yield self._window_chunk(window[:self.chunk_size])
+                window = window[self.chunk_size - self.chunk_overlap_size:]
+        if window:
+            yield self._window_chunk(window)
+
+    @staticmethod
+    def _window_chunk(window: List[Tuple[str, Optional[int]]]) -> Tuple[str, dict]:
+        pages = [page_number for _, page_number in window if page_number is not None]
+        metadata = {"page_start": min(pages), "page_end": max(pages)} if pages else {}
+        return " ".join(word for word, _ in window), metadata
+
+
+class _Unit(NamedTuple):
+    start: int  # Offset of the unit in the text
+    text: str  # The unit with the whitespace that follows it
+    paragraph_end: bool
+
+
+class TokenChunker:
+    def __init__(self, chunk_size: int = 300, chunk_overlap: int = 50, paragraph_snap: float = 0.8):
+        """
+        One-pass chunker with sizes in approximate tokens (CHARS_PER_TOKEN characters per token).
+
+        The text is cut into sentences (or paragraphs), which are packed into chunks of at most chunk_size tokens, so
+        chunks always end at a sentence boundary, and at a paragraph boundary when one comes after paragraph_snap of
+        the chunk is filled. Consecutive chunks share their last sentences, up to chunk_overlap tokens. Sentences
+        longer than a chunk are split at whitespace. Every chunk carries its start/end character offsets in the text.
+
+        Args:
+            chunk_size (int): Maximum tokens per chunk. Default is 300.
+            chunk_overlap (int): Maximum tokens shared by consecutive chunks. Default is 50.
+            paragraph_snap (float): Share of chunk_size after which a paragraph end closes the chunk. Default is 0.8.
+        """
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.paragraph_snap = paragraph_snap
+        self.max_unit_chars = chunk_size * CHARS_PER_TOKEN
+
+    def _split_long(self, start: int, text: str, paragraph_end: bool = False) -> Iterator[_Unit]:
+        """Splits a unit longer than a chunk at whitespace (or hard, if it has none)."""
+        while len(text) > self.max_unit_chars:
+            cut = text.rfind(" ", 0, self.max_unit_chars) + 1 or self.max_unit_chars
+            yield _Unit(start, text[:cut], False)
+            start, text = start + cut, text[cut:]
+        if text:
+            yield _Unit(start, text, paragraph_end)
+
+    def _units(self, blocks: Iterable[Tuple[str, Optional[int]]], block_offsets: List[int], block_pages: List[Optional[int]]) -> Iterator[_Unit]:
+        """Sentences and paragraphs of the blocks, in one pass. Only the unfinished sentence is buffered."""
+        buffer, buffer_start = "", 0
+        for text, page_number in blocks:
+            block_offsets.append(buffer_start + len(buffer))
+            block_pages.append(page_number)
+            buffer += text
+            position = 0
+            for match in BOUNDARY.finditer(buffer):
+                yield from self._split_long(buffer_start + position, buffer[position:match.end()], match.group().count("\n") >= 2)
+                position = match.end()
+            buffer, buffer_start = buffer[position:], buffer_start + position
+            if len(buffer) > self.max_unit_chars: # A long run without boundaries: do not let the buffer grow
+                cut = buffer.rfind(" ", 0, len(buffer) - 1) + 1 or len(buffer)
+                yield from self._split_long(buffer_start, buffer[:cut])
+                buffer, buffer_start = buffer[cut:], buffer_start + cut
+        if buffer:
+            yield from self._split_long(buffer_start, buffer)
+
+    def _chunk(self, units: List[_Unit], block_offsets: List[int], block_pages: List[Optional[int]]) -> Optional[Tuple[str, dict]]:
+        raw = "".join(unit.text for unit in units)
+        text = raw.strip()
+        if not text:
+            return None
+        start = units[0].start + len(raw) - len(raw.lstrip())
+        end = start + len(text)
+        metadata = {"start_char": start, "end_char": end}
+        pages = [block_pages[bisect_right(block_offsets, offset) - 1] for offset in (start, end - 1)]
+        if None not in pages:
+            metadata.update(page_start=pages[0], page_end=pages[1])
+        return text, metadata
+
+    def _overlap(self, units: List[_Unit]) -> Tuple[List[_Unit], float]:
+        """Last units of a chunk, up to chunk_overlap tokens, to start the next one with, and their tokens."""
+        count, tokens = 0, 0.0
+        for unit in reversed(units):
+            unit_tokens = len(unit.text) / CHARS_PER_TOKEN
+            if tokens + unit_tokens > self.chunk_overlap:
+                break
+            count, tokens = count + 1, tokens + unit_tokens
+        return units[len(units) - count:], tokens
+
+    def iter_chunks(self, blocks: Iterable[Tuple[str, Optional[int]]]) -> Iterator[Tuple[str, dict]]:
+        """
+        Generator API for streaming input: consumes (text, page number) blocks, as LocalLoader.iter_blocks yields them,
+        and yields the chunks as soon as they are complete. Offsets are in the concatenation of the blocks.
+
+        Args:
+            blocks (Iterable[Tuple[str, Optional[int]]]): Blocks of text and their page numbers (None if unknown).
+
+        Yields:
+            Tuple[str, dict]: A chunk and its metadata: start_char, end_char and, when the pages are known, page_start and page_end.
+        """
+        block_offsets: List[int] = []
+        block_pages: List[Optional[int]] = []
+        current: List[_Unit] = []
+        tokens = 0.0
+        new_units = 0 # Units of current that are not in the previous chunk
+        for unit in self._units(blocks, block_offsets, block_pages):
+            unit_tokens = len(unit.text) / CHARS_PER_TOKEN
+            if current and tokens + unit_tokens > self.chunk_size:
+                if new_units:
+                    chunk = self._chunk(current, block_offsets, block_pages)
+                    if chunk:
+                        yield chunk
+                    current, tokens = self._overlap(current)
+                else:
+                    current, tokens = [], 0.0
+                while current and tokens + unit_tokens > self.chunk_size: # The overlap does not leave room for the unit
+                    tokens -= len(current.pop(0).text) / CHARS_PER_TOKEN
+                new_units = 0
+            current.append(unit)
+            tokens += unit_tokens
+            new_units += 1
+            if unit.paragraph_end and tokens >= self.chunk_size * self.paragraph_snap:
+                chunk = self._chunk(current, block_offsets, block_pages)
+                if chunk:
+                    yield chunk
+                current, tokens = self._overlap(current)
+                new_units = 0
+        if current and new_units:
+            chunk = self._chunk(current, block_offsets, block_pages)
+            if chunk:
+                yield chunk
+
+    def chunk_text(self, text: str) -> List[Tuple[str, dict]]:
+        """Chunks of a whole text, with their offsets in it."""
+        return list(self.iter_chunks([(text, None)]))
+
+    def generate_chunks(self, txt_files: List[str]) -> List[str]:
+        """
+        Same interface as Chunker.generate_chunks: the chunks of every input string, without their metadata.
+        """
+        return [chunk for text in txt_files for chunk, _ in self.iter_chunks([(text, None)])]
@@ -1,41 +1,82 @@
 import os
-from typing import List, Optional
-from data_ingestion.indexing.chunker import Chunker
+from typing import Optional
+from data_ingestion.indexing.chunker import Chunker, TokenChunker
 from data_ingestion.indexing.loader import LocalLoader
 from data_ingestion.indexing.vectorizer import Vectorizer
 from data_ingestion.indexing.documents import Document
+from utils.embedding_cache import EmbeddingCache
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 chunk_size = int(os.environ.get("CHUNKER_CHUNK_SIZE"))
 chunk_overlap = int(os.environ.get("CHUNKER_CHUNK_OVERLAP"))
+# "words" (default): the word window of Chunker; "tokens": sentence-aware chunks sized in approximate tokens (TokenChunker)
+chunker_engine = os.environ.get("CHUNKER_ENGINE", "words")
+# Recorded in the ingestion manifest: changing them re-processes every file
+chunker_settings = {"engine": chunker_engine, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+# Embeddings requests: texts and estimated tokens per batch, batches in flight and retries on rate limits
+vectorizer_options = dict(batch_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", 256)),
+                          max_batch_tokens=int(os.environ.get("EMBEDDING_MAX_BATCH_TOKENS", 100000)),
+                          max_concurrency=int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 4)),
+                          max_retries=int(os.environ.get("EMBEDDING_MAX_RETRIES", 6)))
+# On-disk embedding cache: unchanged chunks are not embedded again when re-provisioning (empty EMBEDDING_CACHE_DIRECTORY disables it)
+embedding_cache_directory = os.environ.get("EMBEDDING_CACHE_DIRECTORY", "./embedding_cache")
+embedding_cache_max_megabytes = float(os.environ.get("EMBEDDING_CACHE_MAX_MB", 1024))
 
 
-def process_document(file_path: str, api_key: str) -> Optional[Document]:
+def build_embedding_cache() -> Optional[EmbeddingCache]:
+    """Opens the on-disk embedding cache of EMBEDDING_CACHE_DIRECTORY, or returns None if it is disabled. Not done at import:
+    the parsing worker processes import this module too."""
+    if not embedding_cache_directory:
+        return None
+    return EmbeddingCache(embedding_cache_directory, max_megabytes=embedding_cache_max_megabytes)
+
+
+def load_document(file_path: str) -> Document:
+    """
+    Loads a document and chunks its content, without vectors. It is CPU-bound (pdfplumber, pypandoc): the
+    ingestion pipeline of provision.py runs it in worker processes.
+    The file is streamed page by page (or paragraph by paragraph) into the chunker, so the whole content is never
+    held in memory; document.content is left empty and every chunk records the pages it spans in its metadata
+    (and, with the token chunker, its start/end character offsets).
+    
+    Args:
+        file_path (str): The path to the document file to be loaded.
+    
+    Returns:
+        Document: The document with its chunks and their metadata.
+    """
+    document = Document(file_path=file_path)
+    loader = LocalLoader(document=document)
+    if chunker_engine == "words":
+        chunks = Chunker(chunk_size=chunk_size, chunk_overlap_size=chunk_overlap).generate_chunks_from_blocks(loader.iter_blocks())
+    else:
+        chunks = TokenChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap).iter_chunks(loader.iter_blocks())
+    # Step 1 and 2: Stream the blocks of the document into the chunker
+    for chunk, metadata in chunks:
+        document.add_chunks([chunk], [metadata])
+    return document
+
+
+def process_document(file_path: str, api_key: str, embedding_cache: Optional[EmbeddingCache] = None) -> Optional[Document]:
     """
     Main function to process a document by loading it, chunking its content, and generating vectors.
     
     Args:
         file_path (str): The path to the document file to be processed.
         api_key (str): The OpenAI API key for generating vectors.
+        embedding_cache (EmbeddingCache): Cache of the chunk embeddings (optional, see build_embedding_cache).
     
     Returns:
         Document: The processed document with chunks and vectors, or None if an error occurs.
     """
     try:
-        # Step 1: Load the document and generate its content
-        document = Document(file_path=file_path)
-        loader = LocalLoader(document=document)
-        document.content = loader.load()
-        
-        # Step 2: Chunk the document content
-        chunker = Chunker(chunk_size=chunk_size, chunk_overlap_size=chunk_overlap)
-        chunks = chunker.generate_chunks([document.content])
-        document.add_chunks(chunks)
+        # Step 1 and 2: Load the document and chunk its content
+        document = load_document(file_path)
         
         # Step 3: Generate vectors for the chunks using OpenAI embeddings
-        vectorizer = Vectorizer(api_key)
+        vectorizer = Vectorizer(api_key, cache=embedding_cache, **vectorizer_options)
         vectors = vectorizer.generate_vectors(document.chunks)
         document.add_vectors(vectors)
         
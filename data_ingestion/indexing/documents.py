@@ -1,8 +1,8 @@
-from typing import List
+from typing import List, Optional
 
 
 class Document:
-    def __init__(self, file_path: str, content: str = "", chunks: List[str] = None, vectors: List[List[float]] = None):
+    def __init__(self, file_path: str, content: str = "", chunks: List[str] = None, vectors: List[List[float]] = None, metadatas: List[dict] = None):
         """
         Initialize a Document object to store the content, file path, chunks, and vectors.
         
@@ -11,12 +11,14 @@ class Document:
             file_path (str): The path to the document file.
             chunks (List[str]): List of text chunks from the document.
             vectors (List[List[float]]): List of vectors generated for each chunk.
+            metadatas (List[dict]): Metadata of each chunk found while chunking (e.g. the pages it spans).
         """
         self.content = content
         self.file_path = file_path
         self.file_name = self.extract_file_name(file_path)
         self.chunks = chunks if chunks is not None else []
         self.vectors = vectors if vectors is not None else []
+        self.metadatas = metadatas if metadatas is not None else [{} for _ in self.chunks]
 
     def __repr__(self):
         return f"Document(file_name={self.file_name!r}, file_path={self.file_path!r}, content={self.content[:100]!r}...)"
@@ -25,14 +27,16 @@ class Document:
         """Extract the file name from the file path."""
         return file_path.split('/')[-1]  # Modify as needed for your OS
 
-    def add_chunks(self, chunks: List[str]):
+    def add_chunks(self, chunks: List[str], metadatas: Optional[List[dict]] = None):
         """
         Add chunks to the document.
         
         Args:
             chunks (List[str]): List of text chunks.
+            metadatas (List[dict]): Metadata of each chunk (optional).
         """
         self.chunks.extend(chunks)  # Append to existing chunks
+        self.metadatas.extend(metadatas if metadatas is not None else [{} for _ in chunks])
 
     def add_vectors(self, vectors: List[List[float]]):
         """
@@ -2,7 +2,7 @@ import os
 import pdfplumber
 from docx import Document as DocxDocument
 import pypandoc  # Make sure pypandoc is installed
-from typing import Optional
+from typing import Iterator, Optional, Tuple
 from data_ingestion.indexing.documents import Document
 
 class LocalLoader:
@@ -38,6 +38,62 @@ class LocalLoader:
         else:
             raise ValueError(f"Unsupported file type: {self.extension}")
 
+    def iter_blocks(self) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        Streaming load: yields the content as (text, page number) blocks, one PDF page or one paragraph at a time,
+        so a large file is never held in memory at once. Blocks of files without pages have page number None.
+        The blocks keep their separators: joined, they are the content load() returns (up to surrounding whitespace),
+        so character offsets in the stream are offsets in the content.
+
+        Yields:
+            Tuple[str, Optional[int]]: A block of text and its page number (starting at 1).
+        """
+        if self.extension in ['.txt', '.md']:
+            yield from self._iter_text_blocks()
+        elif self.extension == '.pdf':
+            yield from self._iter_pdf_pages()
+        elif self.extension == '.docx':
+            for para in DocxDocument(self.document.file_path).paragraphs:
+                if para.text.strip() != "":
+                    yield para.text + "\n\n", None
+        elif self.extension == '.doc':
+            paragraphs = self._load_doc().split("\n\n")
+            for i, paragraph in enumerate(paragraphs):
+                yield paragraph + ("\n\n" if i < len(paragraphs) - 1 else ""), None
+        else:
+            raise ValueError(f"Unsupported file type: {self.extension}")
+
+    def _iter_text_blocks(self) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        Reads a text or markdown file line by line and yields its paragraphs, each with the blank lines after it.
+        """
+        paragraph = []
+        previous_blank = False
+        with open(self.document.file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    if previous_blank and paragraph:
+                        yield "".join(paragraph), None
+                        paragraph = []
+                    previous_blank = False
+                else:
+                    previous_blank = True
+                paragraph.append(line)
+        if paragraph:
+            yield "".join(paragraph), None
+
+    def _iter_pdf_pages(self) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        Yields the text of every PDF page with its page number. Each page is closed (its parsed objects released)
+        as soon as its text is extracted.
+        """
+        with pdfplumber.open(self.document.file_path) as pdf:
+            for page_number, page in enumerate(pdf.pages, start=1):
+                text = page.extract_text()
+                page.close()
+                if text:  # Only yield if text was extracted
+                    yield text + "\n", page_number
+
     def _load_text(self) -> str:
         """
         Reads content from a text or markdown file and stores it in the Document object.
@@ -56,13 +112,7 @@ class LocalLoader:
         Returns:
             str: The loaded PDF content.
         """
-        content = ""
-        with pdfplumber.open(self.document.file_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:  # Only append if text was extracted
-                    content += text + "\n"
-        self.document.content = content.strip()  # Remove trailing newline
+        self.document.content = "".join(text for text, _ in self._iter_pdf_pages()).strip()  # Remove trailing newline
         return self.document.content
 
     def _load_docx(self) -> str:
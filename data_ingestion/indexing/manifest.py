@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+
+def file_fingerprint(file_path: str) -> Dict[str, object]:
+    """
+    Size, modification time and SHA-256 of a file.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        Dict[str, object]: {"size": ..., "mtime": ..., "sha256": ...}
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256.hexdigest()}
+
+
+class IngestionManifest:
+    def __init__(self, path: str, settings: Optional[Dict[str, object]] = None):
+        """
+        Manifest of the provisioned files: fingerprint (size, mtime, SHA-256) and chunk IDs of every file in the
+        vectorstore, so provision.py only re-processes new or changed files and can delete the chunks of removed ones.
+
+        Args:
+            path (str): JSON file of the manifest (kept in the Chroma persist directory).
+            settings (dict): Settings the chunks depend on (chunker, embedding model). When they differ from the
+                ones of the saved manifest, every file counts as changed.
+        """
+        self.path = path
+        self.settings = settings or {}
+        self.files: Dict[str, dict] = {}
+        self.settings_changed = False
+        self.saved = os.path.exists(path)
+        if self.saved:
+            with open(path, "r", encoding="utf-8") as file:
+                saved = json.load(file)
+            self.files = saved.get("files", {})
+            self.settings_changed = bool(self.files) and saved.get("settings", {}) != self.settings
+        if self.settings_changed:
+            for entry in self.files.values(): # The chunk IDs are kept, to replace them; the fingerprints no longer match
+                entry.update(size=None, mtime=None, sha256=None)
+
+    @property
+    def needs_seed(self) -> bool:
+        """
+        Whether the chunk IDs of the manifest may not be all the chunks in the vectorstore: there is no manifest yet
+        (e.g. a persist directory provisioned before it existed) or the settings changed.
+        """
+        return not self.saved or self.settings_changed
+
+    def seed(self, chunk_ids_by_file: Dict[str, List[str]]):
+        """
+        Adds the chunk IDs found in the vectorstore to the manifest, so re-processing a file deletes all its previous
+        chunks and the chunks of files removed meanwhile are deleted too. Seeded files have no fingerprint, so they
+        count as changed.
+
+        Args:
+            chunk_ids_by_file (dict): Chunk IDs of the vectorstore by file path.
+        """
+        for file_path, chunk_ids in chunk_ids_by_file.items():
+            entry = self.files.setdefault(file_path, {"size": None, "mtime": None, "sha256": None, "chunk_ids": []})
+            known_ids = set(entry["chunk_ids"])
+            entry["chunk_ids"] = entry["chunk_ids"] + [chunk_id for chunk_id in chunk_ids if chunk_id not in known_ids]
+
+    def is_unchanged(self, file_path: str) -> bool:
+        """
+        Whether the file is already provisioned as it is. Size and mtime are checked first; the file is only hashed
+        when they differ (e.g. it was copied or touched), so an unchanged corpus is not read again.
+        """
+        entry = self.files.get(file_path)
+        if entry is None:
+            return False
+        stat = os.stat(file_path)
+        if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+            return True
+        fingerprint = file_fingerprint(file_path)
+        if fingerprint["sha256"] != entry["sha256"]:
+            return False
+        entry.update(fingerprint) # Same content, new mtime: skip the hash next time
+        return True
+
+    def chunk_ids(self, file_path: str) -> List[str]:
+        """Chunk IDs of the file in the vectorstore (empty if it was never provisioned)."""
+        return self.files.get(file_path, {}).get("chunk_ids", [])
+
+    def update(self, file_path: str, chunk_ids: List[str], fingerprint: Optional[Dict[str, object]] = None):
+        """Records the chunks of a provisioned file."""
+        self.files[file_path] = {**(fingerprint or file_fingerprint(file_path)), "chunk_ids": chunk_ids}
+
+    def remove(self, file_path: str) -> List[str]:
+        """Forgets a file. Returns its chunk IDs, to delete them from the vectorstore."""
+        return self.files.pop(file_path, {}).get("chunk_ids", [])
+
+    def removed_files(self, file_paths: List[str]) -> List[str]:
+        """Files of the manifest that are not in file_paths any more."""
+        present = set(file_paths)
+        return [file_path for file_path in self.files if file_path not in present]
+
+    def save(self):
+        """Writes the manifest atomically (a crash leaves the previous one)."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump({"settings": self.settings, "files": self.files}, file, indent=2)
+        os.replace(temporary_path, self.path)
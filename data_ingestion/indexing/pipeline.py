@@ -0,0 +1,172 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple
+from data_ingestion.indexing.document_handler import load_document
+from data_ingestion.indexing.documents import Document
+from data_ingestion.indexing.manifest import IngestionManifest, file_fingerprint
+from data_ingestion.indexing.vectorizer import Vectorizer
+
+_DONE = None  # End of stream marker between the stages
+
+
+def parse_file(file_path: str) -> Tuple[Dict[str, object], Document]:
+    """
+    Parsing stage, run in a worker process: fingerprint, load and chunk a file.
+    The fingerprint is taken before loading, so a file edited meanwhile is processed again on the next run.
+    The content is dropped so only the chunks travel back to the main process.
+    """
+    fingerprint = file_fingerprint(file_path)
+    document = load_document(file_path)
+    document.content = ""
+    return fingerprint, document
+
+
+class IngestionStats:
+    def __init__(self, total_files: int):
+        """Counters of the ingestion pipeline, shared by its stages."""
+        self.total_files = total_files
+        self.parsed_files = 0
+        self.embedded_files = 0
+        self.written_files = 0
+        self.written_chunks = 0
+        self.failed_files: List[str] = []
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        return (f"Parsed {self.parsed_files}/{self.total_files}, embedded {self.embedded_files}, written {self.written_files} files "
+                f"({self.written_chunks} chunks, {len(self.failed_files)} failed) in {elapsed:.1f}s - "
+                f"{self.written_files / elapsed if elapsed else 0:.1f} files/s, {self.written_chunks / elapsed if elapsed else 0:.1f} chunks/s")
+
+
+class IngestionPipeline:
+    def __init__(self, vectorstore, vectorizer: Vectorizer, manifest: IngestionManifest, workers: int = 4, embedding_workers: int = 4,
+                 write_batch_size: int = 1000, queue_size: int = 16, progress_interval: float = 5.0):
+        """
+        Staged ingestion of provision.py, joined by bounded queues so a slow stage holds back the ones before it:
+        1. Parsing (load and chunk) in a pool of `workers` processes, at most queue_size files ahead of the embedding.
+        2. Embedding in `embedding_workers` threads (each Vectorizer call batches the chunks of a file).
+        3. Writing in the calling thread: upserts of at least write_batch_size chunks, then the manifest is saved.
+
+        Args:
+            vectorstore (ChromaVectorStore): Where the chunks are upserted.
+            vectorizer (Vectorizer): Embeds the chunks.
+            manifest (IngestionManifest): Updated with the chunk IDs of every written file.
+            progress_interval (float): Seconds between progress reports.
+        """
+        self.vectorstore = vectorstore
+        self.vectorizer = vectorizer
+        self.manifest = manifest
+        self.workers = max(workers, 1)
+        self.embedding_workers = max(embedding_workers, 1)
+        self.write_batch_size = write_batch_size
+        self.queue_size = queue_size
+        self.progress_interval = progress_interval
+
+    def _parse(self, file_paths: List[str], parsed: queue.Queue, stats: IngestionStats):
+        """Stage 1: submits the files to the process pool, keeping at most queue_size of them in flight."""
+        try:
+            # Spawned, not forked: this process already runs the embedding threads and holds sqlite/HTTP connections
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                pending = {}
+                files = iter(file_paths)
+                while True:
+                    for file_path in files:
+                        pending[executor.submit(parse_file, file_path)] = file_path
+                        if len(pending) >= self.queue_size:
+                            break
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_path = pending.pop(future)
+                        try:
+                            parsed.put(future.result()) # Blocks while the embedding stage is behind
+                            stats.add(parsed_files=1)
+                        except Exception as e:
+                            logging.error(f"An error occurred while parsing {file_path}: {e}")
+                            stats.failed_files.append(file_path)
+        finally:
+            for _ in range(self.embedding_workers):
+                parsed.put(_DONE)
+
+    def _embed(self, parsed: queue.Queue, embedded: queue.Queue, stats: IngestionStats):
+        """Stage 2: embeds the chunks of the parsed files."""
+        try:
+            while True:
+                item = parsed.get()
+                if item is _DONE:
+                    break
+                fingerprint, document = item
+                try:
+                    document.add_vectors(self.vectorizer.generate_vectors(document.chunks) if document.chunks else [])
+                    embedded.put((fingerprint, document))
+                    stats.add(embedded_files=1)
+                except Exception as e:
+                    logging.error(f"An error occurred while embedding {document.file_path}: {e}")
+                    stats.failed_files.append(document.file_path)
+        finally:
+            embedded.put(_DONE)
+
+    def _write(self, documents: List[Tuple[Dict[str, object], Document]], stats: IngestionStats):
+        """Stage 3: one batched upsert for the documents, then their manifest entries."""
+        try:
+            chunk_ids = self.vectorstore.upsert_documents([document for _, document in documents],
+                                                          {document.file_path: self.manifest.chunk_ids(document.file_path) for _, document in documents})
+        except Exception as e:
+            logging.error(f"An error occurred while writing {len(documents)} documents: {e}")
+            stats.failed_files.extend(document.file_path for _, document in documents)
+            return
+        for fingerprint, document in documents:
+            self.manifest.update(document.file_path, chunk_ids[document.file_path], fingerprint)
+        self.manifest.save()
+        stats.add(written_files=len(documents), written_chunks=sum(len(document.chunks) for _, document in documents))
+
+    def run(self, file_paths: List[str]) -> IngestionStats:
+        """Ingests the files and returns the counters. Files that failed keep their previous chunks and manifest entry."""
+        stats = IngestionStats(total_files=len(file_paths))
+        parsed = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        threads = [threading.Thread(target=self._parse, args=(file_paths, parsed, stats), name="ingestion-parse", daemon=True)]
+        threads += [threading.Thread(target=self._embed, args=(parsed, embedded, stats), name=f"ingestion-embed-{i}", daemon=True) for i in range(self.embedding_workers)]
+        for thread in threads:
+            thread.start()
+
+        batch: List[Tuple[Dict[str, object], Document]] = []
+        batch_started = time.perf_counter()
+        running_embedders = self.embedding_workers
+        last_report = time.perf_counter()
+        while running_embedders:
+            try:
+                item = embedded.get(timeout=1.0)
+            except queue.Empty:
+                item = False
+            if item is _DONE:
+                running_embedders -= 1
+            elif item:
+                if not batch:
+                    batch_started = time.perf_counter()
+                batch.append(item)
+            # Write when the batch is full, or it has waited too long (the embedding stage is the bottleneck)
+            if batch and (sum(len(document.chunks) for _, document in batch) >= self.write_batch_size or time.perf_counter() - batch_started >= self.progress_interval):
+                self._write(batch, stats)
+                batch = []
+            if time.perf_counter() - last_report >= self.progress_interval:
+                print(stats.report())
+                last_report = time.perf_counter()
+        if batch:
+            self._write(batch, stats)
+        for thread in threads:
+            thread.join()
+        print(stats.report())
+        return stats
@@ -1,36 +1,100 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+import openai
 from openai import OpenAI
-from typing import List, Union
-client = OpenAI()
+from utils.embedding_cache import EmbeddingCache
+
+# Errors worth retrying: rate limits and transient server or network failures
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (4 characters per token), enough to keep the batches under the request limits."""
+    return len(text) // 4 + 1
+
 
 class Vectorizer:
-    def __init__(self, api_key: str, model: str = "text-embedding-ada-002"):
+    def __init__(self, api_key: str, model: str = "text-embedding-ada-002", batch_size: int = 256, max_batch_tokens: int = 100000,
+                 max_concurrency: int = 4, max_retries: int = 6, backoff_seconds: float = 1.0, max_backoff_seconds: float = 30.0, cache: Optional[EmbeddingCache] = None):
         """
         Initialize the Vectorizer with OpenAI API credentials and the embedding model.
-        
+
         Args:
             api_key (str): The OpenAI API key.
             model (str): The embedding model to use (default is "text-embedding-ada-002").
+            batch_size (int): Maximum number of texts per embeddings request (the API accepts up to 2048).
+            max_batch_tokens (int): Maximum estimated tokens per embeddings request.
+            max_concurrency (int): Maximum number of embeddings requests in flight.
+            max_retries (int): Retries of a batch on rate-limit and transient errors, with exponential backoff.
+            backoff_seconds (float): First backoff, doubled on every retry up to max_backoff_seconds.
+            cache (EmbeddingCache): On-disk embedding cache; only the texts that are not in it are sent to the API.
         """
-        client.api_key = api_key
+        # Retries are handled here, with our own backoff, so the SDK ones are disabled
+        self.client = OpenAI(api_key=api_key, max_retries=0)
         self.model = model
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.cache = cache
+
+    def make_batches(self, texts: List[str]) -> List[List[str]]:
+        """Splits the texts, in order, into batches of at most batch_size texts and max_batch_tokens estimated tokens."""
+        batches = []
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """One embeddings request, retried with exponential backoff and jitter on rate-limit and transient errors."""
+        attempt = 0
+        while True:
+            try:
+                response = self.client.embeddings.create(input=batch, model=self.model)
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = min(self.backoff_seconds * 2 ** (attempt - 1), self.max_backoff_seconds) * random.uniform(0.5, 1.0)
+                logging.warning(f"Embeddings request of {len(batch)} texts failed ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
 
     def generate_vectors(self, chunks: List[str]) -> List[List[float]]:
         """
         Generates embeddings (vectors) for the provided list of chunks using the OpenAI API.
+        The chunks are sent in batches, up to max_concurrency requests at a time.
 
         Args:
             chunks (List[str]): A list of text chunks to generate embeddings for.
 
         Returns:
-            List[List[float]]: A list of embedding vectors corresponding to the input chunks.
+            List[List[float]]: A list of embedding vectors corresponding to the input chunks, in the same order.
         """
-        vectors = []
-        for chunk in chunks:
-            response = client.embeddings.create(input=chunk, model=self.model)
-            vector = response.data[0].embedding
-            vectors.append(vector)
-        return vectors
-    
+        if self.cache is not None:
+            return self.cache.embed(self.model, chunks, self._embed)
+        return self._embed(chunks)
+
+    def _embed(self, chunks: List[str]) -> List[List[float]]:
+        batches = self.make_batches(chunks)
+        if len(batches) <= 1 or self.max_concurrency <= 1:
+            return [vector for batch in batches for vector in self.embed_batch(batch)]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches)), thread_name_prefix="embeddings") as executor:
+            return [vector for vectors in executor.map(self.embed_batch, batches) for vector in vectors]
+
     def __call__(self, input: Union[str, List[str]]) -> List[List[float]]:
         """
         Make this class callable, as required by ChromaDB. Converts input text(s) to embedding vectors.
@@ -44,5 +108,4 @@ class Vectorizer:
         if isinstance(input, str):
             input = [input]
 
-        response = self.client.embeddings.create(input=input, model=self.model)
-        return [item.embedding for item in response.data]
\ No newline at end of file
+        return self.generate_vectors(input)
@@ -1,26 +1,17 @@
-from typing import Dict, Union
+from typing import Awaitable, Callable, Dict, Optional, Union
 from utils.logger import logger
 from utils.conversation import Conversation, ConversationForSales
 from utils.user_data import UserInformation
-from config import db_manager_conversations, db_manager_userdata, assistant_content_filter, assistant_memory, assistant_sales_detector, assistant_consentiment, assistant_request_data, rag, limit_messages_in_conversation, threshold_sales_intention_trigger, privacy_policy_uri
+from utils.stage_scheduler import StageScheduler
+from utils.metrics import current_branch, set_branch, span, start_branch
+from utils.conversation_summary import format_turns
+from config import conversation_states, conversation_summaries, content_prescreen, assistant_memory, sales_detector, consent_detector, assistant_request_data, rag, limit_messages_in_conversation, threshold_sales_intention_trigger, privacy_policy_uri
 
 
 
 def format_var_chat_history(resultados: list[dict])-> str:
     """This function recieves a list of ConversationForSales and for each row (dict), retrieves the questiona dn answer, and generate a string based on that values."""
-    conversacion = ""
-    
-    for registro in resultados:
-        question = registro.get("question")
-        answer = registro.get("answer")
-        
-        if question:
-            conversacion += f"\nUser: {question}"
-        
-        if answer:
-            conversacion += f"\nAssistant: {answer}"
-    
-    return conversacion.strip()  # Remove any unnecessary line breaks at the beginning or end
+    return format_turns(resultados).strip()  # Remove any unnecessary line breaks at the beginning or end
 
 
 def format_var_conversationforsales_messages(resultados: list[dict])-> str:
@@ -41,25 +32,101 @@ thanks_and_true_consent = "Thank you for giving your consent! To proceed, in the
 thanks_and_false_consent= "Understood. You have not given your consent, so we won’t collect any personal information. However, feel free to continue asking any questions you may have — we're here to help!"
 unsafe_user_input = "Bad user input. Please review you message, we have not answer your request due to the following reason: {content_filter}"
 
-def generate_answer(id: str, user_input: str, limit_messages: int = limit_messages_in_conversation)-> Dict[str, Union[str, int]]:
-    """generate_answer recieves a user_input, a conversation_id, a db_manager and a limit_messages, and returns the answer of the user_input and a integer indicating the remaining messages available in the conversation. It also saves the conversation in the db"""
-    
+def conversation_branch(conversation) -> str:
+    """Branch of the state machine that the next message of the conversation will take, if its input is safe (same conditions as _generate_answer)."""
+    if conversation.turn_count == 0:
+        return "first_message"
+    if conversation.last_sales_intention is False:
+        return "sales_detection" if conversation.turn_count < threshold_sales_intention_trigger else "sales_threshold"
+    if conversation.last_sales_intention is True and conversation.last_consent is None:
+        return "consent"
+    if conversation.last_sales_intention is True and conversation.last_consent is True:
+        return "user_data_capture" if conversation.name or conversation.email is None else "user_data_complete"
+    if conversation.last_sales_intention is True and conversation.last_consent is False:
+        return "consent_refused"
+    return "follow_up"
+
+
+def unsafe_answer(content_filter: str, limit_messages: int) -> Dict[str, Union[str, int]]:
+    """Reply to an input the content filter rejected. It does not depend on the conversation, which is not saved."""
+    set_branch("unsafe")
+    answer = unsafe_user_input.format(content_filter = content_filter)
+    remaining_messages = limit_messages - 1
+    return {"answer":answer, "remaining_messages":remaining_messages}
+
+
+async def screen_content(stages: StageScheduler, question: str) -> Dict[str, Union[str, int]]:
+    """Content filter verdict. The local pre-screen decides, for the state of the conversation, whether the input is cleared at once or goes to the content filter assistant.
+    The screening starts at once; only a locally cleared input waits for the conversation to know its state."""
+    async def state() -> str:
+        try:
+            return conversation_branch(await stages.result("conversation"))
+        except Exception: # The conversation failed to load: the content filter decides, _generate_answer handles the error
+            return "unknown"
+    return await content_prescreen.screen(question, state=state())
+
+
+async def first_message_rag_answer(stages: StageScheduler, question: str, on_token: Optional[Callable[[str], Awaitable[None]]] = None) -> Dict[str, Union[str, int]]:
+    """RAG answer to the first message of a conversation. It is served from the semantic cache when a similar first question has already been answered; otherwise the answer is generated and stored in it."""
+    cached_answer, embedding = await stages.result("semantic_cache")
+    if cached_answer is not None:
+        if on_token is not None:
+            await on_token(cached_answer)
+        return {"answer": cached_answer, "tokens_input": 0, "tokens_output": 0}
+    context = await stages.result("context")
+    rag_api_call = await rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = question), question=question, on_token=on_token)
+    rag.remember_answer(question, embedding, rag_api_call.get("answer"))
+    return rag_api_call
+
+
+async def generate_answer(id: str, user_input: str, limit_messages: int = limit_messages_in_conversation, on_token: Optional[Callable[[str], Awaitable[None]]] = None)-> Dict[str, Union[str, int]]:
+    """generate_answer recieves a user_input, a conversation_id, a db_manager and a limit_messages, and returns the answer of the user_input and a integer indicating the remaining messages available in the conversation. It also saves the conversation in the db.
+    If on_token is given, the RAG completion is streamed through it; the returned answer is still the complete one (including any consent suffix)."""
+    start_branch()
+    with span("generate_answer"):
+        async with StageScheduler() as stages: # Speculative stages still pending on return are cancelled
+            result = await _generate_answer(stages, id, user_input, limit_messages, on_token)
+            conversation = await stages.result("conversation") if current_branch() != "unsafe" else None # Unsafe input is not saved: nothing new to summarize
+    if conversation is not None:
+        conversation_summaries.schedule(id, conversation) # Folds the pending turns into the rolling summary in the background
+    return result
+
+
+async def _generate_answer(stages: StageScheduler, id: str, user_input: str, limit_messages: int, on_token: Optional[Callable[[str], Awaitable[None]]] = None)-> Dict[str, Union[str, int]]:
+    """State machine behind generate_answer. On the first message the content filter, the sales detector and the retrieval run concurrently; the filter verdict is still checked before anything is answered or saved."""
     tokens_input = 0
     tokens_output = 0
     question = user_input
     logger.info(f"conversation_id: {id} - question: {question}")
 
-    assistant_content_filter_api_call = assistant_content_filter.chat_completion_response(prompt=assistant_content_filter.base_prompt, question=question)
+    stages.start("conversation", conversation_states.get(conversation_id=id))
+    stages.start("content_filter", screen_content(stages, question))
+    try:
+        conversation = await stages.result("conversation")
+    except Exception:
+        # Unsafe input is answered without the conversation: a failed load only fails the request when the input is safe
+        assistant_content_filter_api_call = await stages.result("content_filter")
+        if "true" in assistant_content_filter_api_call.get("answer"):
+            raise
+        logger.info(f"conversation_id: {id} - assistant_content_filter_api_call: {assistant_content_filter_api_call}")
+        return unsafe_answer(assistant_content_filter_api_call.get("answer"), limit_messages)
+    turn_count = conversation.turn_count
+    set_branch("first_message" if turn_count == 0 else "follow_up")
+    if turn_count == 0: # First message: sales detection and retrieval only depend on the question
+        stages.start("sales_detector", sales_detector.classify(question))
+        query_context = rag.query_context(question) # Embedded once for the retrieval and the semantic cache
+        stages.start("context", rag.get_context(question=question, query_context=query_context))
+        stages.start("semantic_cache", rag.lookup_answer(question=question, query_context=query_context))
+
+    assistant_content_filter_api_call = await stages.result("content_filter")
     tokens_input += assistant_content_filter_api_call.get("tokens_input")
     tokens_output += assistant_content_filter_api_call.get("tokens_output")
     content_filter = assistant_content_filter_api_call.get("answer")
     logger.info(f"conversation_id: {id} - assistant_content_filter_api_call: {assistant_content_filter_api_call}")
     
     if "true" in content_filter: # Safe user_input
-        conversation = db_manager_conversations.buscar_conversaciones_por_id(conversation_id=id)
-        
-        if len(conversation) == 0: # When it is the first message in the conversation
-            sales_intention_api_call = assistant_sales_detector.chat_completion_response(prompt=assistant_sales_detector.base_prompt, question=question)
+        if turn_count == 0: # When it is the first message in the conversation
+            sales_intention_api_call = await stages.result("sales_detector")
             tokens_input += sales_intention_api_call.get("tokens_input")
             tokens_output += sales_intention_api_call.get("tokens_output")
             logger.info(f"conversation_id: {id} - sales_intention_api_call: {sales_intention_api_call}")
@@ -68,14 +135,13 @@ def generate_answer(id: str, user_input: str, limit_messages: int = limit_messag
                 logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
                 consent = None
                 logger.info(f"conversation_id: {id} - consent: {consent}")
-                context = rag.get_context(question=question)
-                rag_api_call = rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = question), question=question)
+                rag_api_call = await first_message_rag_answer(stages, question, on_token)
                 tokens_input += rag_api_call.get("tokens_input")
                 tokens_output += rag_api_call.get("tokens_output")
                 answer = rag_api_call.get("answer") +  request_consent.format(privacy_policy = privacy_policy_uri)
                 logger.info(f"conversation_id: {id} - answer: {answer}")
                 conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
                 remaining_messages = limit_messages
                 return {"answer":answer, "remaining_messages":remaining_messages}
             else:
@@ -83,29 +149,29 @@ def generate_answer(id: str, user_input: str, limit_messages: int = limit_messag
                 logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
                 consent = None
                 logger.info(f"conversation_id: {id} - consent: {consent}")
-                context = rag.get_context(question=question)
-                rag_api_call = rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = question), question=question)
+                rag_api_call = await first_message_rag_answer(stages, question, on_token)
                 tokens_input += rag_api_call.get("tokens_input")
                 tokens_output += rag_api_call.get("tokens_output")
                 answer = rag_api_call.get("answer")
                 logger.info(f"conversation_id: {id} - answer: {answer}")
                 conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
                 remaining_messages = limit_messages - 1
                 return {"answer":answer, "remaining_messages":remaining_messages} 
         
         else: # When the conversation has previos messages.
-            last_sales_intention = conversation[-1].get("sales_intention")
-            last_consent = conversation[-1].get("consent")
-            var_chat_history = format_var_chat_history(resultados=conversation)
-            chat_history_api_call = assistant_memory.chat_completion_response(prompt=assistant_memory.base_prompt.format(var_chat_history=var_chat_history,question=question), question="")
+            last_sales_intention = conversation.last_sales_intention
+            last_consent = conversation.last_consent
+            var_chat_history = conversation_summaries.chat_history(conversation) # Rolling summary and the newest turns
+            chat_history_api_call = await assistant_memory.chat_completion_response(prompt=assistant_memory.base_prompt.format(var_chat_history=var_chat_history,question=question), question="")
             tokens_input += chat_history_api_call.get("tokens_input")
             tokens_output += chat_history_api_call.get("tokens_output")
             chat_history = chat_history_api_call.get("answer")
 
             # when last_sales_intention is False:
-            if last_sales_intention is False and len(conversation) < threshold_sales_intention_trigger:
-                sales_intention_api_call = assistant_sales_detector.chat_completion_response(prompt=assistant_sales_detector.base_prompt, question=chat_history)
+            if last_sales_intention is False and turn_count < threshold_sales_intention_trigger:
+                set_branch("sales_detection")
+                sales_intention_api_call = await sales_detector.classify(question, llm_question=chat_history)
                 tokens_input += sales_intention_api_call.get("tokens_input")
                 tokens_output += sales_intention_api_call.get("tokens_output")
                 logger.info(f"conversation_id: {id} - sales_intention_api_call: {sales_intention_api_call}")
@@ -114,53 +180,55 @@ def generate_answer(id: str, user_input: str, limit_messages: int = limit_messag
                     logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
                     consent = None
                     logger.info(f"conversation_id: {id} - consent: {consent}")
-                    context = rag.get_context(question=question)
-                    rag_api_call = rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history)
+                    context = await rag.get_context(question=question)
+                    rag_api_call = await rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history, on_token=on_token)
                     tokens_input += rag_api_call.get("tokens_input")
                     tokens_output += rag_api_call.get("tokens_output")
                     answer = rag_api_call.get("answer") + request_consent.format(privacy_policy = privacy_policy_uri)
                     logger.info(f"conversation_id: {id} - answer: {answer}")
                     conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                    db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                    remaining_messages = limit_messages - len(conversation) + 2
+                    await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                    remaining_messages = limit_messages - turn_count + 2
                     return {"answer":answer, "remaining_messages":remaining_messages} 
                 else:
                     sales_intention = False
                     logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
                     consent = None
                     logger.info(f"conversation_id: {id} - consent: {consent}")
-                    context = rag.get_context(question=question)
-                    rag_api_call = rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history)
+                    context = await rag.get_context(question=question)
+                    rag_api_call = await rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history, on_token=on_token)
                     tokens_input += rag_api_call.get("tokens_input")
                     tokens_output += rag_api_call.get("tokens_output")
                     answer = rag_api_call.get("answer")
                     logger.info(f"conversation_id: {id} - answer: {answer}")
                     conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                    db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                    remaining_messages = limit_messages - len(conversation) - 1
+                    await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                    remaining_messages = limit_messages - turn_count - 1
                     return {"answer":answer, "remaining_messages":remaining_messages} 
             
-            elif last_sales_intention is False and len(conversation) >= threshold_sales_intention_trigger:
+            elif last_sales_intention is False and turn_count >= threshold_sales_intention_trigger:
+                set_branch("sales_threshold")
                 sales_intention = True
                 logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
                 consent = None
                 logger.info(f"conversation_id: {id} - consent: {consent}")
-                context = rag.get_context(question=question)
-                rag_api_call = rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history)
+                context = await rag.get_context(question=question)
+                rag_api_call = await rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history, on_token=on_token)
                 tokens_input += rag_api_call.get("tokens_input")
                 tokens_output += rag_api_call.get("tokens_output")
                 answer = rag_api_call.get("answer") + request_consent.format(privacy_policy = privacy_policy_uri)
                 logger.info(f"conversation_id: {id} - answer: {answer}")
                 conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                remaining_messages = limit_messages - len(conversation) + 2
+                await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                remaining_messages = limit_messages - turn_count + 2
                 return {"answer":answer, "remaining_messages":remaining_messages} 
 
             # when last_sales_intention is True and last_consent is None:
             elif last_sales_intention is True and last_consent is None:
+                set_branch("consent")
                 sales_intention = True
                 logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
-                consent_api_call = assistant_consentiment.chat_completion_response(prompt=assistant_consentiment.base_prompt, question=question)
+                consent_api_call = await consent_detector.classify(question)
                 tokens_input += consent_api_call.get("tokens_input")
                 tokens_output += consent_api_call.get("tokens_output")
                 if consent_api_call.get("answer") in ["Strong", "Moderate"]:
@@ -169,8 +237,8 @@ def generate_answer(id: str, user_input: str, limit_messages: int = limit_messag
                     answer = thanks_and_true_consent
                     logger.info(f"conversation_id: {id} - answer: {answer}")
                     conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                    db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                    remaining_messages = limit_messages - len(conversation) - 1
+                    await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                    remaining_messages = limit_messages - turn_count - 1
                     return {"answer":answer, "remaining_messages":remaining_messages} 
                 else:
                     consent = False
@@ -178,21 +246,21 @@ def generate_answer(id: str, user_input: str, limit_messages: int = limit_messag
                     answer = thanks_and_false_consent
                     logger.info(f"conversation_id: {id} - answer: {answer}")
                     conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                    db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                    remaining_messages = limit_messages - len(conversation) - 1
+                    await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                    remaining_messages = limit_messages - turn_count - 1
                     return {"answer":answer, "remaining_messages":remaining_messages} 
 
             # when last_sales_intention is True and last_content is True:        
             elif last_sales_intention is True and last_consent is True:
-                conversation_for_sale = db_manager_userdata.buscar_conversaciones_por_id(conversation_id=id)
-                last_name = conversation_for_sale[-1].get("name") if conversation_for_sale else None
-                last_email = conversation_for_sale[-1].get("email") if conversation_for_sale else None
+                last_name = conversation.name
+                last_email = conversation.email
 
                 if last_name or last_email is None: #There are variables missing to "catch" the sale
-                    if len(conversation_for_sale) == 0:
+                    set_branch("user_data_capture")
+                    if conversation.user_data_count == 0:
                         messages = question
                     else:
-                        messages = format_var_conversationforsales_messages(resultados=conversation) + f"\nLast Message : {question}"
+                        messages = format_var_conversationforsales_messages(resultados=conversation.sales_messages) + f"\nLast Message : {question}"
                     
                     sales_intention = True
                     logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
@@ -200,58 +268,58 @@ def generate_answer(id: str, user_input: str, limit_messages: int = limit_messag
                     logger.info(f"conversation_id: {id} - consent: {consent}")
                     
                     # Scrap User Data in the message.
-                    user_data_api_call = assistant_request_data.chat_completion_structured_response(prompt=messages, output_format=UserInformation)
+                    user_data_api_call = await assistant_request_data.chat_completion_structured_response(prompt=messages, output_format=UserInformation)
                     tokens_input += user_data_api_call.get("tokens_input")
                     tokens_output += user_data_api_call.get("tokens_output")
                     user_data = user_data_api_call.get("answer")
                     logger.info(f"conversation_id: {id} - user_data: {user_data}")
                     user_data_to_save = ConversationForSales(conversation_id=id, name=user_data.name, email=user_data.email, message=question)
-                    db_manager_userdata.add_item(user_data_to_save) # SAVE conversation_to_save IN DB
+                    await conversation_states.add_item(user_data_to_save) # SAVE conversation_to_save IN DB
 
                     # Generate a responses requesting the missing user data.
-                    response_api_call = assistant_request_data.chat_completion_response(prompt=assistant_request_data.base_prompt.format(user_data = UserInformation.schema_json(indent=2), current_data = user_data), question="")
+                    response_api_call = await assistant_request_data.chat_completion_response(prompt=assistant_request_data.base_prompt.format(user_data = UserInformation.schema_json(indent=2), current_data = user_data), question="")
                     tokens_input += response_api_call.get("tokens_input")
                     tokens_output += response_api_call.get("tokens_output")
                     answer = response_api_call.get("answer")
                     conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                    db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                    remaining_messages = limit_messages - len(conversation)
+                    await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                    remaining_messages = limit_messages - turn_count
                     return {"answer":answer, "remaining_messages":remaining_messages}
                 
                 else: #There are all the variables to "catch" the sale
+                    set_branch("user_data_complete")
                     sales_intention = True
                     logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
                     consent = last_consent
                     logger.info(f"conversation_id: {id} - consent: {consent}")
-                    context = rag.get_context(question=question)
-                    rag_api_call = rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history)
+                    context = await rag.get_context(question=question)
+                    rag_api_call = await rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history, on_token=on_token)
                     tokens_input += rag_api_call.get("tokens_input")
                     tokens_output += rag_api_call.get("tokens_output")
                     answer = rag_api_call.get("answer")
                     logger.info(f"conversation_id: {id} - answer: {answer}")
                     conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                    db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                    remaining_messages = limit_messages - len(conversation) - 1
+                    await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                    remaining_messages = limit_messages - turn_count - 1
                     return {"answer":answer, "remaining_messages":remaining_messages} 
 
             # when last_sales_intention is True and last_content is False:
             elif last_sales_intention is True and last_consent is False:
+                set_branch("consent_refused")
                 sales_intention = True
                 logger.info(f"conversation_id: {id} - sales_intention: {sales_intention}")
                 consent = last_consent
                 logger.info(f"conversation_id: {id} - consent: {consent}")
-                context = rag.get_context(question=question)
-                rag_api_call = rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history)
+                context = await rag.get_context(question=question)
+                rag_api_call = await rag.chat_completion_response(prompt=rag.base_prompt.format(context=context, question = chat_history), question=chat_history, on_token=on_token)
                 tokens_input += rag_api_call.get("tokens_input")
                 tokens_output += rag_api_call.get("tokens_output")
                 answer = rag_api_call.get("answer")
                 logger.info(f"conversation_id: {id} - answer: {answer}")
                 conversation_to_save = Conversation(conversation_id=id, question=question, answer=answer, sales_intention=sales_intention, consent=consent)
-                db_manager_conversations.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
-                remaining_messages = limit_messages - len(conversation) - 1
+                await conversation_states.add_item(conversation_to_save) # SAVE conversation_to_save IN DB
+                remaining_messages = limit_messages - turn_count - 1
                 return {"answer":answer, "remaining_messages":remaining_messages} 
 
     else:
-        answer = unsafe_user_input.format(content_filter = content_filter)
-        remaining_messages = limit_messages - 1
-        return {"answer":answer, "remaining_messages":remaining_messages}
\ No newline at end of file
+        return unsafe_answer(content_filter, limit_messages)
\ No newline at end of file
@@ -1,6 +1,12 @@
+#python provision.py             -> incremental: only new or changed files are processed, chunks of removed files are deleted
+#python provision.py --full      -> re-processes every file
+#python provision.py --workers 8 -> parsing processes (default: one per core)
+import argparse
 import os
 from storage.vector_db.vectorstore import ChromaVectorStore
-from data_ingestion.indexing.document_handler import process_document
+from data_ingestion.indexing.document_handler import build_embedding_cache, chunker_settings, vectorizer_options
+from data_ingestion.indexing.manifest import IngestionManifest
+from data_ingestion.indexing.pipeline import IngestionPipeline
 from data_ingestion.indexing.vectorizer import Vectorizer
 import logging
 from dotenv import load_dotenv
@@ -8,37 +14,75 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-# Get the OpenAI API key from the environment variables
-api_key = os.environ.get("OPENAI_API_KEY")
-
-persist_directory = os.environ.get("CHROMADB_PERSIST_DIRECTORY")
-#persist_directory = "./vectorstore_test"
-logging.info(f"persist_directory: {persist_directory}")
-data_directory = os.environ.get("DATA_DIRECTORY")
-#data_directory = "./data_ingestion/data"
-logging.info(f"data_directory: {data_directory}")
-
-
-embedding_fn = Vectorizer(api_key)
-# Initialize the Chroma vectorstore with persistence
-vectorstore = ChromaVectorStore(
-    collection_name=os.environ.get("CHROMADB_COLLECTION_NAME"),
-    embedding_function=embedding_fn,
-    persist_directory=persist_directory
-)
-
-# Iterate over the files in the directory
-for elemento in os.listdir(data_directory):
-    # Construct the full file path
-    file_path = os.path.join(data_directory, elemento)
-    
-    # Process the document
-    result = process_document(file_path=file_path, api_key=api_key)
-
-    # Display the result
-    print(f"Processing document: {file_path}")
-    
-    # Add the document to the vectorstore
-    vectorstore.add_document(result)
-
-logging.info("Data Ingestion finished!")
\ No newline at end of file
+
+def main():
+    parser = argparse.ArgumentParser(description="Provisions the Chroma vectorstore with the documents of DATA_DIRECTORY.")
+    parser.add_argument("--full", action="store_true", help="Re-process every file, not only the new or changed ones.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes that load and chunk the files.")
+    parser.add_argument("--embedding-workers", type=int, default=int(os.environ.get("INGESTION_EMBEDDING_WORKERS", 4)), help="Files embedded at the same time.")
+    parser.add_argument("--write-batch-size", type=int, default=int(os.environ.get("INGESTION_WRITE_BATCH_SIZE", 1000)), help="Chunks per vectorstore write.")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Seconds between progress reports.")
+    args = parser.parse_args()
+
+    # Get the OpenAI API key from the environment variables
+    api_key = os.environ.get("OPENAI_API_KEY")
+
+    persist_directory = os.environ.get("CHROMADB_PERSIST_DIRECTORY")
+    #persist_directory = "./vectorstore_test"
+    logging.info(f"persist_directory: {persist_directory}")
+    data_directory = os.environ.get("DATA_DIRECTORY")
+    #data_directory = "./data_ingestion/data"
+    logging.info(f"data_directory: {data_directory}")
+
+    embedding_cache = build_embedding_cache()
+    embedding_fn = Vectorizer(api_key, cache=embedding_cache, **vectorizer_options)
+    # Initialize the Chroma vectorstore with persistence
+    vectorstore = ChromaVectorStore(
+        collection_name=os.environ.get("CHROMADB_COLLECTION_NAME"),
+        embedding_function=embedding_fn,
+        persist_directory=persist_directory
+    )
+    # File hash/mtime -> chunk IDs of what is already in the vectorstore
+    manifest = IngestionManifest(os.path.join(persist_directory or ".", "ingestion_manifest.json"),
+                                 settings={"chunker": chunker_settings, "embedding_model": embedding_fn.model})
+    if manifest.settings_changed:
+        print("Chunker or embedding settings changed: every file is re-processed.")
+    if manifest.needs_seed:
+        # The manifest may not list every chunk of the collection: take them from the collection, so the stale chunks
+        # of re-processed files and the chunks of files removed before the manifest existed are deleted too
+        manifest.seed(vectorstore.chunk_ids_by_file())
+
+    file_paths = [os.path.join(data_directory, elemento) for elemento in sorted(os.listdir(data_directory))]
+    changed_files = [file_path for file_path in file_paths if args.full or not manifest.is_unchanged(file_path)]
+    print(f"{len(changed_files)} of {len(file_paths)} files are new or changed.")
+
+    # Load and chunk (worker processes) -> embed (threads) -> batched upserts, joined by bounded queues
+    pipeline = IngestionPipeline(vectorstore=vectorstore, vectorizer=embedding_fn, manifest=manifest, workers=args.workers, embedding_workers=args.embedding_workers,
+                                 write_batch_size=args.write_batch_size, progress_interval=args.progress_interval)
+    stats = pipeline.run(changed_files) if changed_files else None
+    changed = stats.written_files if stats else 0
+
+    # Delete the chunks of the files that are no longer in the directory
+    for file_path in manifest.removed_files(file_paths):
+        print(f"Removing document: {file_path}")
+        chunk_ids = manifest.remove(file_path)
+        if chunk_ids:
+            vectorstore.delete_documents(chunk_ids)
+        changed += 1
+    manifest.save()
+    # BM25 index of text_search, updated with the upserts and deletions (saved before the app is told to reload it)
+    vectorstore.save_lexical_index()
+
+    if changed:
+        # Answers cached on the previous corpus (semantic cache) are no longer valid
+        vectorstore.bump_corpus_version()
+    if stats and stats.failed_files:
+        print(f"Failed files (their previous chunks are kept, they are retried on the next run): {stats.failed_files}")
+    if embedding_cache is not None:
+        logging.info(f"Embedding cache: {embedding_cache.stats()}")
+        embedding_cache.close()
+    logging.info("Data Ingestion finished!")
+
+
+if __name__ == "__main__":
+    main()
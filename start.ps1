@@ -73,16 +73,9 @@ if (-Not $containerExists) {
     }
 }
 
-# Obtener variable de entorno
-$persistDir = [Environment]::GetEnvironmentVariable("CHROMADB_PERSIST_DIRECTORY")
-
-# Ejecutar provision.py si el directorio no existe
-if (-Not (Test-Path $persistDir)) {
-    Write-Host ">> Directory $persistDir does not exist. Running provision.py..."
-    python provision.py
-} else {
-    Write-Host ">> Directory $persistDir already exists. Skipping provision."
-}
+# Ejecutar provision.py: es incremental, solo procesa los archivos nuevos o modificados (usar --full para reprocesar todo)
+Write-Host ">> Running provision.py (incremental)..."
+python provision.py
 
 # Ejecutar app.py
 Write-Host ">> Starting app.py..."
@@ -73,13 +73,9 @@ else
     fi
 fi
 
-# Ejecutar provision.py si el directorio de persistencia no existe
-if [ ! -d "$CHROMADB_PERSIST_DIRECTORY" ]; then
-    echo ">> Directory $CHROMADB_PERSIST_DIRECTORY does not exist. Running provision.py..."
-    python provision.py
-else
-    echo ">> Directory $CHROMADB_PERSIST_DIRECTORY already exists. Skipping provision."
-fi
+# Ejecutar provision.py: es incremental, solo procesa los archivos nuevos o modificados (usar --full para reprocesar todo)
+echo ">> Running provision.py (incremental)..."
+python provision.py
 
 # Ejecutar aplicación
 echo ">> Starting app.py..."
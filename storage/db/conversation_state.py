@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional
+from bson.objectid import ObjectId
+from storage.db.db_manager import CONVERSATION_WINDOW, MongoDBManager
+from utils.conversation import BaseConversation, ConversationForSales
+from utils.metrics import metrics
+
+state_cache_requests = metrics.counter("chatbot_conversation_state_cache_requests_total", "Lookups in the conversation state cache by result (hit/miss/stale).")
+state_cache_evictions = metrics.counter("chatbot_conversation_state_cache_evictions_total", "Conversation states evicted from the cache (size, ttl or stale).")
+
+
+def _created_at(document: dict) -> float:
+    """Creation time (epoch seconds) of a Mongo document, taken from its ObjectId."""
+    _id = document.get("_id")
+    return _id.generation_time.timestamp() if isinstance(_id, ObjectId) else time.time()
+
+
+class ConversationState:
+    """
+    What generate_answer needs to know about a conversation: turn count, flags of the last turn, the captured user data,
+    the recent turns and the rolling summary, which covers the first summarized_turns turns.
+    """
+
+    def __init__(self, conversation_id: str, max_recent_turns: int = 20):
+        self.conversation_id = conversation_id
+        self.turn_count = 0
+        self.last_sales_intention = None
+        self.last_consent = None
+        self.recent_turns: Deque[dict] = deque(maxlen=max_recent_turns)
+        self.user_data_count = 0
+        self.name = None
+        self.email = None
+        self.sales_messages: Deque[dict] = deque(maxlen=max_recent_turns)
+        self.summary: Optional[str] = None
+        self.summarized_turns = 0
+        self.oldest_document_at: Optional[float] = None
+
+    def add_turn(self, turn: dict, created_at: float):
+        self.turn_count += 1
+        self.last_sales_intention = turn.get("sales_intention")
+        self.last_consent = turn.get("consent")
+        self.recent_turns.append(turn)
+        if turn.get("summary"): # The summary is stored in the last turn it covers
+            self.summary = turn["summary"]
+            self.summarized_turns = self.turn_count
+        self._seen(created_at)
+
+    def unsummarized_turns(self) -> List[dict]:
+        """The recent turns that are not yet part of the summary, oldest first."""
+        pending = self.turn_count - self.summarized_turns
+        return list(self.recent_turns)[-pending:] if pending > 0 else []
+
+    def add_user_data(self, user_data: dict, created_at: float):
+        self.user_data_count += 1
+        self.name = user_data.get("name")
+        self.email = user_data.get("email")
+        self.sales_messages.append(user_data)
+        self._seen(created_at)
+
+    def _seen(self, created_at: float):
+        if self.oldest_document_at is None or created_at < self.oldest_document_at:
+            self.oldest_document_at = created_at
+
+    def expires_at(self, loaded_at: float) -> float:
+        """The state is valid until its oldest document leaves the one-week window of MongoDBManager."""
+        return (self.oldest_document_at if self.oldest_document_at is not None else loaded_at) + CONVERSATION_WINDOW.total_seconds()
+
+
+class ConversationStateCache:
+    """
+    Write-through cache of ConversationState, so a turn does not re-read the whole conversation from Mongo.
+
+    On a miss the state is loaded from the conversations and userdata collections; add_item writes to Mongo and then
+    updates the cached state. Entries expire when their oldest document leaves the one-week window and the least
+    recently used are evicted above max_size (0 disables the cache).
+    The cache is per process. With validate, a hit is trusted only if the turn count in Mongo (counted from the
+    conversation_id + _id index) still matches it, so a turn served by another worker reloads the state. Every turn
+    writes a conversations document (after its user data), so the count also covers the userdata collection.
+    """
+
+    def __init__(self, conversations: MongoDBManager, userdata: MongoDBManager, max_size: int = 10000, max_recent_turns: int = 20, validate: bool = True):
+        self.conversations = conversations
+        self.userdata = userdata
+        self.max_size = max_size
+        self.max_recent_turns = max_recent_turns
+        self.validate = validate
+        self.entries: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _get_cached(self, conversation_id: str) -> Optional[ConversationState]:
+        with self.lock:
+            state = self.entries.get(conversation_id)
+            if state is not None and state.expires_at(time.time()) < time.time():
+                del self.entries[conversation_id]
+                state_cache_evictions.inc(reason="ttl")
+                state = None
+            if state is not None:
+                self.entries.move_to_end(conversation_id)
+            return state
+
+    async def _is_current(self, state: ConversationState) -> bool:
+        """Whether no other process added turns to the conversation since the state was cached (a count covered by the index)."""
+        return await self.conversations.count_messages_in_conversation(state.conversation_id, within_window=True) == state.turn_count
+
+    def _put(self, state: ConversationState):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[state.conversation_id] = state
+            self.entries.move_to_end(state.conversation_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                state_cache_evictions.inc(reason="size")
+
+    async def load(self, conversation_id: str) -> ConversationState:
+        """
+        Builds the state from Mongo: the turn count (from the index) and only the last max_recent_turns turns and user
+        data rows, so loading costs the same however long the conversation is.
+        """
+        state = ConversationState(conversation_id, max_recent_turns=self.max_recent_turns)
+        turn_count = await self.conversations.count_messages_in_conversation(conversation_id, within_window=True)
+        if turn_count == 0:
+            return state # User data is only saved after a consent turn, so new conversations skip those queries
+        turns = await self.conversations.get_last_items(conversation_id, self.max_recent_turns)
+        state.turn_count = turn_count - len(turns) # The older turns are only counted
+        if state.turn_count > 0:
+            oldest = await self.conversations.get_oldest_item(conversation_id)
+            if oldest is not None:
+                state._seen(_created_at(oldest))
+        for turn in turns:
+            state.add_turn(turn, _created_at(turn))
+        user_data = await self.userdata.get_last_items(conversation_id, self.max_recent_turns)
+        for row in user_data:
+            state.add_user_data(row, _created_at(row))
+        return state
+
+    async def get(self, conversation_id: str) -> ConversationState:
+        """Returns the state of a conversation, from the cache (if it is still current) or from Mongo."""
+        state = self._get_cached(conversation_id)
+        if state is not None and self.validate and not await self._is_current(state):
+            with self.lock:
+                if self.entries.get(conversation_id) is state:
+                    del self.entries[conversation_id]
+            state_cache_requests.inc(result="stale")
+            state_cache_evictions.inc(reason="stale")
+            self.misses += 1
+            state = None
+        elif state is not None:
+            self.hits += 1
+            state_cache_requests.inc(result="hit")
+            return state
+        else:
+            self.misses += 1
+            state_cache_requests.inc(result="miss")
+        state = await self.load(conversation_id)
+        with self.lock:
+            cached = self.entries.get(conversation_id) # A concurrent turn may have loaded (and updated) it meanwhile
+        if cached is not None:
+            return cached
+        self._put(state)
+        return state
+
+    async def add_item(self, item: BaseConversation) -> str:
+        """Saves a Conversation (conversations collection) or ConversationForSales (userdata collection) and updates the cached state."""
+        is_user_data = isinstance(item, ConversationForSales)
+        manager = self.userdata if is_user_data else self.conversations
+        inserted_id = await manager.add_item(item)
+        if not inserted_id:
+            self.invalidate(item.conversation_id) # The write failed, let the next turn read Mongo
+            return inserted_id
+        with self.lock:
+            state = self.entries.get(item.conversation_id)
+        if state is not None:
+            document = item.to_dict()
+            document["_id"] = ObjectId(inserted_id)
+            if is_user_data:
+                state.add_user_data(document, time.time())
+            else:
+                state.add_turn(document, time.time())
+        return inserted_id
+
+    async def set_summary(self, conversation_id: str, turn: dict, summary: str, summarized_turns: int):
+        """Stores the rolling summary in the document of the last turn it covers and in the cached state."""
+        turn["summary"] = summary
+        with self.lock:
+            state = self.entries.get(conversation_id)
+        if state is not None and summarized_turns > state.summarized_turns:
+            state.summary = summary
+            state.summarized_turns = summarized_turns
+        if "_id" in turn:
+            await self.conversations.update_item(str(turn["_id"]), {"summary": summary})
+
+    def invalidate(self, conversation_id: str):
+        with self.lock:
+            self.entries.pop(conversation_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,129 @@
+import logging
+import threading
+from typing import Dict, Optional
+from pymongo import AsyncMongoClient, errors
+from pymongo import monitoring
+from utils.metrics import metrics
+
+pool_wait = metrics.summary("chatbot_mongo_pool_wait_seconds", "Time waited to check a connection out of the Mongo pool.")
+pool_checkouts = metrics.counter("chatbot_mongo_pool_checkouts_total", "Connection checkouts from the Mongo pool by result (ok, or the failure reason: timeout, connectionError, poolClosed).")
+pool_checked_out = metrics.gauge("chatbot_mongo_pool_checked_out", "Connections of the Mongo pool in use.")
+pool_connections = metrics.gauge("chatbot_mongo_pool_connections", "Open connections of the Mongo pool.")
+
+
+def _address(address) -> str:
+    return f"{address[0]}:{address[1]}" if isinstance(address, tuple) else str(address)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Exports the connection pool events of the Mongo clients to the metrics registry, labelled by server address."""
+
+    def __init__(self):
+        self.checked_out: Dict[str, int] = {}
+        self.connections: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _add(self, counts: Dict[str, int], gauge, address: str, delta: int):
+        with self.lock:
+            counts[address] = max(counts.get(address, 0) + delta, 0)
+            gauge.set(counts[address], address=address)
+
+    def connection_checked_out(self, event):
+        pool_wait.observe(event.duration, address=_address(event.address))
+        pool_checkouts.inc(address=_address(event.address), result="ok")
+        self._add(self.checked_out, pool_checked_out, _address(event.address), 1)
+
+    def connection_check_out_failed(self, event):
+        pool_wait.observe(event.duration, address=_address(event.address))
+        pool_checkouts.inc(address=_address(event.address), result=str(event.reason))
+
+    def connection_checked_in(self, event):
+        self._add(self.checked_out, pool_checked_out, _address(event.address), -1)
+
+    def connection_created(self, event):
+        self._add(self.connections, pool_connections, _address(event.address), 1)
+
+    def connection_closed(self, event):
+        self._add(self.connections, pool_connections, _address(event.address), -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+class MongoClientRegistry:
+    """
+    One AsyncMongoClient (and so one connection pool) per URI, shared by every MongoDBManager of the process.
+
+    The pool and timeout settings apply to every client. Each worker process opens its own pool, so keep
+    workers * max_pool_size below the connection limit of the server. Managers acquire() the client and release()
+    it on close; the client is closed when the last manager releases it.
+    """
+
+    def __init__(self, max_pool_size: int = 20, min_pool_size: int = 0, max_idle_time_ms: Optional[int] = 60000, wait_queue_timeout_ms: Optional[int] = 5000,
+                 connect_timeout_ms: int = 5000, socket_timeout_ms: Optional[int] = 30000, server_selection_timeout_ms: int = 5000):
+        self.options = dict(
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            maxIdleTimeMS=max_idle_time_ms,
+            waitQueueTimeoutMS=wait_queue_timeout_ms,
+            connectTimeoutMS=connect_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+        )
+        self.clients: Dict[str, AsyncMongoClient] = {}
+        self.references: Dict[str, int] = {}
+        self.listener = PoolMetricsListener()
+        self.lock = threading.Lock()
+
+    def acquire(self, uri: str) -> AsyncMongoClient:
+        """Returns the shared client of the URI, creating it on first use. It connects lazily on the first operation."""
+        with self.lock:
+            if uri not in self.clients:
+                self.clients[uri] = AsyncMongoClient(uri, event_listeners=[self.listener], **self.options)
+                self.references[uri] = 0
+            self.references[uri] += 1
+            return self.clients[uri]
+
+    async def release(self, uri: str):
+        """Releases a client acquired with acquire(). The last release closes it."""
+        with self.lock:
+            if uri not in self.clients:
+                return
+            self.references[uri] -= 1
+            if self.references[uri] > 0:
+                return
+            client = self.clients.pop(uri)
+            del self.references[uri]
+        await client.close()
+        logging.info("Connection to MongoDB closed.")
+
+    async def ping(self, uri: str) -> bool:
+        """Health check: whether the server of the URI answers a ping within the server selection timeout."""
+        client = self.clients.get(uri)
+        if client is None:
+            return False
+        try:
+            await client.admin.command("ping")
+            return True
+        except errors.PyMongoError as e:
+            logging.error(f"MongoDB health check failed: {e}")
+            return False
+
+
+# Used by the MongoDBManagers that are not given a registry
+default_registry = MongoClientRegistry()
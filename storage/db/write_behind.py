@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import List, Optional
+from bson.objectid import ObjectId
+from pymongo import errors
+from pymongo.write_concern import WriteConcern
+from utils.metrics import metrics, span
+
+write_behind_pending = metrics.gauge("chatbot_mongo_write_behind_pending", "Documents waiting in the write-behind queue of a collection.")
+write_behind_flushes = metrics.counter("chatbot_mongo_write_behind_flushes_total", "insert_many batches written by the write-behind queue, by trigger (size/time/shutdown/backpressure).")
+write_behind_documents = metrics.counter("chatbot_mongo_write_behind_documents_total", "Documents written by the write-behind queue.")
+write_behind_direct = metrics.counter("chatbot_mongo_write_behind_direct_writes_total", "Documents written with insert_one because the write-behind queue was full and could not be flushed.")
+write_behind_errors = metrics.counter("chatbot_mongo_write_behind_errors_total", "Failed write-behind batches (they are retried).")
+
+# Durability levels of MongoDBManager: "sync" writes on the request path, the others go through the write-behind queue
+WRITE_CONCERNS = {
+    "acknowledged": WriteConcern(w=1),
+    "journaled": WriteConcern(w=1, j=True),
+    "unacknowledged": WriteConcern(w=0),
+}
+DURABILITY_LEVELS = ["sync"] + list(WRITE_CONCERNS)
+
+
+class WriteBehindBuffer:
+    """
+    Write-behind queue of a MongoDBManager collection.
+
+    add() assigns the _id and returns at once; a background task writes the queued documents with a single
+    insert_many when batch_size documents are waiting or flush_interval seconds after the first one arrived.
+    At most max_pending documents are kept: past that add() waits for a flush, and if the flush fails (Mongo is down)
+    it writes the document itself with insert_one, whose errors reach the caller as with durability "sync". Failed
+    batches stay queued and are retried on the next flush. Until a document is written, buffered() returns it, so the reads of this process see
+    their own writes. Whatever is queued when the process stops without close() is lost: use durability "sync"
+    when every turn must be stored before it is answered.
+    """
+
+    def __init__(self, manager, durability: str = "acknowledged", batch_size: int = 100, flush_interval: float = 0.5, max_pending: int = 10000):
+        if durability not in WRITE_CONCERNS:
+            raise ValueError(f"Invalid write-behind durability '{durability}'. Must be one of: {', '.join(WRITE_CONCERNS)}")
+        self.manager = manager
+        self.write_concern = WRITE_CONCERNS[durability]
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending: List[dict] = []
+        self.inflight: List[dict] = []
+        self.worker: Optional[asyncio.Task] = None
+        self.flush_lock = asyncio.Lock()
+        self.has_pending = asyncio.Event()
+        self.batch_full = asyncio.Event()
+
+    async def add(self, document: dict) -> ObjectId:
+        """Queues a document and returns its _id."""
+        if len(self.pending) + len(self.inflight) >= self.max_pending:
+            await self.flush(trigger="backpressure")
+        document.setdefault("_id", ObjectId())
+        if len(self.pending) + len(self.inflight) >= self.max_pending: # The flush failed: do not grow the queue past max_pending
+            collection = self.manager.collection.with_options(write_concern=self.write_concern)
+            with span(f"mongo_insert_{self.manager.collection_name}", "mongodb"):
+                await collection.insert_one(document)
+            write_behind_direct.inc(collection=self.manager.collection_name)
+            return document["_id"]
+        self.pending.append(document)
+        write_behind_pending.set(len(self.pending), collection=self.manager.collection_name)
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self._run())
+        self.has_pending.set()
+        if len(self.pending) >= self.batch_size:
+            self.batch_full.set()
+        return document["_id"]
+
+    async def _run(self):
+        while True:
+            await self.has_pending.wait()
+            trigger = "size"
+            try:
+                await asyncio.wait_for(self.batch_full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                trigger = "time"
+            self.has_pending.clear()
+            self.batch_full.clear()
+            await self.flush(trigger=trigger)
+            if self.pending:
+                self.has_pending.set()
+
+    async def flush(self, trigger: str = "size"):
+        """Writes the queued documents in batches of batch_size."""
+        async with self.flush_lock:
+            while self.pending:
+                self.inflight, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+                try:
+                    collection = self.manager.collection.with_options(write_concern=self.write_concern)
+                    with span(f"mongo_insert_many_{self.manager.collection_name}", "mongodb"):
+                        await collection.insert_many(self.inflight, ordered=False)
+                    write_behind_flushes.inc(collection=self.manager.collection_name, trigger=trigger)
+                    write_behind_documents.inc(len(self.inflight), collection=self.manager.collection_name)
+                except errors.BulkWriteError as e:
+                    # Duplicate _id: a previous attempt wrote part of the batch. The rest was written, nothing to retry.
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        logging.error(f"Write-behind batch of {self.manager.collection_name} partly failed: {e.details}")
+                        write_behind_errors.inc(collection=self.manager.collection_name)
+                except errors.PyMongoError as e:
+                    logging.error(f"Write-behind batch of {self.manager.collection_name} failed, it will be retried: {e}")
+                    write_behind_errors.inc(collection=self.manager.collection_name)
+                    self.pending = self.inflight + self.pending
+                    return
+                finally:
+                    self.inflight = []
+                    write_behind_pending.set(len(self.pending), collection=self.manager.collection_name)
+
+    def buffered(self, conversation_id: str) -> List[dict]:
+        """Documents of a conversation that may not be in Mongo yet."""
+        return [document for document in self.inflight + self.pending if document.get("conversation_id") == conversation_id]
+
+    async def update(self, item_id: str, fields: dict) -> bool:
+        """Applies the update to a queued document. Returns False if the document is not queued (it is in Mongo)."""
+        for document in self.pending:
+            if str(document["_id"]) == item_id:
+                document.update(fields)
+                return True
+        if any(str(document["_id"]) == item_id for document in self.inflight):
+            async with self.flush_lock: # Being written: wait until it is in Mongo
+                pass
+        return False
+
+    async def close(self):
+        """Stops the background task and writes everything that is still queued."""
+        if self.worker is not None:
+            async with self.flush_lock: # Do not cancel a batch that is being written
+                self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+        await self.flush(trigger="shutdown")
+        if self.pending:
+            logging.error(f"Write-behind queue of {self.manager.collection_name}: {len(self.pending)} documents could not be written.")
@@ -0,0 +1,205 @@
+import array
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+TOKEN = re.compile(r"\w+")
+SEPARATOR = "\0"  # Between the terms (and chunk IDs) stored in the .npz
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens of a text (punctuation is dropped)."""
+    return TOKEN.findall(text.lower())
+
+
+def _encode(strings: List[str]) -> np.ndarray:
+    return np.frombuffer(SEPARATOR.join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode(data: np.ndarray) -> List[str]:
+    text = data.tobytes().decode("utf-8")
+    return text.split(SEPARATOR) if text else []
+
+
+def _uint32_array(values: np.ndarray) -> array.array:
+    result = array.array("I")
+    result.frombytes(np.ascontiguousarray(values, dtype=np.uint32).tobytes())
+    return result
+
+
+class BM25Index:
+    """
+    Corpus-wide BM25 inverted index of the chunks, for the lexical search of text_search.
+
+    Every term gets an integer ID, and its postings are two uint32 arrays: the slots of the chunks that contain it and
+    its frequency in each one. A query only reads the postings of its own terms and scores them with numpy, so its
+    cost does not depend on tokenizing candidates. Chunks are added and removed incrementally: a removed (or
+    replaced) chunk is tombstoned, and the postings are compacted once most of the slots are dead.
+
+    The index is saved as one .npz (save) next to the Chroma collection. While it has changes that are not saved, a
+    "<path>.dirty" marker exists, so an interrupted provisioning is detected by load() and the index rebuilt.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[str, int] = {}
+        self.postings: List[Tuple[array.array, array.array]] = []  # (chunk slots, frequencies) of every term ID
+        self.ids: List[str] = []  # Chunk ID of every slot
+        self.slots: Dict[str, int] = {}  # Slot of every live chunk ID
+        self.lengths = array.array("I")  # Tokens of every slot
+        self.alive = bytearray()  # 1 if the slot holds a live chunk
+        self.total_length = 0
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def _mark_dirty(self):
+        if self.path and not self.dirty:
+            open(f"{self.path}.dirty", "w").close()
+        self.dirty = True
+
+    def add(self, ids: List[str], texts: List[str]):
+        """Indexes chunks. A chunk ID that is already indexed is replaced."""
+        with self.lock:
+            self._mark_dirty()
+            for chunk_id, text in zip(ids, texts):
+                if chunk_id in self.slots:
+                    self._remove([chunk_id])
+                counts = Counter(tokenize(text or ""))
+                slot = len(self.ids)
+                self.ids.append(chunk_id)
+                self.slots[chunk_id] = slot
+                length = sum(counts.values())
+                self.lengths.append(length)
+                self.alive.append(1)
+                self.total_length += length
+                for term, frequency in counts.items():
+                    term_id = self.terms.get(term)
+                    if term_id is None:
+                        term_id = self.terms[term] = len(self.postings)
+                        self.postings.append((array.array("I"), array.array("I")))
+                    slots, frequencies = self.postings[term_id]
+                    slots.append(slot)
+                    frequencies.append(frequency)
+
+    def remove(self, ids: Iterable[str]):
+        """Removes chunks from the index (unknown IDs are ignored)."""
+        with self.lock:
+            self._mark_dirty()
+            self._remove(ids)
+
+    def _remove(self, ids: Iterable[str]):
+        """Tombstones the chunks (removed, or replaced by add) and compacts once most of the slots are dead."""
+        for chunk_id in list(ids):
+            slot = self.slots.pop(chunk_id, None)
+            if slot is not None:
+                self.alive[slot] = 0
+                self.total_length -= self.lengths[slot]
+        dead = len(self.ids) - len(self.slots)
+        if dead > max(1000, len(self.slots)):
+            self._compact()
+
+    def _compact(self):
+        """Drops the dead slots (and the terms left without postings), renumbering the rest."""
+        alive = np.frombuffer(self.alive, dtype=np.bool_).copy()
+        new_slots = np.cumsum(alive, dtype=np.int64) - 1
+        terms, postings = {}, []
+        for term, term_id in self.terms.items():
+            slots = np.frombuffer(self.postings[term_id][0], dtype=np.uint32)
+            frequencies = np.frombuffer(self.postings[term_id][1], dtype=np.uint32)
+            keep = alive[slots]
+            if keep.any():
+                terms[term] = len(postings)
+                postings.append((_uint32_array(new_slots[slots[keep]]), _uint32_array(frequencies[keep])))
+        self.terms, self.postings = terms, postings
+        self.ids = [chunk_id for chunk_id, live in zip(self.ids, alive) if live]
+        self.slots = {chunk_id: slot for slot, chunk_id in enumerate(self.ids)}
+        self.lengths = _uint32_array(np.frombuffer(self.lengths, dtype=np.uint32)[alive])
+        self.alive = bytearray(b"\1" * len(self.ids))
+
+    def top_k(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        """The k chunks with the highest BM25 score for the query, as (chunk ID, score), best first."""
+        with self.lock:
+            term_ids = [self.terms[term] for term in dict.fromkeys(tokenize(query)) if term in self.terms]
+            if not term_ids or not self.slots or k <= 0:
+                return []
+            alive = np.frombuffer(self.alive, dtype=np.bool_)
+            lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+            documents = len(self.slots)
+            average_length = self.total_length / documents or 1.0
+            matched_slots, matched_scores = [], []
+            for term_id in term_ids:
+                slots = np.frombuffer(self.postings[term_id][0], dtype=np.uint32)
+                frequencies = np.frombuffer(self.postings[term_id][1], dtype=np.uint32)
+                live = alive[slots]
+                slots, frequencies = slots[live], frequencies[live].astype(np.float64)
+                if not len(slots):
+                    continue
+                idf = math.log(1 + (documents - len(slots) + 0.5) / (len(slots) + 0.5))
+                norms = self.k1 * (1 - self.b + self.b * lengths[slots] / average_length)
+                matched_slots.append(slots)
+                matched_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norms))
+            if not matched_slots:
+                return []
+            slots, inverse = np.unique(np.concatenate(matched_slots), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+            k = min(k, len(slots))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self.ids[slots[i]], float(scores[i])) for i in top]
+
+    def save(self, path: Optional[str] = None):
+        """Writes the index atomically (the postings of all the terms concatenated, with their offsets) and clears the dirty marker."""
+        with self.lock:
+            self.path = path or self.path
+            terms = sorted(self.terms, key=self.terms.get)
+            counts = np.array([len(self.postings[self.terms[term]][0]) for term in terms], dtype=np.int64)
+            offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "wb") as file:
+                np.savez(file,
+                         parameters=np.array([self.k1, self.b]),
+                         terms=_encode(terms),
+                         ids=_encode(self.ids),
+                         lengths=np.frombuffer(self.lengths, dtype=np.uint32),
+                         alive=np.frombuffer(self.alive, dtype=np.bool_),
+                         offsets=offsets,
+                         slots=np.frombuffer(b"".join(self.postings[self.terms[term]][0].tobytes() for term in terms), dtype=np.uint32),
+                         frequencies=np.frombuffer(b"".join(self.postings[self.terms[term]][1].tobytes() for term in terms), dtype=np.uint32))
+            os.replace(temporary_path, self.path)
+            if os.path.exists(f"{self.path}.dirty"):
+                os.remove(f"{self.path}.dirty")
+            self.dirty = False
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        """Loads a saved index. Returns None if there is none, or if it was left dirty (it must be rebuilt)."""
+        if not os.path.exists(path) or os.path.exists(f"{path}.dirty"):
+            return None
+        try:
+            with np.load(path) as data:
+                k1, b = data["parameters"].tolist()
+                index = cls(path=path, k1=k1, b=b)
+                offsets, slots, frequencies = data["offsets"], data["slots"], data["frequencies"]
+                for term_id, term in enumerate(_decode(data["terms"])):
+                    index.terms[term] = term_id
+                    index.postings.append((_uint32_array(slots[offsets[term_id]:offsets[term_id + 1]]),
+                                           _uint32_array(frequencies[offsets[term_id]:offsets[term_id + 1]])))
+                index.ids = _decode(data["ids"])
+                index.lengths = _uint32_array(data["lengths"])
+                index.alive = bytearray(data["alive"].astype(np.uint8).tobytes())
+        except Exception as e:
+            logging.warning(f"Could not load the BM25 index {path}, it is rebuilt: {e}")
+            return None
+        index.slots = {chunk_id: slot for slot, chunk_id in enumerate(index.ids) if index.alive[slot]}
+        index.total_length = int(np.frombuffer(index.lengths, dtype=np.uint32)[np.frombuffer(index.alive, dtype=np.bool_)].sum())
+        return index
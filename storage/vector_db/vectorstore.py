@@ -1,34 +1,132 @@
 import inspect
 import logging
 import os
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, List, Dict, Optional
 import chromadb
 from data_ingestion.indexing.documents import Document
 import chromadb.utils.embedding_functions as embedding_functions
 from dotenv import load_dotenv
 import numpy as np
-from sentence_transformers import CrossEncoder
-from rank_bm25 import BM25Okapi
+from storage.vector_db.bm25_index import BM25Index
+from utils.metrics import in_context, span
+from utils.embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+from utils.reranker import CrossEncoderReranker
 
 # Load environment variables
 load_dotenv()
 # Get the OpenAI API key from the environment variables
 api_key = os.environ.get("OPENAI_API_KEY")
-
-openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-                api_key=api_key,
-                model_name="text-embedding-ada-002"
-            )
+_openai_ef = None
+_openai_ef_lock = threading.Lock()
+
+
+def default_embedding_function() -> Callable:
+    """The OpenAI embedding function (text-embedding-ada-002), built on first use instead of at import."""
+    global _openai_ef
+    if _openai_ef is None:
+        with _openai_ef_lock:
+            if _openai_ef is None:
+                _openai_ef = embedding_functions.OpenAIEmbeddingFunction(
+                                api_key=api_key,
+                                model_name="text-embedding-ada-002"
+                            )
+    return _openai_ef
+
+
+class QueryContext:
+    def __init__(self, query_texts: List[str], embedding_function: Callable):
+        """
+        Per-request state of a retrieval, passed to every strategy and sub-strategy: the query texts and their
+        embeddings, computed with one call to the embedding function the first time a strategy needs them.
+        cancelled is set when nobody waits for the retrieval any more (RAG.get_context was cancelled): the strategies
+        skip the costly work still ahead, i.e. the cross-encoder.
+        :param query_texts: List of query texts.
+        :param embedding_function: Function to convert texts into vector embeddings.
+        """
+        self.query_texts = query_texts
+        self.embedding_function = embedding_function
+        self._embeddings: Optional[List[List[float]]] = None
+        self.lock = threading.Lock() # Sub-strategies may run in parallel
+        self.cancelled = threading.Event()
+
+    def embeddings(self) -> List[List[float]]:
+        """Embeddings of the query texts (memoized)."""
+        with self.lock:
+            if self._embeddings is None:
+                with span("query_embedding", "embeddings"):
+                    self._embeddings = [np.asarray(vector).tolist() for vector in self.embedding_function(list(self.query_texts))]
+            return self._embeddings
+
+    def for_texts(self, query_texts: List[str]) -> "QueryContext":
+        """Context for other query texts (e.g. the hypothetical documents of HyDE), with the same embedding function and cancellation."""
+        context = QueryContext(query_texts, self.embedding_function)
+        context.cancelled = self.cancelled
+        return context
+
+
+class HybridFusion:
+    def __init__(self, method: str = "rrf", text_depth: int = 20, vector_depth: int = 20, text_weight: float = 1.0, vector_weight: float = 1.0, rrf_k: int = 60, max_workers: int = 8):
+        """
+        How hybrid_search runs and fuses its legs. The text (BM25) leg runs on a thread pool while the vector leg runs
+        in the calling thread, so a hybrid retrieval takes about as long as the slower leg.
+        :param method: "rrf" (reciprocal rank fusion: sum of weight / (rrf_k + rank)) or "weighted" (sum of weight * score,
+            with the scores of every leg min-max normalized to [0, 1]).
+        :param text_depth: Candidates retrieved by the text leg.
+        :param vector_depth: Candidates retrieved by the vector leg.
+        :param text_weight: Weight of the text leg in the fusion.
+        :param vector_weight: Weight of the vector leg in the fusion.
+        :param rrf_k: Rank constant of reciprocal rank fusion (higher values flatten the head of every ranking).
+        :param max_workers: Threads of the pool of the text legs.
+        """
+        if method not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion method {method}: must be rrf or weighted.")
+        self.method = method
+        self.text_depth = text_depth
+        self.vector_depth = vector_depth
+        self.text_weight = text_weight
+        self.vector_weight = vector_weight
+        self.rrf_k = rrf_k
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hybrid")
+
+    def fuse(self, legs: List[List[Dict]], weights: List[float], n_results: int) -> List[Dict]:
+        """
+        Fuses ranked result lists (best first) into one ranking. A chunk found by several legs adds up their contributions.
+        :param legs: Results of every leg, as returned by the strategies.
+        :param weights: Weight of every leg.
+        :param n_results: Number of results to return.
+        :return: The fused results, best first, with the fused score in "score".
+        """
+        fused: Dict[str, Dict] = {}
+        for results, weight in zip(legs, weights):
+            if self.method == "rrf":
+                contributions = [weight / (self.rrf_k + rank) for rank in range(1, len(results) + 1)]
+            else:
+                scores = [result.get("score", 0.0) for result in results]
+                low, high = min(scores, default=0.0), max(scores, default=0.0)
+                contributions = [weight * ((score - low) / (high - low) if high > low else 1.0) for score in scores]
+            for result, contribution in zip(results, contributions):
+                if result["id"] not in fused:
+                    fused[result["id"]] = {**result, "score": 0.0}
+                fused[result["id"]]["score"] += contribution
+        return sorted(fused.values(), key=lambda result: result["score"], reverse=True)[:n_results]
 
 
 class ChromaVectorStore:
-    def __init__(self, collection_name: str, embedding_function: Optional[Callable] = openai_ef, persist_directory: Optional[str] = None, metric: str = "cosine"):
+    def __init__(self, collection_name: str, embedding_function: Optional[Callable] = None, persist_directory: Optional[str] = None, metric: str = "cosine", embedding_cache: Optional[EmbeddingCache] = None, lexical_index_batch_size: int = 5000, hybrid_fusion: Optional[HybridFusion] = None, reranker: Optional[CrossEncoderReranker] = None):
         """
         Initializes the ChromaDB vectorstore client and sets up a collection.
         :param collection_name: The name of the collection for your vectors.
         :param persist_directory: Directory to store persistent data (optional, if persistence is required).
         :param embedding_function: The embedding function to use. Defaults to OpenAI embedding function.
         :param metric: The distance metric to use for the collection.
+        :param embedding_cache: On-disk embedding cache for the query embeddings (optional).
+        :param lexical_index_batch_size: Chunks read per request when the BM25 index is rebuilt from the collection.
+        :param hybrid_fusion: How hybrid_search runs and fuses its legs (default: reciprocal rank fusion, 20 candidates per leg).
+        :param reranker: Cross-encoder of the reranking strategy (default: ms-marco-MiniLM-L-6-v2 on torch, loaded on first use).
         """
         
         # if persist_directory is not None, make sure that it exists
@@ -43,16 +141,28 @@ class ChromaVectorStore:
 
         self.collection_name = collection_name
         self.metric = metric
+        self.persist_directory = persist_directory
+        self._corpus_version = uuid.uuid4().hex # Used when there is no persist_directory
 
         # If no embedding function is provided, use OpenAI's embedding function
-        if embedding_function is None:
-            pass
-            #self.embedding_function = OpenAIEmbeddingFunction(api_key=api_key, model_name="text-embedding-ada-002")
-        else:
-            self.embedding_function = embedding_function
+        self.embedding_function = embedding_function if embedding_function is not None else default_embedding_function()
+        # The collection keeps the plain function; the query embeddings computed here go through the cache
+        self.collection_embedding_function = self.embedding_function
+        if embedding_cache is not None:
+            self.embedding_function = CachedEmbeddingFunction(self.collection_embedding_function, embedding_cache)
 
         self.collection = self.get_or_create_collection()
 
+        # Corpus-wide BM25 index of text_search, kept next to the collection and updated with it
+        self.lexical_index_path = os.path.join(persist_directory, "bm25_index.npz") if persist_directory else None
+        self.lexical_index_batch_size = lexical_index_batch_size
+        self.lexical_index_lock = threading.Lock()
+        self.load_lexical_index()
+
+        self.hybrid_fusion = hybrid_fusion if hybrid_fusion is not None else HybridFusion()
+        self.reranker = reranker if reranker is not None else CrossEncoderReranker()
+        if self.reranker.version_provider is None: # Cached scores are stale once the collection is re-provisioned
+            self.reranker.version_provider = self.corpus_version
         self.retrieval_strategies = RetrievalStrategies()
 
     def get_or_create_collection(self):
@@ -63,7 +173,69 @@ class ChromaVectorStore:
         return self.client.get_or_create_collection(
         name=self.collection_name,
         metadata={"hnsw:space": self.metric},
-        embedding_function= self.embedding_function)
+        embedding_function= self.collection_embedding_function)
+
+    def corpus_version(self) -> str:
+        """
+        Returns a marker of the provisioned corpus. It changes every time bump_corpus_version() is called (provision.py
+        does it after re-provisioning), so caches built on the collection contents can tell they are stale.
+        """
+        if not self.persist_directory:
+            return self._corpus_version
+        try:
+            with open(os.path.join(self.persist_directory, "corpus_version"), "r", encoding="utf-8") as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return ""
+
+    def load_lexical_index(self) -> BM25Index:
+        """
+        Loads the BM25 index saved next to the collection. If there is none, or it was left dirty by an interrupted
+        provisioning, it is rebuilt from the chunks of the collection (and saved).
+        :return: The BM25 index.
+        """
+        with self.lexical_index_lock:
+            version = self.corpus_version()
+            index = BM25Index.load(self.lexical_index_path) if self.lexical_index_path else None
+            if index is None:
+                index = BM25Index(path=self.lexical_index_path)
+                offset = 0
+                while True:
+                    batch = self.collection.get(include=["documents"], limit=self.lexical_index_batch_size, offset=offset)
+                    if not batch["ids"]:
+                        break
+                    index.add(batch["ids"], batch["documents"])
+                    offset += len(batch["ids"])
+                if self.lexical_index_path:
+                    index.save()
+                logging.info(f"BM25 index rebuilt from the collection: {len(index)} chunks")
+            self.lexical_index = index
+            self._lexical_index_version = version
+            return index
+
+    def get_lexical_index(self) -> BM25Index:
+        """
+        The BM25 index of the collection. It is reloaded when the corpus version changes (provision.py saved a new one).
+        :return: The BM25 index.
+        """
+        if self.lexical_index_path and self.corpus_version() != self._lexical_index_version:
+            return self.load_lexical_index()
+        return self.lexical_index
+
+    def save_lexical_index(self):
+        """Saves the BM25 index next to the collection, if it has changed (provision.py calls it after re-provisioning)."""
+        if self.lexical_index_path and self.lexical_index.dirty:
+            self.lexical_index.save()
+
+    def bump_corpus_version(self) -> str:
+        """Marks the corpus as changed. Returns the new version."""
+        version = uuid.uuid4().hex
+        if self.persist_directory:
+            with open(os.path.join(self.persist_directory, "corpus_version"), "w", encoding="utf-8") as file:
+                file.write(version)
+        else:
+            self._corpus_version = version
+        return version
 
     def add_document(self, document: Document):
         """
@@ -74,14 +246,67 @@ class ChromaVectorStore:
             if document.vectors is None or not all(isinstance(v, list) for v in document.vectors):
                 raise ValueError("Invalid vectors; ensure embeddings are generated.")
             # Generate metadata for each chunk
-            metadatas = [{"file_path": document.file_path, "file_name": document.file_name} for _ in document.chunks]
+            metadatas = self.chunk_metadatas(document)
             # Add chunks with pre-computed vectors and metadata (like file path or file name)
             self.collection.add(
                 documents=document.chunks,
-                ids=[f"{document.file_name}_chunk_{i}" for i in range(len(document.chunks))],
+                ids=self.chunk_ids(document),
                 embeddings=document.vectors,
                 metadatas=metadatas # Metadata for each chunk
             )
+            self.lexical_index.add(self.chunk_ids(document), document.chunks)
+
+    @staticmethod
+    def chunk_ids(document: Document) -> List[str]:
+        """IDs of the chunks of a document in the collection."""
+        return [f"{document.file_name}_chunk_{i}" for i in range(len(document.chunks))]
+
+    @staticmethod
+    def chunk_metadatas(document: Document) -> List[Dict]:
+        """Metadata of every chunk of a document: file path and name, plus what the chunker recorded (e.g. page_start, page_end)."""
+        extra = document.metadatas
+        return [{"file_path": document.file_path, "file_name": document.file_name, **(extra[i] if i < len(extra) else {})} for i in range(len(document.chunks))]
+
+    def upsert_document(self, document: Document, previous_ids: Optional[List[str]] = None) -> List[str]:
+        """
+        Adds or replaces the chunks of a document (re-provisioning of a changed file).
+        :param document: Document object containing chunks and vectors.
+        :param previous_ids: Chunk IDs the document had before; the ones it does not have any more are deleted.
+        :return: The chunk IDs of the document.
+        """
+        return self.upsert_documents([document], {document.file_path: previous_ids or []})[document.file_path]
+
+    def upsert_documents(self, documents: List[Document], previous_ids: Optional[Dict[str, List[str]]] = None) -> Dict[str, List[str]]:
+        """
+        Adds or replaces the chunks of several documents with as few collection writes as possible.
+        :param documents: Document objects containing chunks and vectors.
+        :param previous_ids: Chunk IDs every document (by file path) had before; the ones it does not have any more are deleted.
+        :return: The chunk IDs of every document, by file path.
+        """
+        ids, chunks, vectors, metadatas, stale_ids = [], [], [], [], []
+        document_ids = {}
+        for document in documents:
+            if document.chunks and (not document.vectors or not all(isinstance(v, list) for v in document.vectors)):
+                raise ValueError("Invalid vectors; ensure embeddings are generated.")
+            document_ids[document.file_path] = self.chunk_ids(document)
+            ids += document_ids[document.file_path]
+            chunks += document.chunks
+            vectors += document.vectors
+            metadatas += self.chunk_metadatas(document)
+            current_ids = set(document_ids[document.file_path])
+            stale_ids += [id for id in (previous_ids or {}).get(document.file_path, []) if id not in current_ids]
+        batch_size = self.client.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            self.collection.upsert(
+                documents=chunks[start:start + batch_size],
+                ids=ids[start:start + batch_size],
+                embeddings=vectors[start:start + batch_size],
+                metadatas=metadatas[start:start + batch_size]
+            )
+        self.lexical_index.add(ids, chunks)
+        if stale_ids:
+            self.delete_documents(stale_ids)
+        return document_ids
 
     def query_embeddings(self, query_texts: List[str], n_results: int = 5):
         """
@@ -91,14 +316,20 @@ class ChromaVectorStore:
         :return: List of matched document IDs and their metadata.
         """
         # Generar embeddings para los textos de consulta usando la misma función
-        query_embeddings = [self.embedding_function(query)[0] for query in query_texts]
-
         results = self.collection.query(
-            query_embeddings=query_embeddings,
+            query_embeddings=self.query_context(query_texts).embeddings(),
             n_results=n_results
         )
         return results
     
+    def query_context(self, query_texts: List[str]) -> QueryContext:
+        """
+        Creates the per-request context of a retrieval: the query embeddings are computed once and shared by the strategies.
+        :param query_texts: List of query texts.
+        :return: The QueryContext of the query texts.
+        """
+        return QueryContext(query_texts, self.embedding_function)
+
     def query_texts(self, query_texts: List[str], n_results: int = 5):
         """
         Queries the vectorstore for the closest documents to the provided query texts.
@@ -129,6 +360,23 @@ class ChromaVectorStore:
         :param ids: List of document IDs to be deleted.
         """
         self.collection.delete(ids=ids)
+        self.lexical_index.remove(ids)
+
+    def chunk_ids_by_file(self) -> Dict[str, List[str]]:
+        """
+        IDs of all the chunks of the collection, grouped by the file_path of their metadata (read in batches).
+        :return: Chunk IDs by file path.
+        """
+        chunk_ids = defaultdict(list)
+        offset = 0
+        while True:
+            batch = self.collection.get(include=["metadatas"], limit=self.lexical_index_batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            for id, metadata in zip(batch["ids"], batch["metadatas"]):
+                chunk_ids[(metadata or {}).get("file_path", "")].append(id)
+            offset += len(batch["ids"])
+        return dict(chunk_ids)
 
     def get_metadata(self, ids: List[str]):
         """
@@ -146,12 +394,13 @@ class ChromaVectorStore:
         return results
     
 
-    def apply_retrieval_strategy(self, strategy_name: str, query_texts: List[str], n_results: int = 5):
+    def apply_retrieval_strategy(self, strategy_name: str, query_texts: List[str], n_results: int = 5, query_context: Optional[QueryContext] = None):
         """
         Applies a retrieval strategy by its name.
         :param strategy_name: The name of the retrieval strategy to apply.
         :param query_texts: List of query texts.
         :param n_results: Number of results to return.
+        :param query_context: Context of the request (optional); a new one is created for query_texts if not given.
         :return: Results of the retrieval strategy.
         """
     #def apply_retrieval_strategy(self, strategy_name: str, query_texts: List[str], n_results: int = 5):
@@ -163,6 +412,10 @@ class ChromaVectorStore:
         # Recolectar todos los argumentos posibles
         available_args = {
             "query_texts": query_texts,
+            "query_context": query_context if query_context is not None else self.query_context(query_texts),
+            "lexical_index": self.get_lexical_index(),
+            "hybrid_fusion": self.hybrid_fusion,
+            "reranker": self.reranker,
             "embedding_function": self.embedding_function,
             "collection": self.collection,
             "n_results": n_results
@@ -179,116 +432,94 @@ class ChromaVectorStore:
 
 class RetrievalStrategies:
 
-    cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-
     @staticmethod
-    def text_search(query_texts: List[str], embedding_function: Callable, collection, n_results: int): #BM25
+    def text_search(query_texts: List[str], lexical_index: BM25Index, collection, n_results: int): #BM25
         """
-        Hybrid BM25 strategy: retrieves a subset of documents using vector search,
-        then applies BM25 scoring over them.
+        Lexical BM25 search over the whole corpus: scores the chunks with the postings of the query terms in the
+        BM25 index, then fetches the top ones from the collection.
         
         :param query_texts: List of query texts.
-        :param embedding_function: Embedding function (used for initial filtering).
+        :param lexical_index: The BM25 index of the collection.
         :param collection: The ChromaDB collection to search.
         :param n_results: Number of results to return.
         :return: List of BM25-scored top results.
         """
-        from rank_bm25 import BM25Okapi
-        import numpy as np
-
         query = query_texts[0]
 
-        # Paso 1: Recuperar los documentos candidatos (ej. top 50) usando búsqueda vectorial
-        initial_results = collection.query(
-            query_texts=[query],
-            n_results=max(n_results * 3, 30),
-            include=["documents", "metadatas"]  # "ids" no es válido aquí
-        )
-        
-        ids = initial_results["ids"][0]
-        documents = initial_results["documents"][0]
-        metadatas = initial_results["metadatas"][0]
+        # Paso 1: Los mejores chunks según BM25, directamente del índice invertido
+        with span("bm25", "bm25_index"):
+            top = lexical_index.top_k(query, n_results)
+        if not top:
+            return []
 
-        # Paso 2: Aplicar BM25 sobre los documentos recuperados
-        tokenized_corpus = [doc.lower().split() for doc in documents]
-        tokenized_query = query.lower().split()
-
-        bm25 = BM25Okapi(tokenized_corpus)
-        scores = bm25.get_scores(tokenized_query)
-        top_indices = np.argsort(scores)[::-1][:n_results]
+        # Paso 2: Recuperar su contenido de la colección
+        found = collection.get(ids=[chunk_id for chunk_id, _ in top], include=["documents", "metadatas"])
+        chunks = {chunk_id: (document, metadata) for chunk_id, document, metadata in zip(found["ids"], found["documents"], found["metadatas"])}
 
         return [
             {
-                "id": ids[i],
-                "document": documents[i],
-                "metadata": metadatas[i],
-                "score": float(scores[i])
+                "id": chunk_id,
+                "document": chunks[chunk_id][0],
+                "metadata": chunks[chunk_id][1],
+                "score": score
             }
-            for i in top_indices
+            for chunk_id, score in top if chunk_id in chunks
         ]
 
     @staticmethod
-    def vector_search(query_texts: List[str], embedding_function: Callable, collection, n_results: int):
+    def vector_search(query_texts: List[str], query_context: QueryContext, collection, n_results: int):
         """
         Searches for documents by vector similarity.
         :param query_texts: List of query texts to find similar documents.
-        :param embedding_function: Function to convert text into vector embeddings.
+        :param query_context: Context of the request, with the query embeddings.
         :param collection: The ChromaDB collection to search.
         :param n_results: Number of results to return.
-        :return: List of matched document IDs and their metadata.
+        :return: List of matched document IDs, their metadata and similarity (1 - distance).
         """
-        query_embeddings = [embedding_function(query)[0] for query in query_texts]
-        initial_results = collection.query(query_embeddings=query_embeddings, n_results=n_results)
+        initial_results = collection.query(query_embeddings=query_context.embeddings(), n_results=n_results)
         
         ids = initial_results["ids"][0]
         documents = initial_results["documents"][0]
         metadatas = initial_results["metadatas"][0]
+        distances = initial_results["distances"][0]
         
         return [
             {
                 "id": doc_id,
                 "document": doc,
-                "metadata": meta
+                "metadata": meta,
+                "score": 1.0 - float(distance)
             }
-            for doc, meta, doc_id in zip(documents, metadatas, ids)
+            for doc, meta, doc_id, distance in zip(documents, metadatas, ids, distances)
         ]
 
     @staticmethod
-    def hybrid_search(query_texts: List[str], embedding_function: Callable, collection, n_results: int):
+    def hybrid_search(query_texts: List[str], query_context: QueryContext, lexical_index: BM25Index, collection, n_results: int, hybrid_fusion: HybridFusion):
         """
-        Combines text search and vector search.
+        Combines text search (BM25 index) and vector search (query embeddings of the context). Both legs run at the
+        same time and their rankings are fused (reciprocal rank fusion or weighted normalized scores).
         :param query_texts: List of query texts to find similar documents.
-        :param embedding_function: Function to convert text into vector embeddings.
+        :param query_context: Context of the request, with the query embeddings.
+        :param lexical_index: The BM25 index of the collection.
         :param collection: The ChromaDB collection to search.
         :param n_results: Number of results to return.
-        :return: Combined list of results from text and vector searches.
+        :param hybrid_fusion: Candidate depth of every leg, their weights and the fusion method.
+        :return: Fused list of results from text and vector searches, with the fused score.
         """
-        if n_results % 2 > 0:
-            n_results += 1
-
-        half = n_results // 2
-        text_results = RetrievalStrategies.text_search(query_texts, embedding_function, collection, half)
-        vector_results = RetrievalStrategies.vector_search(query_texts, embedding_function, collection, half)
-
-        combined_results = text_results + vector_results
+        text_future = hybrid_fusion.executor.submit(in_context(RetrievalStrategies.text_search, query_texts, lexical_index, collection, hybrid_fusion.text_depth))
+        try:
+            vector_results = RetrievalStrategies.vector_search(query_texts, query_context, collection, hybrid_fusion.vector_depth)
+        finally:
+            text_results = text_future.result() # Also when the vector leg fails, so no leg outlives the request
 
-        # Quitar duplicados si es necesario por ID
-        seen_ids = set()
-        unique_results = []
-        for r in combined_results:
-            if r["id"] not in seen_ids:
-                unique_results.append(r)
-                seen_ids.add(r["id"])
-
-        unique_results.sort(key=lambda x: x.get("score", 0.0), reverse=True)
-        return unique_results[:n_results]
+        return hybrid_fusion.fuse([text_results, vector_results], [hybrid_fusion.text_weight, hybrid_fusion.vector_weight], n_results)
 
     @staticmethod
-    def HyDE(query_texts: List[str], embedding_function: Callable, collection, n_results: int):
+    def HyDE(query_texts: List[str], query_context: QueryContext, collection, n_results: int):
         """
         Hypothetical Document Embeddings (HyDE) strategy.
         :param query_texts: List of query texts.
-        :param embedding_function: Function to generate synthetic embeddings for query texts.
+        :param query_context: Context of the request; the synthetic texts get their own context with its embedding function.
         :param collection: The ChromaDB collection to search.
         :param n_results: Number of results to return.
         :return: List of results from HyDE search.
@@ -298,31 +529,34 @@ class RetrievalStrategies:
         #hyde_prompt = file_manager.load_md_file(file_path="hyde_prompt.md")
         hyde_prompt = "test"
         hyde_texts = [f"Generated context for: {query}" for query in query_texts]
-        results = RetrievalStrategies.vector_search(hyde_texts, embedding_function, collection, n_results)
+        results = RetrievalStrategies.vector_search(hyde_texts, query_context.for_texts(hyde_texts), collection, n_results)
         return results
 
     @staticmethod
-    def reranking(query_texts: List[str], embedding_function: Callable, collection, n_results: int):
+    def reranking(query_texts: List[str], query_context: QueryContext, collection, n_results: int, reranker: CrossEncoderReranker):
         """
         Re-ranking strategy: initial vector search followed by re-ranking.
         :param query_texts: List of query texts.
-        :param embedding_function: Function to convert text into vector embeddings.
+        :param query_context: Context of the request, with the query embeddings.
         :param collection: The ChromaDB collection to search.
         :param n_results: Number of results to return.
+        :param reranker: Cross-encoder that scores the candidates.
         :return: List of re-ranked results.
         """
-        query_embeddings = [embedding_function(query)[0] for query in query_texts]
-        initial_results = collection.query(query_embeddings=query_embeddings, n_results=n_results* 2)
-        reranked_results = RetrievalStrategies._rerank_results(initial_results, query_texts, n_results)
+        initial_results = collection.query(query_embeddings=query_context.embeddings(), n_results=n_results* 2)
+        if query_context.cancelled.is_set(): # Nobody waits for the results any more
+            return []
+        reranked_results = RetrievalStrategies._rerank_results(initial_results, query_texts, n_results, reranker)
         return reranked_results
 
     @staticmethod
-    def _rerank_results(initial_results, query_texts, n_results):
+    def _rerank_results(initial_results, query_texts, n_results, reranker: CrossEncoderReranker):
         """
         Re-ranks initial results based on similarity scores computed by a cross-encoder model.
         :param initial_results: Initial retrieval results with document contents.
         :param query_texts: List of query texts.
         :param n_results: Number of results to return.
+        :param reranker: Cross-encoder that scores the (query, document) pairs, in batches and with a score cache.
         :return: List of top re-ranked results.
         """
 
@@ -334,11 +568,8 @@ class RetrievalStrategies:
         retrieved_ids = initial_results["ids"][0]
         retrieved_metadatas = initial_results["metadatas"][0]
 
-        # Prepare pairs of (query, document) for cross-encoder scoring
-        pairs = [[query, doc] for doc in retrieved_documents]
-
-        # Get similarity scores from the cross-encoder
-        scores = RetrievalStrategies.cross_encoder.predict(pairs)
+        # Get similarity scores of the (query, document) pairs from the cross-encoder
+        scores = reranker.score(query, retrieved_ids, retrieved_documents)
 
         # Sort indices based on scores in descending order
         sorted_indices = np.argsort(scores)[::-1]
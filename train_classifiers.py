@@ -0,0 +1,134 @@
+#python train_classifiers.py --task all
+#python train_classifiers.py --task consent --evaluate
+"""
+Trains the local classifiers of the sales detector and the consent detector on the turns stored in the
+conversations collection. The labels are the answers the LLM assistants gave in production:
+- sales: the first turn of every conversation and the follow-ups that went through sales detection
+  (previous turn without sales intention and fewer than THRESHOLD_SALES_INTENTION_TRIGGER turns); label sales_intention.
+- consent: the turn that answered the consent request (previous turn with sales intention and no consent); label consent.
+- content_filter: every stored question passed the content filter, so their embeddings are saved as the safe examples
+  of the content filter pre-screen (there are no unsafe examples to evaluate it with).
+
+The labelled turns are split into train and test sets. The model is trained on the train set and saved to
+LOCAL_CLASSIFIER_DIR; the test set reports, for every confidence threshold, the share of requests the local
+classifier answers (coverage) and its accuracy on them. The rest go to the LLM. With --evaluate the saved model is
+evaluated on all the labelled turns instead.
+"""
+import argparse
+import os
+import random
+from collections import defaultdict
+from typing import Dict, List, Tuple
+import numpy as np
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from utils.local_classifier import DEFAULT_ENCODER, LocalClassifier, SafeExamplesClassifier, encode, train_logistic_regression
+
+load_dotenv()
+
+THRESHOLDS = [0.5, 0.7, 0.8, 0.9, 0.95, 0.98]
+
+
+def load_turns(uri: str, db_name: str) -> Dict[str, List[dict]]:
+    """Turns of every conversation, in insertion order."""
+    client = MongoClient(uri)
+    collection = client[db_name]["conversations"]
+    conversations = defaultdict(list)
+    for turn in collection.find({}, {"conversation_id": 1, "question": 1, "sales_intention": 1, "consent": 1}).sort([("conversation_id", 1), ("_id", 1)]):
+        conversations[turn["conversation_id"]].append(turn)
+    client.close()
+    return conversations
+
+
+def labelled_turns(conversations: Dict[str, List[dict]], task: str, threshold_sales_intention_trigger: int) -> List[Tuple[str, int]]:
+    """(question, label) pairs of the task, following the branches of generate_answer."""
+    examples = []
+    for turns in conversations.values():
+        for i, turn in enumerate(turns):
+            previous = turns[i - 1] if i > 0 else None
+            if task == "sales":
+                asked = previous is None or (previous.get("sales_intention") is False and i < threshold_sales_intention_trigger)
+                label = turn.get("sales_intention")
+            else:
+                asked = previous is not None and previous.get("sales_intention") is True and previous.get("consent") is None
+                label = turn.get("consent")
+            if asked and isinstance(label, bool) and turn.get("question"):
+                examples.append((turn["question"], int(label)))
+    return examples
+
+
+def report(probabilities: np.ndarray, labels: np.ndarray):
+    print(f"  {'threshold':>9} {'coverage':>9} {'accuracy':>9} {'to LLM':>7}")
+    for threshold in THRESHOLDS:
+        answered = (probabilities >= threshold) | (probabilities <= 1 - threshold)
+        correct = ((probabilities >= 0.5) == labels.astype(bool)) & answered
+        accuracy = correct.sum() / answered.sum() if answered.any() else float("nan")
+        print(f"  {threshold:>9.2f} {answered.mean():>9.1%} {accuracy:>9.1%} {(~answered).sum():>7}")
+
+
+def save_safe_examples(args, conversations: Dict[str, List[dict]]):
+    path = os.path.join(args.model_dir, "content_filter_examples.npz")
+    questions = sorted({turn["question"].strip() for turns in conversations.values() for turn in turns if turn.get("question")})
+    random.Random(args.seed).shuffle(questions)
+    questions = questions[:args.max_safe_examples]
+    print(f"\ncontent_filter: {len(questions)} distinct questions that passed the content filter")
+    if args.evaluate or not questions:
+        return
+    SafeExamplesClassifier(embeddings=encode(args.encoder, questions), encoder_name=args.encoder).save(path)
+    print(f"  Saved to {path}")
+
+
+def run(task: str, args, conversations: Dict[str, List[dict]]):
+    if task == "content_filter":
+        save_safe_examples(args, conversations)
+        return
+    path = os.path.join(args.model_dir, f"{task}_classifier.npz")
+    examples = labelled_turns(conversations, task, args.threshold_sales_intention_trigger)
+    positives = sum(label for _, label in examples)
+    print(f"\n{task}: {len(examples)} labelled turns ({positives} positive, {len(examples) - positives} negative)")
+
+    if args.evaluate:
+        classifier = LocalClassifier.load(path)
+        if classifier is None:
+            print(f"  {path} not found, train it first")
+            return
+        report(classifier.probabilities([text for text, _ in examples]), np.array([label for _, label in examples]))
+        return
+
+    if min(positives, len(examples) - positives) < args.min_examples:
+        print(f"  At least {args.min_examples} examples of each class are needed, skipping")
+        return
+    random.Random(args.seed).shuffle(examples)
+    split = int(len(examples) * (1 - args.test_size))
+    features = encode(args.encoder, [text for text, _ in examples])
+    labels = np.array([label for _, label in examples])
+    weights, bias = train_logistic_regression(features[:split], labels[:split])
+    classifier = LocalClassifier(weights=weights, bias=bias, encoder_name=args.encoder)
+    print(f"  Test set ({len(examples) - split} turns):")
+    report(1 / (1 + np.exp(-(features[split:] @ weights + bias))), labels[split:])
+    classifier.save(path)
+    print(f"  Saved to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the local sales intent and consent classifiers.")
+    parser.add_argument("--task", choices=["sales", "consent", "content_filter", "all"], default="all")
+    parser.add_argument("--evaluate", action="store_true", help="Evaluate the saved models on all the labelled turns instead of training.")
+    parser.add_argument("--uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017/"))
+    parser.add_argument("--db-name", default="your_database_name", help="Database of MongoDBManager.")
+    parser.add_argument("--model-dir", default=os.environ.get("LOCAL_CLASSIFIER_DIR", "models"))
+    parser.add_argument("--encoder", default=os.environ.get("LOCAL_CLASSIFIER_ENCODER", DEFAULT_ENCODER))
+    parser.add_argument("--threshold-sales-intention-trigger", type=int, default=int(os.environ.get("THRESHOLD_SALES_INTENTION_TRIGGER", 3)))
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--min-examples", type=int, default=20)
+    parser.add_argument("--max-safe-examples", type=int, default=20000, help="Questions kept as safe examples of the content filter pre-screen.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    conversations = load_turns(args.uri, args.db_name)
+    for task in (["sales", "consent", "content_filter"] if args.task == "all" else [args.task]):
+        run(task, args, conversations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import re
+from concurrent.futures import Executor
+from typing import Awaitable, Dict, Iterable, List, Optional, Pattern, Tuple, Union
+from utils.local_classifier import CONSENT_REPLIES, SafeExamplesClassifier
+from utils.metrics import in_context, metrics, span
+from utils.response_cache import normalize_input
+
+prescreen_requests = metrics.counter("chatbot_content_prescreen_requests_total", "Content filter pre-screen decisions by conversation state and result (allow_list, classifier, pattern, ambiguous, disabled).")
+prescreen_avoided_calls = metrics.counter("chatbot_content_prescreen_avoided_calls_total", "Content filter LLM calls avoided by the pre-screen, by conversation state.")
+
+# Same shape as the answers of the content filter assistant (prompts/content_filter.md)
+SAFE_VERDICT = '{"is_safe": true, "reason": "Safe content"}'
+
+# Replies that are always safe: greetings, thanks and the consent replies
+ALLOW_LIST = {
+    "hi", "hello", "hey", "good morning", "good afternoon", "good evening", "hola", "buenos días", "buenas tardes", "buenas noches", "bonjour", "hallo",
+    "thanks", "thank you", "thanks a lot", "thank you very much", "gracias", "muchas gracias", "merci", "danke", "obrigado",
+    "bye", "goodbye", "adiós", "adios", "hasta luego", "ok thanks", "ok thank you", "great", "perfect", "perfecto", "genial",
+    *CONSENT_REPLIES,
+}
+
+# Categories of prompts/content_filter.md. A match does not block the input: it always goes to the LLM filter.
+UNSAFE_PATTERNS: Dict[str, List[str]] = {
+    "hate": [r"\b(nazi|racist|subhuman|inferior race|go back to your country)\b", r"\b(n[i1]gg\w*|f[a4]gg?[o0]t\w*|retard\w*|maric[oó]n\w*|sudaca\w*)\b"],
+    "violence": [r"\b(kill|murder|shoot|stab|bomb|hurt|beat up)\b", r"\b(matar|asesinar|disparar|apuñalar|bomba|golpear)\w*"],
+    "sexual": [r"\b(sex\w*|porn\w*|nude\w*|naked|horny|not wearing anything)\b", r"\b(desnud\w*|follar|coger|sexo|porno|cachond\w*)\b"],
+    "self_harm": [r"\b(suicid\w*|self[- ]harm|hurting myself|kill myself|end my life|cut myself)\b", r"\b(suicid\w*|matarme|hacerme daño|quitarme la vida)\b"],
+    "vulgar": [r"\b(fuck\w*|shit\w*|bitch\w*|asshole\w*|dick\w*|cunt\w*|idiot\w*|dumb|stupid|moron\w*)\b",
+               r"(\bverg[ao]\w*|lloverga|relampague\w*|\bput[ao]s?\b|mierda|pendej\w*|cabr[oó]n\w*|pinche|chinga\w*|coño|gilipollas|idiota|estúpid\w*)"],
+    "scam": [r"(https?://|www\.|\.(ru|xyz|top|click)\b)", r"\b(click (this|the|here)|free (iphone|money|gift)|win (a|an|\$)|gift card|lottery|wire transfer|crypto wallet|password|verify your account)\b",
+             r"\b(haz clic|gana (un|una|dinero)|lotería|transferencia|contraseña)\b"],
+}
+
+
+def compile_patterns(patterns: Dict[str, List[str]]) -> List[Tuple[str, Pattern]]:
+    return [(category, re.compile(pattern, re.IGNORECASE)) for category, category_patterns in patterns.items() for pattern in category_patterns]
+
+
+class ContentPrescreen:
+    """
+    Local pre-screen in front of the content filter assistant. It clears obviously benign input without an LLM call
+    and escalates everything else:
+    1. Input that matches a pattern of the unsafe categories goes to the LLM filter.
+    2. Input in the allow-list is safe.
+    3. If a classifier is given, input very similar to questions that already passed the filter is safe.
+    4. Anything else goes to the LLM filter.
+    The pre-screen only applies in the conversation states of `states` (None: all of them); in the others every input
+    goes to the LLM filter. The state may still be loading when screen() starts: the local checks, and the LLM
+    filter when they escalate, do not wait for it.
+    """
+
+    def __init__(self, assistant, allow_list: Iterable[str] = ALLOW_LIST, patterns: Dict[str, List[str]] = UNSAFE_PATTERNS, classifier: Optional[SafeExamplesClassifier] = None,
+                 states: Optional[Iterable[str]] = None, executor: Optional[Executor] = None):
+        self.assistant = assistant
+        self.allow_list = {normalize_input(text) for text in allow_list}
+        self.patterns = compile_patterns(patterns)
+        self.classifier = classifier
+        self.states = set(states) if states is not None else None
+        self.executor = executor
+
+    def matched_category(self, text: str) -> Optional[str]:
+        for category, pattern in self.patterns:
+            if pattern.search(text):
+                return category
+        return None
+
+    async def local_verdict(self, text: str) -> str:
+        """allow_list/classifier if the input is cleared locally, pattern/ambiguous if it needs the LLM filter."""
+        category = self.matched_category(text)
+        if category is not None:
+            logging.info(f"Content pre-screen: input matches the {category} patterns, asking the content filter.")
+            return "pattern"
+        if normalize_input(text).replace(",", "") in self.allow_list:
+            return "allow_list"
+        if self.classifier is not None:
+            try:
+                loop = asyncio.get_running_loop()
+                with span("content_prescreen", self.classifier.encoder_name):
+                    if await loop.run_in_executor(self.executor, in_context(self.classifier.is_safe, text)):
+                        return "classifier"
+            except Exception as e:
+                logging.warning(f"Content pre-screen classifier failed, asking the content filter: {e}")
+        return "ambiguous"
+
+    def enabled(self, state: str) -> bool:
+        return self.states is None or state in self.states
+
+    async def screen(self, text: str, state: Union[str, Awaitable[str]]) -> dict:
+        """
+        Returns the same dict as Assistant.chat_completion_response, with the content filter verdict in answer.
+        :param text: The user input.
+        :param state: The conversation state, or an awaitable of it (e.g. once the conversation is loaded). It is
+                      only awaited to decide on input the local checks cleared, and to label the metrics.
+        """
+        result = await self.local_verdict(text)
+        if result in ("allow_list", "classifier"):
+            state = state if isinstance(state, str) else await state
+            if self.enabled(state):
+                prescreen_requests.inc(state=state, result=result)
+                prescreen_avoided_calls.inc(state=state)
+                return {"answer": SAFE_VERDICT, "tokens_input": 0, "tokens_output": 0}
+            prescreen_requests.inc(state=state, result="disabled")
+            return await self.assistant.chat_completion_response(prompt=self.assistant.base_prompt, question=text)
+        # The LLM filter decides whatever the state is: ask it while the state is loading
+        filter_call = asyncio.ensure_future(self.assistant.chat_completion_response(prompt=self.assistant.base_prompt, question=text))
+        try:
+            state = state if isinstance(state, str) else await state
+        except BaseException:
+            filter_call.cancel()
+            raise
+        prescreen_requests.inc(state=state, result=result if self.enabled(state) else "disabled")
+        return await filter_call
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from typing import Dict, Iterable
+from storage.db.conversation_state import ConversationState, ConversationStateCache
+from utils.llm_manager import Assistant
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (4 characters per token), enough for the history budget."""
+    return len(text) // 4 + 1
+
+
+def format_turns(turns: Iterable[dict]) -> str:
+    """Formats conversation turns (question/answer documents) as a User/Assistant transcript."""
+    lines = []
+    for turn in turns:
+        if turn.get("question"):
+            lines.append(f"User: {turn.get('question')}")
+        if turn.get("answer"):
+            lines.append(f"Assistant: {turn.get('answer')}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer:
+    """
+    Rolling summary of every conversation, so the memory stage does not get the whole transcript on every turn.
+
+    Once history_turns saved turns are not covered by the summary, schedule() folds them into it in a background task,
+    and stores it with the last turn it covers. Until then the memory stage gets those turns raw, so shorter
+    conversations never pay for a summary. chat_history() gives the memory stage the summary plus the newest turns;
+    while there is no summary it falls back to the last history_turns turns. The raw turns are cut to
+    history_max_tokens and the summary is asked to stay under summary_max_tokens, so the memory prompt stays about the
+    same size however long the conversation gets.
+    """
+
+    def __init__(self, assistant: Assistant, states: ConversationStateCache, history_turns: int = 4, history_max_tokens: int = 1500, summary_max_tokens: int = 300):
+        self.assistant = assistant
+        self.states = states
+        self.history_turns = history_turns
+        self.history_max_tokens = history_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def chat_history(self, state: ConversationState) -> str:
+        """Chat history for the memory stage: the summary and the turns it does not cover (at least the last one)."""
+        turns = state.unsummarized_turns() or list(state.recent_turns)[-1:]
+        turns = turns[-self.history_turns:]
+        while len(turns) > 1 and estimate_tokens(format_turns(turns)) > self.history_max_tokens:
+            turns = turns[1:] # Drop the oldest turns first
+        history = format_turns(turns)
+        if state.summary:
+            return f"Summary of the earlier conversation: {state.summary}\n{history}".strip()
+        return history
+
+    def schedule(self, conversation_id: str, state: ConversationState):
+        """Updates the summary of the conversation in the background, if history_turns turns of the state are not summarized.
+        If an update is already running, the next turn catches up."""
+        if state.turn_count - state.summarized_turns < self.history_turns or conversation_id in self.tasks:
+            return
+        task = asyncio.ensure_future(self.summarize(conversation_id))
+        self.tasks[conversation_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(conversation_id, None))
+
+    async def summarize(self, conversation_id: str):
+        """Folds the turns that are not summarized yet into the summary. Errors are logged; the memory stage falls back to the raw turns."""
+        try:
+            state = await self.states.get(conversation_id=conversation_id)
+            turns = state.unsummarized_turns()
+            if not turns:
+                return
+            summarized_turns = state.turn_count
+            prompt = self.assistant.base_prompt.format(summary=state.summary or "(empty)", new_turns=format_turns(turns), max_words=int(self.summary_max_tokens * 0.75))
+            summary_api_call = await self.assistant.chat_completion_response(prompt=prompt, question="")
+            summary = (summary_api_call.get("answer") or "").strip()[:self.summary_max_tokens * 4]
+            if summary:
+                await self.states.set_summary(conversation_id, turns[-1], summary, summarized_turns)
+        except Exception as e:
+            logging.warning(f"Could not update the summary of conversation {conversation_id}: {e}")
+
+    async def aclose(self, timeout: float = 10):
+        """Waits for the pending summary updates, e.g. before closing the Mongo connections."""
+        if self.tasks:
+            await asyncio.wait(list(self.tasks.values()), timeout=timeout)
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from utils.metrics import metrics
+
+embedding_cache_requests = metrics.counter("chatbot_embedding_cache_requests_total", "Texts looked up in the on-disk embedding cache by result (hit/miss).")
+embedding_cache_evictions = metrics.counter("chatbot_embedding_cache_evictions_total", "Embeddings evicted from the on-disk embedding cache (size).")
+
+DIGEST_BYTES = 16
+
+
+def text_key(model: str, text: str) -> bytes:
+    """Content address of an embedding: hash of the model and the text."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()[:DIGEST_BYTES]
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model, hash of the text), shared by provision.py and the app.
+
+    Vectors are stored as float32 rows in one file per dimension (vectors_<dim>.f32), each row prefixed with the
+    key, and an SQLite index maps every key to its row and last use. Above max_megabytes the least recently used
+    embeddings are evicted and their rows reused. A row is only returned if its key matches, so a row that another
+    process has just reused is a miss, not a wrong vector.
+    The last use of a hit is only written when it is older than touch_interval_seconds, so hits on the request path
+    seldom take the SQLite write lock; eviction order is accurate to that interval.
+    """
+
+    def __init__(self, directory: str, max_megabytes: float = 1024, touch_interval_seconds: float = 3600):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        self.touch_interval_seconds = touch_interval_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, "index.sqlite"), timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, dim INTEGER NOT NULL, slot INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS free_slots (dim INTEGER NOT NULL, slot INTEGER NOT NULL, PRIMARY KEY (dim, slot))")
+
+    def _path(self, dim: int) -> str:
+        return os.path.join(self.directory, f"vectors_{dim}.f32")
+
+    @staticmethod
+    def _row_bytes(dim: int) -> int:
+        return DIGEST_BYTES + dim * 4
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached embeddings of the texts, None for the ones that are not cached."""
+        keys = [text_key(model, text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        with self.lock:
+            rows = {}
+            for start in range(0, len(keys), 500):
+                batch = list(set(keys[start:start + 500]))
+                query = f"SELECT key, dim, slot, last_used FROM entries WHERE key IN ({','.join('?' * len(batch))})"
+                rows.update({key: (dim, slot, last_used) for key, dim, slot, last_used in self.connection.execute(query, batch)})
+            files = {}
+            try:
+                found = []
+                for i, key in enumerate(keys):
+                    if key not in rows:
+                        continue
+                    dim, slot, _ = rows[key]
+                    if dim not in files:
+                        files[dim] = open(self._path(dim), "rb")
+                    files[dim].seek(slot * self._row_bytes(dim))
+                    row = files[dim].read(self._row_bytes(dim))
+                    if len(row) == self._row_bytes(dim) and row[:DIGEST_BYTES] == key:
+                        results[i] = np.frombuffer(row[DIGEST_BYTES:], dtype=np.float32).tolist()
+                        found.append(key)
+            finally:
+                for file in files.values():
+                    file.close()
+            now = time.time()
+            stale = [key for key in set(found) if rows[key][2] < now - self.touch_interval_seconds]
+            if stale: # One transaction for the batch. It only orders the eviction: a failure does not fail the lookup
+                try:
+                    self.connection.execute("BEGIN IMMEDIATE")
+                    self.connection.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in stale])
+                    self.connection.execute("COMMIT")
+                except sqlite3.Error as e:
+                    if self.connection.in_transaction:
+                        self.connection.execute("ROLLBACK")
+                    logging.warning(f"Embedding cache: could not update the last use of {len(stale)} embeddings: {e}")
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(texts) - hits
+        embedding_cache_requests.inc(hits, result="hit")
+        embedding_cache_requests.inc(len(texts) - hits, result="miss")
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Stores the embeddings of the texts, then evicts the least recently used ones above max_megabytes."""
+        entries = {text_key(model, text): np.asarray(vector, dtype=np.float32) for text, vector in zip(texts, vectors)}
+        if not entries:
+            return
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE") # Serializes the writers of every process
+            try:
+                now = time.time()
+                existing = set()
+                keys = list(entries)
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    existing.update(key for (key,) in self.connection.execute(f"SELECT key FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch))
+                by_dim: Dict[int, list] = {}
+                for key, vector in entries.items():
+                    if key not in existing:
+                        by_dim.setdefault(len(vector), []).append((key, vector))
+                for dim, items in by_dim.items():
+                    free = [slot for (slot,) in self.connection.execute("SELECT slot FROM free_slots WHERE dim = ? ORDER BY slot LIMIT ?", (dim, len(items)))]
+                    self.connection.executemany("DELETE FROM free_slots WHERE dim = ? AND slot = ?", [(dim, slot) for slot in free])
+                    path = self._path(dim)
+                    with open(path, "r+b" if os.path.exists(path) else "w+b") as file:
+                        file.seek(0, os.SEEK_END)
+                        next_slot = file.tell() // self._row_bytes(dim)
+                        slots = free + list(range(next_slot, next_slot + len(items) - len(free)))
+                        for slot, (key, vector) in sorted(zip(slots, items), key=lambda item: item[0]):
+                            file.seek(slot * self._row_bytes(dim))
+                            file.write(key + vector.tobytes())
+                    self.connection.executemany("INSERT INTO entries (key, dim, slot, last_used) VALUES (?, ?, ?, ?)",
+                                                [(key, dim, slot, now) for slot, (key, _) in zip(slots, items)])
+                self._evict()
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self):
+        size = self.connection.execute(f"SELECT COALESCE(SUM({DIGEST_BYTES} + dim * 4), 0) FROM entries").fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        evicted = []
+        for key, dim, slot in self.connection.execute("SELECT key, dim, slot FROM entries ORDER BY last_used"):
+            evicted.append((key, dim, slot))
+            size -= self._row_bytes(dim)
+            if size <= self.max_bytes * 0.9: # Some headroom, so eviction does not run on every insert
+                break
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _, _ in evicted])
+        self.connection.executemany("INSERT OR IGNORE INTO free_slots (dim, slot) VALUES (?, ?)", [(dim, slot) for _, dim, slot in evicted])
+        embedding_cache_evictions.inc(len(evicted))
+        logging.info(f"Embedding cache: evicted {len(evicted)} embeddings")
+
+    def embed(self, model: str, texts: List[str], compute: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """Embeddings of the texts: cached ones from disk, the rest computed (once per distinct text) with compute() and stored."""
+        results = self.get_many(model, texts)
+        missing = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+        if missing:
+            computed = dict(zip(missing, (np.asarray(vector, dtype=np.float32).tolist() for vector in compute(missing)))) # float32 like the cached ones
+            self.put_many(model, missing, [computed[text] for text in missing])
+            results = [result if result is not None else computed[text] for text, result in zip(texts, results)]
+        return results
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.connection.execute(f"SELECT COUNT(*), COALESCE(SUM({DIGEST_BYTES} + dim * 4), 0) FROM entries").fetchone()
+            return {"entries": entries, "megabytes": round(size / 1024 / 1024, 2), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class CachedEmbeddingFunction:
+    """Embedding function (ChromaDB style: list of texts in, list of vectors out) that goes through an EmbeddingCache."""
+
+    def __init__(self, embedding_function: Callable[[List[str]], List[List[float]]], cache: EmbeddingCache, model: Optional[str] = None):
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.model = model or getattr(embedding_function, "model", None) or getattr(embedding_function, "model_name", None) or type(embedding_function).__name__
+
+    def __call__(self, input):
+        if isinstance(input, str):
+            input = [input]
+        return self.cache.embed(self.model, list(input), lambda texts: [list(vector) for vector in self.embedding_function(texts)])
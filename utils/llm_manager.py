@@ -1,15 +1,26 @@
+import asyncio
 import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, Tuple
+import numpy as np
 from pydantic import BaseModel
-from storage.vector_db.vectorstore import ChromaVectorStore
-import time
+from storage.vector_db.vectorstore import ChromaVectorStore, QueryContext
+from utils.metrics import in_context, record_tokens, span, stage_retries
+from utils.response_cache import ResponseCache
+from utils.semantic_cache import SemanticCache
 
 
 class LLMClient:
-    def __init__(self, client, base_prompt: str, model: str = "gpt-4o", max_retries: int =3):
+    def __init__(self, client, base_prompt: str, model: str = "gpt-4o", max_retries: int =3, name: str = None, cache: Optional[ResponseCache] = None):
+        """The client is expected to be an AsyncOpenAI instance, so requests do not block the event loop.
+        name labels the metrics of this client's requests (e.g. content_filter), it defaults to the class name.
+        If a cache is given, repeated (prompt, question) pairs are answered from it without calling the model."""
         self.client = client
         self.model = model
         self.base_prompt = base_prompt
         self.max_retries = max_retries
+        self.name = name or self.__class__.__name__.lower()
+        self.cache = cache
 
     def _handle_response(self, response):
         # Check if 'choices' exists and is not empty
@@ -24,85 +35,199 @@ class LLMClient:
             return False
 
         return True
-    
-    
-    def chat_completion_response(self, prompt: str, question: str) -> dict:
+
+
+    async def chat_completion_response(self, prompt: str, question: str, on_token: Optional[Callable[[str], Awaitable[None]]] = None) -> dict:
         """This method receives a formatted prompt and returns the response as a string.
-        In this request the prompt is on the content and a question string ."""
+        In this request the prompt is on the content and a question string .
+        If on_token is given the completion is streamed and on_token is awaited with every text delta as it arrives."""
         messages=[
                 {"role": "system", "content": prompt},
                 {"role": "user", "content": question}
             ]
+        if on_token is not None:
+            with span(self.name, self.model):
+                return await self._stream_chat_completion(messages, on_token)
+        if self.cache is not None:
+            key = self.cache.make_key(self.model, prompt, question)
+            result, hit = await self.cache.get_or_compute(key, lambda: self._chat_completion(messages))
+            if hit: # No tokens were spent on this request
+                return {"answer": result.get("answer"), "tokens_input": 0, "tokens_output": 0}
+            return result
+        return await self._chat_completion(messages)
+
+
+    async def _chat_completion(self, messages: list) -> dict:
+        """Sends the chat completion request, retrying incomplete responses. Returns the same dict as chat_completion_response."""
+        with span(self.name, self.model):
+            attempts = 0
+            while attempts < self.max_retries:
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages
+                    )
+                except Exception as e:
+                    logging.error(f"[ERROR] OpenAI request failed: {str(e)}")
+                    raise
+                if self._handle_response(response):
+                    tokens_input = response.usage.prompt_tokens
+                    tokens_output = response.usage.completion_tokens
+                    answer = response.choices[0].message.content
+                    logging.info(f"chat_completion_response: tokens_input={tokens_input} - tokens_output={tokens_output}")
+                    record_tokens(self.name, self.model, tokens_input, tokens_output)
+                    return {"answer": answer, "tokens_input": tokens_input, "tokens_output": tokens_output}
+                attempts += 1
+                stage_retries.inc(stage=self.name, model=self.model)
+                await asyncio.sleep(2 ** attempts)  # Exponential backoff for retries
+            raise Exception(f"Failed after {self.max_retries} retries.")
+
+
+    async def _stream_chat_completion(self, messages: list, on_token: Callable[[str], Awaitable[None]]) -> dict:
+        """Streams a chat completion, forwarding every text delta to on_token. Returns the same dict as chat_completion_response.
+        Retries are only possible before the first token has been forwarded."""
         attempts = 0
         while attempts < self.max_retries:
             try:
-                response = self.client.chat.completions.create(
+                stream = await self.client.chat.completions.create(
                     model=self.model,
-                    messages=messages
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True}
                 )
             except Exception as e:
                 logging.error(f"[ERROR] OpenAI request failed: {str(e)}")
                 raise
-            if self._handle_response(response):
-                tokens_input = response.usage.prompt_tokens
-                tokens_output = response.usage.completion_tokens
-                answer = response.choices[0].message.content
-                logging.info(f"chat_completion_response: tokens_input={tokens_input} - tokens_output={tokens_output}")
+            parts = []
+            finish_reason = None
+            tokens_input = 0
+            tokens_output = 0
+            async for chunk in stream:
+                if chunk.usage: # Last chunk, only carries the usage
+                    tokens_input = chunk.usage.prompt_tokens
+                    tokens_output = chunk.usage.completion_tokens
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    parts.append(choice.delta.content)
+                    await on_token(choice.delta.content)
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+            if parts and finish_reason in [None, 'stop', 'length']:
+                answer = "".join(parts)
+                logging.info(f"chat_completion_response (stream): tokens_input={tokens_input} - tokens_output={tokens_output}")
+                record_tokens(self.name, self.model, tokens_input, tokens_output)
                 return {"answer": answer, "tokens_input": tokens_input, "tokens_output": tokens_output}
+            if parts: # Tokens were already sent, the stream cannot be retried
+                raise Exception(f"Stream finished with reason {finish_reason}.")
             attempts += 1
-            time.sleep(2 ** attempts)  # Exponential backoff for retries
+            stage_retries.inc(stage=self.name, model=self.model)
+            await asyncio.sleep(2 ** attempts)  # Exponential backoff for retries
         raise Exception(f"Failed after {self.max_retries} retries.")
 
-    
-    def chat_completion_structured_response(self, prompt: str, output_format: BaseModel) -> BaseModel:
+
+    async def chat_completion_structured_response(self, prompt: str, output_format: BaseModel) -> BaseModel:
         """This method receives a formatted prompt and the desired structured output format, and returns a class of the desired structured output format."""
         messages = [
                 {"role": "system", "content": "You are an expert at structured data extraction. You will be given unstructured text and should convert it into the given structure."},
                 {"role": "user", "content": prompt}
             ]
-        attempts = 0
-        while attempts < self.max_retries:
-            try:            
-                response = self.client.beta.chat.completions.parse(
-                    model="gpt-4o-2024-08-06",
-                    messages=messages,
-                    response_format=output_format,
-                )
-            except Exception as e:
-                logging.error(f"[ERROR] OpenAI request failed: {str(e)}")
-                raise
-            if self._handle_response(response):
-                tokens_input = response.usage.prompt_tokens
-                tokens_output = response.usage.completion_tokens
-                answer = response.choices[0].message.parsed
-                logging.info(f"chat_completion_response: tokens_input={tokens_input} - tokens_output={tokens_output}")
-                return {"answer": answer, "tokens_input": tokens_input, "tokens_output": tokens_output}
-            attempts += 1
-            time.sleep(2 ** attempts)  # Exponential backoff for retries
-        raise Exception(f"Failed after {self.max_retries} retries.")
+        structured_model = "gpt-4o-2024-08-06"
+        stage = f"{self.name}_structured"
+        with span(stage, structured_model):
+            attempts = 0
+            while attempts < self.max_retries:
+                try:
+                    response = await self.client.beta.chat.completions.parse(
+                        model=structured_model,
+                        messages=messages,
+                        response_format=output_format,
+                    )
+                except Exception as e:
+                    logging.error(f"[ERROR] OpenAI request failed: {str(e)}")
+                    raise
+                if self._handle_response(response):
+                    tokens_input = response.usage.prompt_tokens
+                    tokens_output = response.usage.completion_tokens
+                    answer = response.choices[0].message.parsed
+                    logging.info(f"chat_completion_response: tokens_input={tokens_input} - tokens_output={tokens_output}")
+                    record_tokens(stage, structured_model, tokens_input, tokens_output)
+                    return {"answer": answer, "tokens_input": tokens_input, "tokens_output": tokens_output}
+                attempts += 1
+                stage_retries.inc(stage=stage, model=structured_model)
+                await asyncio.sleep(2 ** attempts)  # Exponential backoff for retries
+            raise Exception(f"Failed after {self.max_retries} retries.")
 
 
 class Assistant(LLMClient):
-    def __init__(self, client, base_prompt, model="gpt-4o", max_retries=3):
-        super().__init__(client=client, base_prompt=base_prompt, model=model, max_retries=max_retries)
+    def __init__(self, client, base_prompt, model="gpt-4o", max_retries=3, name=None, cache=None):
+        super().__init__(client=client, base_prompt=base_prompt, model=model, max_retries=max_retries, name=name, cache=cache)
 
 
 class RAG(LLMClient):
-    def __init__(self, client, vectorstore: ChromaVectorStore, retrieval_strategy: str = "hybrid_search", base_prompt: str = None, model: str = "gpt-4o", max_retries: int = 3):
-        super().__init__(client=client, base_prompt=base_prompt, model=model, max_retries=max_retries)
+    def __init__(self, client, vectorstore: ChromaVectorStore, retrieval_strategy: str = "hybrid_search", base_prompt: str = None, model: str = "gpt-4o", max_retries: int = 3, executor: Optional[Executor] = None, max_retrieval_workers: int = 8, name: str = "rag", semantic_cache: Optional[SemanticCache] = None):
+        """
+        The retrieval strategies are synchronous (Chroma, embeddings and the cross-encoder), so they run on a
+        bounded executor instead of the event loop. max_retrieval_workers caps how many retrievals run at once.
+        If a semantic_cache is given, lookup_answer/remember_answer serve answers to questions similar to ones already answered.
+        """
+        super().__init__(client=client, base_prompt=base_prompt, model=model, max_retries=max_retries, name=name)
         self.vectorstore = vectorstore
         self.retrieval_strategy = retrieval_strategy
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=max_retrieval_workers, thread_name_prefix="retrieval")
+        self.semantic_cache = semantic_cache
 
-    def get_context(self, question: str, number_of_docs: int = 8) -> str:
-        """Retrieves and formats the context."""
+    def query_context(self, question: str) -> QueryContext:
+        """Per-request retrieval state of the question. Share it between get_context and lookup_answer to embed the question once."""
+        return self.vectorstore.query_context([question])
+
+    def retrieve_context(self, question: str, number_of_docs: int = 8, query_context: Optional[QueryContext] = None) -> str:
+        """Retrieves and formats the context. Blocking, use get_context from async code."""
         try:
-            context_list = self.vectorstore.apply_retrieval_strategy(self.retrieval_strategy, query_texts=[question], n_results=number_of_docs)
+            context_list = self.vectorstore.apply_retrieval_strategy(self.retrieval_strategy, query_texts=[question], n_results=number_of_docs, query_context=query_context)
             resultado = "/n/n".join(item.get("document") for item in context_list)
             return resultado
         except Exception as e:
-            raise Exception("Error trying to retrieve context: {e}")
+            raise Exception(f"Error trying to retrieve context: {e}")
+
+    async def get_context(self, question: str, number_of_docs: int = 8, query_context: Optional[QueryContext] = None) -> str:
+        """
+        Retrieves and formats the context on the retrieval executor.
+        Cancelling it does not stop the executor thread, which cannot be interrupted: the retrieval runs on, but
+        query_context.cancelled is set so it skips the cross-encoder if it has not started yet.
+        """
+        loop = asyncio.get_running_loop()
+        query_context = query_context if query_context is not None else self.query_context(question)
+        with span("retrieval", self.retrieval_strategy): # Includes the time waiting for a free retrieval worker
+            try:
+                return await loop.run_in_executor(self.executor, in_context(self.retrieve_context, question, number_of_docs, query_context))
+            except asyncio.CancelledError:
+                query_context.cancelled.set()
+                raise
+
+    def _lookup_answer(self, question: str, query_context: QueryContext) -> Tuple[Optional[str], np.ndarray]:
+        return self.semantic_cache.lookup(question, query_context.embeddings()[0])
+
+    async def lookup_answer(self, question: str, query_context: Optional[QueryContext] = None) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Returns (cached answer or None, question embedding) from the semantic cache. Errors count as a miss.
+        The embedding comes from query_context (computed once for this and the retrieval)."""
+        if self.semantic_cache is None:
+            return None, None
+        loop = asyncio.get_running_loop()
+        try:
+            with span("semantic_cache", "embeddings"):
+                return await loop.run_in_executor(self.executor, in_context(self._lookup_answer, question, query_context or self.query_context(question)))
+        except Exception as e:
+            logging.warning(f"Semantic cache lookup failed, answering without it: {e}")
+            return None, None
+
+    def remember_answer(self, question: str, embedding: Optional[np.ndarray], answer: str):
+        """Stores an answer in the semantic cache, using the embedding returned by lookup_answer."""
+        if self.semantic_cache is not None and embedding is not None and answer:
+            self.semantic_cache.store(question, embedding, answer)
 
     def format_prompt(self, context: str) -> str:
         """Format the base_prompt with the given context."""
         return self.base_prompt.replace("{context}", context)
-    
+
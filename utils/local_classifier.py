@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from utils.metrics import in_context, metrics, span
+from utils.response_cache import normalize_input
+
+local_classifier_requests = metrics.counter("chatbot_local_classifier_requests_total", "Classifier requests by how they were answered (rule, local, llm).")
+
+DEFAULT_ENCODER = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# Replies to the consent request that need no model at all (English, Spanish, French, German, Italian and Portuguese)
+CONSENT_REPLIES = {
+    **{reply: "Strong" for reply in ["yes", "yeah", "yep", "sure", "ok", "okay", "of course", "absolutely", "go ahead", "yes please", "yes sure",
+                                     "si", "sí", "claro", "vale", "por supuesto", "oui", "bien sûr", "ja", "certo", "sim", "claro que sim"]},
+    **{reply: "No" for reply in ["no", "nope", "no thanks", "no thank you", "not now", "no gracias", "non", "non merci", "nein", "nein danke", "não", "nao"]},
+}
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(model_name: str):
+    """Loads a sentence-transformers model once per process (on CPU)."""
+    with _encoders_lock:
+        if model_name not in _encoders:
+            from sentence_transformers import SentenceTransformer
+            _encoders[model_name] = SentenceTransformer(model_name, device="cpu")
+        return _encoders[model_name]
+
+
+def encode(model_name: str, texts: List[str]) -> np.ndarray:
+    """Normalized sentence embeddings of the texts."""
+    return np.asarray(get_encoder(model_name).encode(texts, normalize_embeddings=True, convert_to_numpy=True), dtype=np.float32)
+
+
+def train_logistic_regression(features: np.ndarray, labels: np.ndarray, l2: float = 1e-3, epochs: int = 1000, learning_rate: float = 0.5) -> Tuple[np.ndarray, float]:
+    """Binary logistic regression by full-batch gradient descent, with balanced class weights. Returns (weights, bias)."""
+    labels = labels.astype(np.float32)
+    positives = max(labels.sum(), 1.0)
+    negatives = max(len(labels) - labels.sum(), 1.0)
+    sample_weights = np.where(labels == 1, len(labels) / (2 * positives), len(labels) / (2 * negatives))
+    weights = np.zeros(features.shape[1], dtype=np.float32)
+    bias = 0.0
+    for _ in range(epochs):
+        probabilities = 1 / (1 + np.exp(-(features @ weights + bias)))
+        error = (probabilities - labels) * sample_weights
+        weights -= learning_rate * (features.T @ error / len(labels) + l2 * weights)
+        bias -= learning_rate * float(error.mean())
+    return weights, bias
+
+
+class LocalClassifier:
+    """
+    Logistic regression over sentence-transformers embeddings that answers a binary classifier assistant
+    (sales intent, consent). It only answers when it is confident: a probability of at least `confidence` gives the
+    positive label ("Strong"), at most 1 - confidence the negative one ("No"), anything in between returns None.
+    """
+
+    def __init__(self, weights: np.ndarray, bias: float, encoder_name: str = DEFAULT_ENCODER, confidence: float = 0.9):
+        self.weights = weights
+        self.bias = bias
+        self.encoder_name = encoder_name
+        self.confidence = confidence
+
+    def probabilities(self, texts: List[str]) -> np.ndarray:
+        return 1 / (1 + np.exp(-(encode(self.encoder_name, texts) @ self.weights + self.bias)))
+
+    def predict(self, text: str) -> Optional[str]:
+        probability = float(self.probabilities([text])[0])
+        if probability >= self.confidence:
+            return "Strong"
+        if probability <= 1 - self.confidence:
+            return "No"
+        return None
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, weights=self.weights, bias=np.float32(self.bias), encoder_name=np.array(self.encoder_name))
+
+    @classmethod
+    def load(cls, path: str, confidence: float = 0.9) -> Optional["LocalClassifier"]:
+        """Loads a classifier saved by train_classifiers.py. Returns None if there is none, so the LLM answers everything."""
+        if not os.path.exists(path):
+            logging.info(f"Local classifier {path} not found, the LLM will answer every request.")
+            return None
+        data = np.load(path)
+        return cls(weights=data["weights"], bias=float(data["bias"]), encoder_name=str(data["encoder_name"]), confidence=confidence)
+
+
+class SafeExamplesClassifier:
+    """
+    Nearest-neighbour check of the content filter pre-screen: an input is safe when its embedding is at least
+    `similarity` (cosine) close to a question that already passed the content filter. It never marks input as unsafe.
+    """
+
+    def __init__(self, embeddings: np.ndarray, encoder_name: str = DEFAULT_ENCODER, similarity: float = 0.9):
+        self.embeddings = embeddings
+        self.encoder_name = encoder_name
+        self.similarity = similarity
+
+    def is_safe(self, text: str) -> bool:
+        return bool(len(self.embeddings)) and float((self.embeddings @ encode(self.encoder_name, [text])[0]).max()) >= self.similarity
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, embeddings=self.embeddings, encoder_name=np.array(self.encoder_name))
+
+    @classmethod
+    def load(cls, path: str, similarity: float = 0.9) -> Optional["SafeExamplesClassifier"]:
+        """Loads the examples saved by train_classifiers.py. Returns None if there are none."""
+        if not os.path.exists(path):
+            logging.info(f"Safe examples {path} not found, the content pre-screen will only use its rules.")
+            return None
+        data = np.load(path)
+        return cls(embeddings=data["embeddings"], encoder_name=str(data["encoder_name"]), similarity=similarity)
+
+
+class ClassifierCascade:
+    """
+    Answers a classifier assistant from the cheapest source that is sure: exact replies (rules), then the local
+    classifier, and only in its uncertain band the LLM assistant.
+
+    The rules and the local classifier look at the user message (text); the LLM gets llm_question if given
+    (e.g. the chat history) and text otherwise.
+    """
+
+    def __init__(self, name: str, assistant, classifier: Optional[LocalClassifier] = None, rules: Optional[Dict[str, str]] = None, executor: Optional[Executor] = None):
+        self.name = name
+        self.assistant = assistant
+        self.classifier = classifier
+        self.rules = rules or {}
+        self.executor = executor
+
+    async def classify(self, text: str, llm_question: Optional[str] = None) -> dict:
+        """Returns the same dict as Assistant.chat_completion_response."""
+        answer = self.rules.get(normalize_input(text).replace(",", ""))
+        if answer is not None:
+            local_classifier_requests.inc(classifier=self.name, result="rule")
+            return {"answer": answer, "tokens_input": 0, "tokens_output": 0}
+        if self.classifier is not None:
+            try:
+                loop = asyncio.get_running_loop()
+                with span(f"{self.name}_local", self.classifier.encoder_name):
+                    answer = await loop.run_in_executor(self.executor, in_context(self.classifier.predict, text))
+            except Exception as e:
+                logging.warning(f"Local classifier {self.name} failed, asking the LLM: {e}")
+            if answer is not None:
+                local_classifier_requests.inc(classifier=self.name, result="local")
+                return {"answer": answer, "tokens_input": 0, "tokens_output": 0}
+        local_classifier_requests.inc(classifier=self.name, result="llm")
+        return await self.assistant.chat_completion_response(prompt=self.assistant.base_prompt, question=llm_question if llm_question is not None else text)
@@ -0,0 +1,209 @@
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Branch of the generate_answer state machine the current request is in. It holds a mutable dict so stages
+# running as separate tasks (which get a copy of the context) still see the branch once it is decided.
+_current_branch: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("current_branch", default=None)
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, str]) -> LabelValues:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: LabelValues, extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = (f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: Dict[LabelValues, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_labels_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    def set(self, value: float, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Summary:
+    """
+    Latency/size distribution with labels. Keeps the last `window` observations per label set to compute
+    quantiles, plus the running count and sum, and is exported as a Prometheus summary.
+    """
+
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, name: str, description: str, window: int = 2048):
+        self.name = name
+        self.description = description
+        self.window = window
+        self.samples: Dict[LabelValues, deque] = {}
+        self.counts: Dict[LabelValues, int] = {}
+        self.sums: Dict[LabelValues, float] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=self.window)
+                self.counts[key] = 0
+                self.sums[key] = 0.0
+            self.samples[key].append(value)
+            self.counts[key] += 1
+            self.sums[key] += value
+
+    def quantile(self, q: float, **labels) -> float:
+        """Returns the q quantile (0-1) of the observations kept for the label set."""
+        with self.lock:
+            values = sorted(self.samples.get(_labels_key(labels), ()))
+        return self._quantile(values, q)
+
+    @staticmethod
+    def _quantile(ordered: List[float], q: float) -> float:
+        if not ordered:
+            return float("nan")
+        index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+        return ordered[index]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} summary"]
+        with self.lock:
+            snapshot = [(key, sorted(values), self.counts[key], self.sums[key]) for key, values in self.samples.items()]
+        for key, ordered, count, total in sorted(snapshot, key=lambda item: item[0]):
+            for q in self.quantiles:
+                lines.append(f"{self.name}{_format_labels(key, {'quantile': str(q)})} {self._quantile(ordered, q)}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process registry of metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, description: str):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, description)
+            return self.metrics[name]
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._get_or_create(Gauge, name, description)
+
+    def summary(self, name: str, description: str) -> Summary:
+        return self._get_or_create(Summary, name, description)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+stage_latency = metrics.summary("chatbot_stage_latency_seconds", "Latency of each stage of the answer pipeline.")
+stage_tokens = metrics.counter("chatbot_stage_tokens_total", "Tokens used by each LLM stage.")
+stage_retries = metrics.counter("chatbot_stage_retries_total", "Retries of LLM requests with an incomplete response.")
+stage_errors = metrics.counter("chatbot_stage_errors_total", "Stages that raised an exception.")
+
+
+def start_branch(branch: str = "unknown"):
+    """Starts tracking the state machine branch of the current request."""
+    _current_branch.set({"branch": branch})
+
+
+def set_branch(branch: str):
+    """Sets the branch of the current request. Spans finishing afterwards are labelled with it."""
+    holder = _current_branch.get()
+    if holder is None:
+        _current_branch.set({"branch": branch})
+    else:
+        holder["branch"] = branch
+
+
+def current_branch() -> str:
+    holder = _current_branch.get()
+    return holder["branch"] if holder else "none"
+
+
+def in_context(function: Callable, *args) -> Callable:
+    """
+    function(*args) bound to a copy of the current context, to submit to an executor: its threads do not get the
+    context of the caller (unlike tasks), so spans inside them would not know the branch of the request.
+    """
+    return functools.partial(contextvars.copy_context().run, function, *args)
+
+
+@contextmanager
+def span(stage: str, model: str = ""):
+    """
+    Times a block and records it in chatbot_stage_latency_seconds labelled with the stage, the model and the
+    branch of the request. Exceptions are counted in chatbot_stage_errors_total and re-raised.
+    Works in both sync and async code (`with span(...)` around an `await`).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e: # Cancelled speculative stages are not errors
+        stage_errors.inc(stage=stage, model=model, error=type(e).__name__)
+        raise
+    finally:
+        stage_latency.observe(time.perf_counter() - start, stage=stage, model=model, branch=current_branch())
+
+
+def record_tokens(stage: str, model: str, tokens_input: int, tokens_output: int):
+    """Adds the tokens of an LLM call to chatbot_stage_tokens_total."""
+    branch = current_branch()
+    stage_tokens.inc(tokens_input or 0, stage=stage, model=model, branch=branch, direction="input")
+    stage_tokens.inc(tokens_output or 0, stage=stage, model=model, branch=branch, direction="output")
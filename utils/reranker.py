@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from utils.metrics import metrics, span
+
+reranker_cache_requests = metrics.counter("chatbot_reranker_cache_requests_total", "(query, chunk) pairs looked up in the reranker score cache by result (hit/miss).")
+
+DEFAULT_RERANKER = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+BACKENDS = ("torch", "onnx", "onnx-int8")
+# Dynamically quantized (int8) ONNX export published with the sentence-transformers cross-encoders
+DEFAULT_INT8_FILE = "onnx/model_qint8_avx2.onnx"
+
+
+class CrossEncoderReranker:
+    """
+    Cross-encoder that scores (query, chunk) pairs for the reranking strategy, on CPU.
+
+    The model is loaded on first use (get_model(), which the app warm-up calls at startup), so importing the
+    vectorstore does not load a transformer. Backends: "torch" (sentence-transformers default), "onnx" (ONNX Runtime) and
+    "onnx-int8" (ONNX Runtime with the int8 quantized export, int8_file). Pairs are scored in batches of batch_size
+    with `threads` CPU threads, and the scores are kept in an LRU cache keyed by (query, chunk ID), cleared when
+    version_provider() changes (the collection was re-provisioned).
+    """
+
+    def __init__(self, model_name: str = DEFAULT_RERANKER, backend: str = "torch", batch_size: int = 32, threads: Optional[int] = None,
+                 cache_size: int = 10000, int8_file: str = DEFAULT_INT8_FILE, version_provider: Optional[Callable[[], str]] = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown reranker backend {backend}: must be one of {', '.join(BACKENDS)}.")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.threads = threads
+        self.cache_size = cache_size
+        self.int8_file = int8_file
+        self.version_provider = version_provider
+        self.version = None
+        self.cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.model = None
+        self.load_seconds: Optional[float] = None
+
+    def _load_model(self):
+        from sentence_transformers import CrossEncoder
+        if self.backend == "torch":
+            if self.threads:
+                import torch
+                torch.set_num_threads(self.threads)
+            return CrossEncoder(self.model_name, device="cpu")
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if self.threads:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = self.threads
+            model_kwargs["session_options"] = session_options
+        if self.backend == "onnx-int8":
+            model_kwargs["file_name"] = self.int8_file
+        return CrossEncoder(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    def get_model(self):
+        """The model, loaded once (concurrent callers wait for the same load)."""
+        if self.model is None:
+            with self.load_lock:
+                if self.model is None:
+                    start = time.perf_counter()
+                    with span("reranker_load", self.model_name):
+                        model = self._load_model()
+                        model.predict([["warm up", "warm up"]], batch_size=1) # First inference allocates the buffers
+                    self.load_seconds = time.perf_counter() - start
+                    logging.info(f"Reranker {self.model_name} ({self.backend}) loaded in {self.load_seconds:.1f}s")
+                    self.model = model
+        return self.model
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def _check_version(self):
+        if self.version_provider is None:
+            return
+        version = self.version_provider()
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+
+    def score(self, query: str, chunk_ids: List[str], documents: List[str]) -> np.ndarray:
+        """
+        Cross-encoder scores of the chunks for the query. Cached pairs are not scored again.
+        :param query: The query text.
+        :param chunk_ids: IDs of the chunks (cache keys).
+        :param documents: Texts of the chunks.
+        :return: The score of every chunk.
+        """
+        scores = np.zeros(len(documents), dtype=np.float64)
+        missing = []
+        with self.cache_lock:
+            self._check_version()
+            for i, chunk_id in enumerate(chunk_ids):
+                cached = self.cache.get((query, chunk_id))
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self.cache.move_to_end((query, chunk_id))
+                    scores[i] = cached
+        reranker_cache_requests.inc(len(documents) - len(missing), result="hit")
+        reranker_cache_requests.inc(len(missing), result="miss")
+        if missing:
+            model = self.get_model()
+            with span("cross_encoder", self.model_name):
+                computed = model.predict([[query, documents[i]] for i in missing], batch_size=self.batch_size)
+            with self.cache_lock:
+                for i, value in zip(missing, computed):
+                    scores[i] = float(value)
+                    if self.cache_size:
+                        self.cache[(query, chunk_ids[i])] = float(value)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return scores
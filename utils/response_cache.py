@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from utils.metrics import metrics
+
+cache_requests = metrics.counter("chatbot_response_cache_requests_total", "Lookups in the exact-match response cache by result (hit/miss).")
+cache_evictions = metrics.counter("chatbot_response_cache_evictions_total", "Entries evicted from the exact-match response cache (size or ttl).")
+
+
+def normalize_input(text: str) -> str:
+    """Normalizes a user input for exact matching: case, surrounding punctuation and whitespace are ignored."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.strip(" .!¡?¿,;:\"'")
+
+
+class ResponseCache:
+    """
+    Exact-match cache of LLM answers, keyed by model, hash of the system prompt and the normalized user input.
+    Entries expire after ttl_seconds and the least recently used ones are evicted above max_size.
+    Concurrent misses of the same key share a single LLM request.
+    """
+
+    def __init__(self, name: str, max_size: int = 10000, ttl_seconds: float = 3600):
+        self.name = name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, question: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"{model}:{prompt_hash}:{normalize_input(question)}"
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                cache_evictions.inc(assistant=self.name, reason="ttl")
+                entry = None
+            if entry is None:
+                self.misses += 1
+                cache_requests.inc(assistant=self.name, result="miss")
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            cache_requests.inc(assistant=self.name, result="hit")
+            return entry[1]
+
+    def set(self, key: str, value: dict):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                cache_evictions.inc(assistant=self.name, reason="size")
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        """Returns (value, hit). On a miss compute() is awaited once, even if the same key is requested concurrently."""
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        pending = self.inflight.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending), True
+            except asyncio.CancelledError:
+                if not pending.cancelled():  # This request was cancelled, not the one computing the value
+                    raise
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            value = await compute()
+            self.set(key, value)
+            future.set_result(value)
+            return value, False
+        except asyncio.CancelledError:
+            future.cancel()  # Waiters compute the value themselves
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Waiters get the exception; do not report it as unretrieved
+            raise
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
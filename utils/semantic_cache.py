@@ -0,0 +1,140 @@
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from utils.metrics import metrics
+
+semantic_cache_requests = metrics.counter("chatbot_semantic_cache_requests_total", "Lookups in the semantic answer cache by result (hit/miss).")
+semantic_cache_similarity = metrics.summary("chatbot_semantic_cache_best_similarity", "Cosine similarity of the closest cached question on every lookup, to tune the threshold.")
+semantic_cache_size = metrics.gauge("chatbot_semantic_cache_entries", "Answers kept in the semantic answer cache.")
+
+
+class SemanticCache:
+    """
+    Cache of RAG answers to first-turn questions, matched by the cosine similarity of the question embeddings.
+
+    A question is answered from the cache when an earlier answered question is at least `threshold` similar.
+    Entries expire after ttl_seconds, the least recently used are evicted above max_size, and the whole cache is
+    cleared when version_provider() changes (the vector collection was re-provisioned).
+    lookup() takes the question embedding the retrieval already computed (QueryContext), so a first turn is embedded once.
+    The embeddings, expiry and last use times live in preallocated arrays that grow in chunks (up to max_size rows),
+    so storing an answer does not copy the cache; a full cache overwrites the row of the least recently used entry.
+    """
+
+    def __init__(self, threshold: float = 0.96, max_size: int = 2000, ttl_seconds: float = 86400, version_provider: Optional[Callable[[], str]] = None):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.version_provider = version_provider
+        self.version = version_provider() if version_provider else None
+        self._embeddings = np.empty((0, 0), dtype=np.float32) # Rows beyond len(self.answers) are free capacity
+        self._expires_at = np.empty(0)
+        self._last_used = np.empty(0)
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        if self.version_provider is None:
+            return
+        version = self.version_provider()
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Normalized embeddings of the cached questions, one row per entry (a view, not a copy)."""
+        return self._embeddings[:len(self.answers)]
+
+    def _grow(self, dimensions: int):
+        """Makes room for one more row: the capacity doubles (at least 64 rows, at most max_size)."""
+        size = len(self.answers)
+        if size < self._embeddings.shape[0]:
+            return
+        capacity = min(self.max_size, max(64, 2 * size))
+        embeddings = np.empty((capacity, dimensions), dtype=np.float32)
+        embeddings[:size] = self._embeddings[:size]
+        self._embeddings = embeddings
+        self._expires_at = np.concatenate([self._expires_at[:size], np.empty(capacity - size)])
+        self._last_used = np.concatenate([self._last_used[:size], np.empty(capacity - size)])
+
+    def _remove(self, indices: np.ndarray):
+        removed = np.zeros(len(self.answers), dtype=bool)
+        removed[indices] = True
+        keep = np.flatnonzero(~removed)
+        size = len(keep)
+        self._embeddings[:size] = self._embeddings[keep]
+        self._expires_at[:size] = self._expires_at[keep]
+        self._last_used[:size] = self._last_used[keep]
+        self.questions = [self.questions[i] for i in keep]
+        self.answers = [self.answers[i] for i in keep]
+
+    def lookup(self, question: str, embedding) -> Tuple[Optional[str], np.ndarray]:
+        """Returns (cached answer or None, normalized embedding of the question). Pass the embedding to store() on a miss."""
+        embedding = self.normalize(embedding)
+        with self.lock:
+            self._check_version()
+            now = time.monotonic()
+            expired = np.flatnonzero(self._expires_at[:len(self.answers)] < now)
+            if expired.size:
+                self._remove(expired)
+            answer = None
+            if self.answers and self._embeddings.shape[1] == embedding.shape[0]:
+                similarities = self.embeddings @ embedding
+                best = int(np.argmax(similarities))
+                semantic_cache_similarity.observe(float(similarities[best]))
+                if similarities[best] >= self.threshold:
+                    self._last_used[best] = now
+                    answer = self.answers[best]
+            if answer is None:
+                self.misses += 1
+                semantic_cache_requests.inc(result="miss")
+            else:
+                self.hits += 1
+                semantic_cache_requests.inc(result="hit")
+            semantic_cache_size.set(len(self.answers))
+        return answer, embedding
+
+    def store(self, question: str, embedding: np.ndarray, answer: str):
+        """Stores an answer. Evicts the least recently used entry when the cache is full."""
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self._check_version()
+            if not self.answers or self._embeddings.shape[1] != embedding.shape[0]:
+                self.clear()
+                self._embeddings = np.empty((0, embedding.shape[0]), dtype=np.float32)
+            now = time.monotonic()
+            if len(self.answers) >= self.max_size: # Full: the least recently used entry gives up its row
+                slot = int(np.argmin(self._last_used[:len(self.answers)]))
+                self.questions[slot] = question
+                self.answers[slot] = answer
+            else:
+                self._grow(embedding.shape[0])
+                slot = len(self.answers)
+                self.questions.append(question)
+                self.answers.append(answer)
+            self._embeddings[slot] = embedding
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+            semantic_cache_size.set(len(self.answers))
+
+    def clear(self):
+        self._embeddings = np.empty((0, self._embeddings.shape[1]), dtype=np.float32)
+        self._expires_at = np.empty(0)
+        self._last_used = np.empty(0)
+        self.questions, self.answers = [], []
+        semantic_cache_size.set(0)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self.answers), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
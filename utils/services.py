@@ -0,0 +1,147 @@
+import inspect
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+from utils.metrics import metrics, span
+
+service_init_seconds = metrics.gauge("chatbot_service_init_seconds", "Seconds it took to build (and warm up) each service of the process.")
+service_ready = metrics.gauge("chatbot_service_ready", "1 once the service is built (and warmed up), 0 while it is not.")
+
+
+class LazyService:
+    """
+    Thread-safe lazy singleton. The factory runs the first time an attribute of the service is read or set, and the
+    object it returns stands behind the proxy from then on, so `from config import rag` does not build the RAG and
+    `rag.chat_completion_response(...)` builds it once (concurrent callers wait for the same build).
+
+    The proxy forwards attribute access only: pass ServiceRegistry.get(name), the object itself, to code that checks
+    types or compares it with None.
+    """
+
+    __slots__ = ("_lazy_name", "_lazy_factory", "_lazy_warm_up", "_lazy_close", "_lazy_instance", "_lazy_built", "_lazy_lock", "_lazy_seconds")
+
+    def __init__(self, name: str, factory: Callable[[], Any], warm_up: Optional[Callable[[Any], Any]] = None, close: Optional[Callable[[Any], Any]] = None):
+        object.__setattr__(self, "_lazy_name", name)
+        object.__setattr__(self, "_lazy_factory", factory)
+        object.__setattr__(self, "_lazy_warm_up", warm_up)
+        object.__setattr__(self, "_lazy_close", close)
+        object.__setattr__(self, "_lazy_instance", None)
+        object.__setattr__(self, "_lazy_built", False)
+        object.__setattr__(self, "_lazy_lock", threading.Lock())
+        object.__setattr__(self, "_lazy_seconds", None)
+
+    def _resolve(self) -> Any:
+        if not self._lazy_built:
+            with self._lazy_lock:
+                if not self._lazy_built:
+                    start = time.perf_counter()
+                    with span("service_init", self._lazy_name):
+                        instance = self._lazy_factory()
+                    object.__setattr__(self, "_lazy_instance", instance)
+                    object.__setattr__(self, "_lazy_seconds", time.perf_counter() - start)
+                    object.__setattr__(self, "_lazy_built", True)
+                    logging.info(f"Service {self._lazy_name} built in {self._lazy_seconds:.3f}s")
+        return self._lazy_instance
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._resolve(), attribute)
+
+    def __setattr__(self, attribute: str, value):
+        setattr(self._resolve(), attribute, value)
+
+    def __bool__(self) -> bool:
+        return bool(self._resolve())
+
+    def __repr__(self) -> str:
+        return f"<LazyService {self._lazy_name} {'built' if self._lazy_built else 'not built'}>"
+
+
+class ServiceRegistry:
+    """
+    The lazy services of the process (config.py registers them), with their lifecycle: warm_up() builds them in
+    parallel at startup, and aclose() closes the ones that were built (pools, executors, connections) at shutdown.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.services: Dict[str, LazyService] = {}
+        self.max_workers = max_workers
+        self.warm_seconds: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], warm_up: Optional[Callable[[Any], Any]] = None, close: Optional[Callable[[Any], Any]] = None) -> LazyService:
+        """
+        Registers a service and returns its lazy proxy.
+        :param name: Name of the service (labels its metrics and the /readyz report).
+        :param factory: Builds the service. It may get other services with get().
+        :param warm_up: Extra work done by warm_up() once the service is built, e.g. loading a model (optional).
+        :param close: Called with the service at shutdown, if it was built. It may return an awaitable (optional).
+        """
+        service = LazyService(name, factory, warm_up=warm_up, close=close)
+        self.services[name] = service
+        service_ready.set(0, service=name)
+        return service
+
+    def get(self, name: str) -> Any:
+        """The service itself (built now if it was not)."""
+        return self.services[name]._resolve()
+
+    def built(self, name: str) -> bool:
+        return self.services[name]._lazy_built
+
+    def _warm_up_one(self, name: str):
+        service = self.services[name]
+        start = time.perf_counter()
+        try:
+            instance = service._resolve()
+            if service._lazy_warm_up is not None:
+                with span("service_warm_up", name):
+                    service._lazy_warm_up(instance)
+        except Exception as e:
+            logging.error(f"Service {name} failed to warm up: {e}")
+            with self.lock:
+                self.errors[name] = str(e)
+            return
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.warm_seconds[name] = seconds
+            self.errors.pop(name, None)
+        service_init_seconds.set(seconds, service=name)
+        service_ready.set(1, service=name)
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        Builds and warms up the services (all of them by default) in parallel threads. A service that depends on
+        another waits for it, so the slowest chain sets the total time. Failures are logged and kept in `errors`;
+        the next use of the service retries the build.
+        :return: Seconds of every service that is warm.
+        """
+        names = list(names) if names is not None else list(self.services)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(names))), thread_name_prefix="warm-up") as executor:
+            list(executor.map(self._warm_up_one, names))
+        return {name: self.warm_seconds[name] for name in names if name in self.warm_seconds}
+
+    def ready(self, names: Optional[Iterable[str]] = None) -> bool:
+        """True when all the services (or the given ones) are warm."""
+        names = list(names) if names is not None else list(self.services)
+        return all(name in self.warm_seconds for name in names)
+
+    def status(self) -> Dict[str, dict]:
+        """Per service: whether it is built and warm, its warm-up seconds and its last error."""
+        return {name: {"built": service._lazy_built, "ready": name in self.warm_seconds, "seconds": self.warm_seconds.get(name), "error": self.errors.get(name)}
+                for name, service in self.services.items()}
+
+    async def aclose(self):
+        """Closes the services that were built, in reverse registration order (a service is closed before the ones it uses)."""
+        for name, service in reversed(list(self.services.items())):
+            if not service._lazy_built or service._lazy_close is None or service._lazy_instance is None:
+                continue
+            try:
+                result = service._lazy_close(service._lazy_instance)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logging.error(f"Error closing service {name}: {e}")
+            service_ready.set(0, service=name)
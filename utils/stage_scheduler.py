@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Awaitable, Dict, List
+
+
+class StageScheduler:
+    """
+    Runs independent stages of the answer pipeline concurrently.
+
+    Stages are started as soon as their inputs are known and awaited only when their result is needed.
+    Stages that are still pending when the scheduler is closed (e.g. the content filter rejected the input,
+    or an exception was raised) are cancelled and their results are thrown away.
+
+    Usage:
+        async with StageScheduler() as stages:
+            stages.start("content_filter", assistant.chat_completion_response(...))
+            stages.start("context", rag.get_context(question))
+            verdict = await stages.result("content_filter")
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def __aenter__(self) -> "StageScheduler":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.cancel_pending()
+
+    def start(self, name: str, coroutine: Awaitable) -> asyncio.Task:
+        """Schedules a stage on the running event loop."""
+        if name in self.tasks:
+            raise ValueError(f"Stage {name} has already been started.")
+        task = asyncio.ensure_future(coroutine)
+        self.tasks[name] = task
+        return task
+
+    def started(self, name: str) -> bool:
+        """Returns whether a stage with this name has been started."""
+        return name in self.tasks
+
+    async def result(self, name: str):
+        """Waits for a stage and returns its result (or raises its exception)."""
+        if name not in self.tasks:
+            raise KeyError(f"Stage {name} has not been started.")
+        return await self.tasks[name]
+
+    async def cancel_pending(self) -> List[str]:
+        """Cancels every stage that has not finished yet and waits for them. Returns the cancelled stage names."""
+        pending = {name: task for name, task in self.tasks.items() if not task.done()}
+        for task in pending.values():
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+            logging.info(f"StageScheduler: discarded pending stages {list(pending)}")
+        # Retrieve exceptions of finished stages whose result was never awaited, so they are not reported as unhandled.
+        for task in self.tasks.values():
+            if task.done() and not task.cancelled():
+                task.exception()
+        return list(pending)